@@ -72,6 +72,7 @@ notebook_params = {
     "sql_dialect": "tsql",  # Currently only 'tsql' is supported
     "request_params": json.dumps(request_params),
     "output_dir": app_configs.get("VOLUME_NAME_OUTPUT_PATH", ""),
+    "run_profile": app_configs.get("RUN_PROFILE_PATH", ""),  # Created by sql2dbx/06_calibrate_endpoint
 
     # TODO: Currently using default values for the following params; consider making them configurable.
     # "token_count_threshold": app_configs.get("MAX_TOKENS", "20000"),
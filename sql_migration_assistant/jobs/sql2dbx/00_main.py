@@ -64,10 +64,13 @@
 # MAGIC |---|---|
 # MAGIC | <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a> | Analyzes the input SQL files, calculates token counts, and saves the results to a Delta table. |
 # MAGIC | <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a> | Converts the SQL code to a Python function that runs in a Databricks notebook using an LLM and updates the result table. |
-# MAGIC | <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a> | Performs static syntax checks on Python functions and the Spark SQL contained within them, updating the result table with any errors found. |
+# MAGIC | <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a> | Performs static syntax checks on Python functions and the Spark SQL contained within them, updating the result table with any errors found. Only the files whose content changed since their last check are checked. |
 # MAGIC | <a href="$./03_02_fix_syntax_error" target="_blank">03_02_fix_syntax_error</a> | Fixes syntax errors in Python functions and SQL statements identified in the previous step using an LLM and updates the result table. |
 # MAGIC | <a href="$./04_export_to_databricks_notebooks" target="_blank">04_export_to_databricks_notebooks</a> | Exports the converted code to Databricks notebooks. |
 # MAGIC | <a href="$./05_adjust_conversion_targets" target="_blank">05_adjust_conversion_targets</a> | (Optional) Adjusts the conversion targets by setting the `is_conversion_target` field to `True` for specific files that need to be re-converted. This can be used to reprocess files that did not convert satisfactorily. |
+# MAGIC | <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a> | (Optional, not run by this notebook) Measures the endpoint throughput with a representative sample of the result table and writes a recommended run profile (`concurrency`, `max_tokens` and `timeout`) for the `run_profile` parameter. |
+# MAGIC | <a href="$./07_streaming_pipeline" target="_blank">07_streaming_pipeline</a> | (Optional, not run by this notebook) Converts, syntax-checks and fixes the conversion targets in a single streaming pipeline, where each file moves to its next step as soon as its previous step finishes. It can be used instead of 02_convert_sql_to_databricks, 03_01_static_syntax_check and 03_02_fix_syntax_error. |
+# MAGIC | <a href="$./00_main_single_session" target="_blank">00_main_single_session</a> | (Optional, alternative to this notebook) Runs steps 01 to 04 with the same parameters as this notebook in a single Python session, installing the required packages only once instead of in each notebook. |
 # MAGIC
 # MAGIC ## 🎯 Conversion Sources
 # MAGIC sql2dbx currently supports the conversion of **T-SQL** (Transact-SQL) code to Databricks notebooks. The architecture of sql2dbx allows for the addition of system prompts for other SQL dialects, expanding its capabilities to handle various SQL variants.
@@ -112,10 +115,14 @@
 # MAGIC `result_schema` | Yes | | The existing schema under the specified catalog where the result table will reside.
 # MAGIC `token_count_threshold` | Yes | `20000` | Specifies the maximum token count allowed without SQL comments for files to be included in the following conversion process.
 # MAGIC `existing_result_table` | No | | The existing result table to use for storing the analysis results. If specified, the table will be used instead of creating a new one.
+# MAGIC `file_extensions` | No | | Comma-separated file extensions to analyze (e.g., `.sql,.prc`), compared case-insensitively. Other files, such as documents in the same directory, are neither read nor converted. If unspecified, all files are analyzed.
+# MAGIC `incremental` | Yes | `False` | If `True`, a manifest of the input files is saved with the result table. When `existing_result_table` is specified in a later run, only new or changed files are analyzed and merged into it, and only those files are converted again.
 # MAGIC `endpoint_name` | Yes |  | The name of the Databricks Model Serving endpoint. You can find the endpoint name under the `Serving` tab. Example: If the endpoint URL is `https://<workspace_url>/serving-endpoints/hinak-oneenvgpt4o/invocations`, specify `hinak-oneenvgpt4o`.
 # MAGIC `sql_dialect` | Yes | `tsql` | The SQL dialect to be converted. Currently, only tsql is supported.
 # MAGIC `comment_lang` | Yes | `English` | The language for comments to be added to the converted Databricks notebooks. Options are English or Japanese.
 # MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | The extra chat HTTP request parameters in JSON format (reference: [Databricks Foundation Model APIs](https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request)).
+# MAGIC `concurrency` | Yes | `10` | The number of concurrent requests sent to the model serving endpoint, used for both conversion and syntax error fixing.
+# MAGIC `run_profile` | No | | The path of a run profile JSON file created by <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a>. If specified, its `concurrency`, `timeout` and `max_tokens` override `concurrency` and `max_tokens` in `request_params`.
 # MAGIC `max_fix_attempts` | Yes | `1` | The maximum number of attempts to automatically fix syntax errors in the conversion results.
 # MAGIC `output_dir` | Yes | The directory where Databricks notebooks are saved. Supports the path in Workspace or Repos.
 # MAGIC
@@ -148,12 +155,14 @@
 # MAGIC | `input_file_number` | int | A unique integer identifier for each input file. The numbering starts from `1`. |
 # MAGIC | `input_file_path` | string | The full path to the input file. |
 # MAGIC | `input_file_encoding` | string | The detected encoding of the input file (e.g., `UTF-8`). |
+# MAGIC | `input_file_encoding_confidence` | double | The confidence of the encoding detection, from `0.0` to `1.0`. `1.0` for byte order marks, valid UTF-8 and explicitly specified encodings. |
 # MAGIC | `tiktoken_encoding` | string | The encoding used for tokenization in LLMs (e.g., `o200k_base`). |
-# MAGIC | `input_file_token_count` | int | The total number of tokens in the input file. |
+# MAGIC | `input_file_token_count` | int | The total number of tokens in the input file. Empty for SQL files if `count_raw_tokens` of 01_analyze_input_files is `False`. |
 # MAGIC | `input_file_token_count_without_sql_comments` | int | The number of tokens in the input file excluding SQL comments. |
 # MAGIC | `input_file_content` | string | The entire content of the input file. |
 # MAGIC | `input_file_content_without_sql_comments` | string | The content of the input file excluding SQL comments. |
 # MAGIC | `is_conversion_target` | boolean | Indicates whether the file is a conversion target (True or False). This is determined in `01_analyze_input_files` based on a comparison between the token count of the input file (excluding SQL comments) and the `token_count_threshold`. It is automatically updated from `True` to `False` once the conversion process is successfully completed. |
+# MAGIC | `similarity_cluster_id` | int | The `input_file_number` of the first file in a cluster of near-duplicate files, such as procedures that differ only in table or column names or literals. Files without similar files have their own number. In `02_convert_sql_to_databricks`, the first conversion target of each cluster is converted first and used as the example for the others. |
 # MAGIC | `model_serving_endpoint_for_conversion` | string | The model serving endpoint for the conversion process. |
 # MAGIC | `model_serving_endpoint_for_fix` | string | The model serving endpoint for syntax error fixing. |
 # MAGIC | `result_content` | string | The converted content of the file after processing. (Initially `null`) |
@@ -163,6 +172,8 @@
 # MAGIC | `result_python_parse_error` | string | Any errors encountered during the Python function syntax check using `ast.parse`. |
 # MAGIC | `result_extracted_sqls` | array<string> | The list of SQL statements extracted from the Python function.  (Initially `null`) |
 # MAGIC | `result_sql_parse_errors` | array<string> | Any errors encountered during the SQL syntax check using `spark._jsparkSession.sessionState().sqlParser().parsePlan()`. (Initially `null`) |
+# MAGIC | `result_content_hash` | string | The SHA-256 hash of `result_content`, updated whenever `result_content` is updated. (Initially `null`) |
+# MAGIC | `checked_hash` | string | The `result_content_hash` of the content that the syntax check results are for. `03_01_static_syntax_check` only checks the rows whose `result_content_hash` differs from it. (Initially `null`) |
 # MAGIC
 # MAGIC ## 🔄 How to Re-convert Specific Files
 # MAGIC If the conversion result is not satisfactory, you can re-convert specific files by following these steps:
@@ -195,12 +206,16 @@ dbutils.widgets.text("result_catalog", "", "Result Catalog")
 dbutils.widgets.text("result_schema", "", "Result Schema")
 dbutils.widgets.text("token_count_threshold", "20000", "Token Count Threshold")
 dbutils.widgets.text("existing_result_table", "", "Existing Result Table (Optional)")
+dbutils.widgets.text("file_extensions", "", "File Extensions (Optional)")
+dbutils.widgets.dropdown("incremental", "False", ["True", "False"], "Incremental Analysis")
 
 # Params for 02_convert_sql_to_databricks
 dbutils.widgets.text("endpoint_name", "", "Serving Endpoint Name")
 dbutils.widgets.dropdown("sql_dialect", "tsql", ["tsql"], "SQL Dialect")
 dbutils.widgets.dropdown("comment_lang", "English", ["English", "Japanese"], "Comment Language")
 dbutils.widgets.text("request_params", '{"max_tokens": 4000, "temperature": 0}', "Chat Request Params")
+dbutils.widgets.text("concurrency", "10", "Concurrency Requests")
+dbutils.widgets.text("run_profile", "", "Run Profile Path (Optional)")
 
 # Params for 03_syntax_check_and_fix
 dbutils.widgets.text("max_fix_attempts", "1", "Maximum Fix Attempts")
@@ -216,14 +231,18 @@ result_catalog = dbutils.widgets.get("result_catalog")
 result_schema = dbutils.widgets.get("result_schema")
 token_count_threshold = int(dbutils.widgets.get("token_count_threshold"))
 existing_result_table = dbutils.widgets.get("existing_result_table")
+file_extensions = dbutils.widgets.get("file_extensions")
+incremental = dbutils.widgets.get("incremental")
 endpoint_name = dbutils.widgets.get("endpoint_name")
 sql_dialect = dbutils.widgets.get("sql_dialect")
 comment_lang = dbutils.widgets.get("comment_lang")
 request_params = dbutils.widgets.get("request_params")
+concurrency = int(dbutils.widgets.get("concurrency"))
+run_profile = dbutils.widgets.get("run_profile")
 max_fix_attempts = int(dbutils.widgets.get("max_fix_attempts"))
 output_dir = dbutils.widgets.get("output_dir")
 
-input_dir, result_catalog, result_schema, token_count_threshold, existing_result_table, endpoint_name, sql_dialect, comment_lang, request_params, max_fix_attempts, output_dir
+input_dir, result_catalog, result_schema, token_count_threshold, existing_result_table, file_extensions, incremental, endpoint_name, sql_dialect, comment_lang, request_params, concurrency, run_profile, max_fix_attempts, output_dir
 
 # COMMAND ----------
 
@@ -240,6 +259,8 @@ result_table = dbutils.notebook.run("01_analyze_input_files", 0, {
     "result_schema": result_schema,
     "token_count_threshold": token_count_threshold,
     "existing_result_table": existing_result_table,
+    "file_extensions": file_extensions,
+    "incremental": incremental,
 })
 print(f"Conversion result table: {result_table}")
 
@@ -258,6 +279,8 @@ dbutils.notebook.run("02_convert_sql_to_databricks", 0, {
     "sql_dialect": sql_dialect,
     "comment_lang": comment_lang,
     "request_params": request_params,
+    "concurrency": concurrency,
+    "run_profile": run_profile,
 })
 
 # COMMAND ----------
@@ -301,6 +324,8 @@ for attempt in range(max_fix_attempts):
         "endpoint_name": endpoint_name,
         "result_table": result_table,
         "request_params": request_params,
+        "concurrency": concurrency,
+        "run_profile": run_profile,
     })
 
 # COMMAND ----------
@@ -64,10 +64,13 @@
 # MAGIC |---|---|
 # MAGIC | <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a> | 入力SQLファイルの分析とトークン数の計算を行い、結果をDeltaテーブルに保存します。 |
 # MAGIC | <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a> | LLMを使用してSQLコードをDatabricksノートブックで実行可能なPython関数に変換し、結果テーブルを更新します。 |
-# MAGIC | <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a> | Python関数とその中のSpark SQLの静的構文チェックを行い、検出されたエラーを結果テーブルに更新します。 |
+# MAGIC | <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a> | Python関数とその中のSpark SQLの静的構文チェックを行い、検出されたエラーを結果テーブルに更新します。前回のチェック以降に内容が変更されたファイルのみがチェックされます。 |
 # MAGIC | <a href="$./03_02_fix_syntax_error" target="_blank">03_02_fix_syntax_error</a> | 前のステップで検出されたPython関数とSQL文の構文エラーをLLMを使用して修正し、結果テーブルを更新します。 |
 # MAGIC | <a href="$./04_export_to_databricks_notebooks" target="_blank">04_export_to_databricks_notebooks</a> | 変換されたコードをDatabricksノートブックにエクスポートします。 |
 # MAGIC | <a href="$./05_adjust_conversion_targets" target="_blank">05_adjust_conversion_targets</a> | （オプション）再変換が必要な特定のファイルの`is_conversion_target`フィールドを`True`に設定することで、変換対象を調整します。これは、満足に変換されなかったファイルを再処理するために使用できます。 |
+# MAGIC | <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a> | （オプション、メインノートブックからは実行されません）結果テーブルの代表的なサンプルを使ってエンドポイントのスループットを計測し、推奨の実行プロファイル（`concurrency`、`max_tokens`、`timeout`）を`run_profile`パラメーター用に出力します。 |
+# MAGIC | <a href="$./07_streaming_pipeline" target="_blank">07_streaming_pipeline</a> | （オプション、メインノートブックからは実行されません）変換対象のファイルの変換、構文チェック、構文エラーの修正を1つのストリーミングパイプラインで実行します。各ファイルは前のステップが終わり次第、次のステップに進みます。02_convert_sql_to_databricks、03_01_static_syntax_check、03_02_fix_syntax_errorの代わりに使用できます。 |
+# MAGIC | <a href="$./00_main_single_session" target="_blank">00_main_single_session</a> | （オプション、このノートブックの代替）このノートブックと同じパラメーターで01から04までのステップを1つのPythonセッションで実行します。必要なパッケージは各ノートブックではなく一度だけインストールされます。 |
 # MAGIC
 # MAGIC ## 🎯 変換対象
 # MAGIC 現在、sql2dbxは**T-SQL**（Transact-SQL）コードからDatabricksノートブックへの変換をサポートしています。sql2dbxはLLMを用いて変換を行うため、システムプロンプトを追加することで、様々なSQL方言に対応できます。
@@ -110,10 +113,14 @@
 # MAGIC `result_schema` | Yes | | 指定された既存のカタログ内の、結果テーブルが配置される既存のスキーマ。
 # MAGIC `token_count_threshold` | Yes | `20000` | 変換プロセスに含める対象となるファイルの、SQLコメントを除いた最大トークン数。
 # MAGIC `existing_result_table` | No | | 分析結果の保存に使用する既存の結果テーブル。指定された場合、新しいテーブルを作成する代わりにこのテーブルが使用されます。
+# MAGIC `file_extensions` | No | | 分析対象とするファイル拡張子のカンマ区切りリスト（例：`.sql,.prc`）。大文字と小文字は区別されません。同じディレクトリにあるドキュメントなどのその他のファイルは読み込まれず、変換もされません。指定しない場合はすべてのファイルが分析されます。
+# MAGIC `incremental` | Yes | `False` | `True`の場合、入力ファイルのマニフェストを結果テーブルと一緒に保存します。以降の実行で`existing_result_table`を指定すると、新規または変更されたファイルのみが分析されて既存テーブルにマージされ、それらのファイルのみが再変換されます。
 # MAGIC `endpoint_name` | Yes | | Databricksモデルサービングエンドポイントの名前。
 # MAGIC `sql_dialect` | Yes | `tsql` | SQL方言。現在はtsqlのみサポート。
 # MAGIC `comment_lang` | Yes | `English` | 変換したDatabricksノートブックに付与するコメントの言語。英語または日本語から選択。
 # MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | JSON形式の追加チャットHTTPリクエストパラメータ（参照：[Databricks Foundation Model APIs](https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request)）。
+# MAGIC `concurrency` | Yes | `10` | モデルサービングエンドポイントに送信する同時リクエスト数。変換と構文エラー修正の両方で使用されます。
+# MAGIC `run_profile` | No | | <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a>で作成した実行プロファイル（JSONファイル）のパス。指定された場合、プロファイルの`concurrency`、`timeout`、`max_tokens`が`concurrency`および`request_params`の`max_tokens`より優先されます。
 # MAGIC `max_fix_attempts` | Yes | `1` | 変換結果の構文エラーを自動修正する最大試行回数。
 # MAGIC `output_dir` | Yes | | Databricksノートブックを保存するディレクトリ。WorkspaceまたはRepos内のパスをサポート。
 # MAGIC
@@ -146,12 +153,14 @@
 # MAGIC | `input_file_number` | int | 各入力ファイルの一意の整数識別子。番号付けは`1`から始まります。 |
 # MAGIC | `input_file_path` | string | 入力ファイルへのフルパス。 |
 # MAGIC | `input_file_encoding` | string | 検出された入力ファイルのエンコーディング（例：`UTF-8`）。 |
+# MAGIC | `input_file_encoding_confidence` | double | エンコーディング検出の確信度（`0.0`〜`1.0`）。BOM、正しいUTF-8、明示的に指定されたエンコーディングの場合は`1.0`。 |
 # MAGIC | `tiktoken_encoding` | string | LLMでのトークン化に使用されるエンコーディング（例：`o200k_base`）。 |
-# MAGIC | `input_file_token_count` | int | 入力ファイルの総トークン数。 |
+# MAGIC | `input_file_token_count` | int | 入力ファイルの総トークン数。01_analyze_input_filesの`count_raw_tokens`が`False`の場合、SQLファイルでは空になります。 |
 # MAGIC | `input_file_token_count_without_sql_comments` | int | SQLコメントを除いた入力ファイルのトークン数。 |
 # MAGIC | `input_file_content` | string | 入力ファイルの全内容。 |
 # MAGIC | `input_file_content_without_sql_comments` | string | SQLコメントを除いた入力ファイルの内容。 |
 # MAGIC | `is_conversion_target` | boolean | ファイルが変換対象かどうか（TrueまたはFalse）。`01_analyze_input_files`においてSQLコメントを除いた入力ファイルのトークン数と`token_count_threshold`との比較に基づいて決定されます。変換処理が正常に終了したら自動的に`True`から`False`に更新されます。 |
+# MAGIC | `similarity_cluster_id` | int | テーブル名・列名やリテラルのみが異なるプロシージャなど、ほぼ重複するファイルのクラスタ内で最初のファイルの`input_file_number`。類似ファイルがないファイルは自身の番号になります。`02_convert_sql_to_databricks`では、各クラスタの最初の変換対象が先に変換され、他のファイルの例として使用されます。 |
 # MAGIC | `model_serving_endpoint_for_conversion` | string | 変換処理に使用したモデルサービングエンドポイントの名前。 |
 # MAGIC | `model_serving_endpoint_for_fix` | string | 構文エラー修正に使用したモデルサービングエンドポイントの名前。 |
 # MAGIC | `result_content` | string | 処理後のファイルの変換内容。（初期値は`null`） |
@@ -161,6 +170,8 @@
 # MAGIC | `result_python_parse_error` | string | `ast.parse`を使用したPython関数の構文チェック中に遭遇したエラー。 |
 # MAGIC | `result_extracted_sqls` | array<string> | Python関数から抽出されたSQLステートメントのリスト。（初期値は`null`） |
 # MAGIC | `result_sql_parse_errors` | array<string> | `spark._jsparkSession.sessionState().sqlParser().parsePlan()`を使用したSQL構文チェック中に遭遇したエラー。（初期値は`null`） |
+# MAGIC | `result_content_hash` | string | `result_content`のSHA-256ハッシュ。`result_content`が更新されるたびに更新されます。（初期値は`null`） |
+# MAGIC | `checked_hash` | string | 構文チェック結果の対象となった内容の`result_content_hash`。`03_01_static_syntax_check`は`result_content_hash`がこれと異なる行のみをチェックします。（初期値は`null`） |
 # MAGIC
 # MAGIC ## 🔄 特定のファイルを再変換する方法
 # MAGIC 変換結果に不満がある場合、以下の手順で特定のファイルを再変換できます：
@@ -193,12 +204,16 @@ dbutils.widgets.text("result_catalog", "", "結果カタログ")
 dbutils.widgets.text("result_schema", "", "結果スキーマ")
 dbutils.widgets.text("token_count_threshold", "20000", "入力トークン数の閾値")
 dbutils.widgets.text("existing_result_table", "", "既存の結果テーブル（任意）")
+dbutils.widgets.text("file_extensions", "", "ファイル拡張子（任意）")
+dbutils.widgets.dropdown("incremental", "False", ["True", "False"], "増分分析")
 
 # 02_convert_sql_to_databricks用のパラメータ
 dbutils.widgets.text("endpoint_name", "", "サービングエンドポイント名")
 dbutils.widgets.dropdown("sql_dialect", "tsql", ["tsql"], "SQL方言")
 dbutils.widgets.dropdown("comment_lang", "English", ["English", "Japanese"], "コメント言語")
 dbutils.widgets.text("request_params", '{"max_tokens": 4000, "temperature": 0}', "チャットリクエストパラメータ")
+dbutils.widgets.text("concurrency", "10", "同時リクエスト数")
+dbutils.widgets.text("run_profile", "", "実行プロファイルのパス（任意）")
 
 # 03_syntax_check_and_fix用のパラメータ
 dbutils.widgets.text("max_fix_attempts", "1", "最大修正試行回数")
@@ -214,14 +229,18 @@ result_catalog = dbutils.widgets.get("result_catalog")
 result_schema = dbutils.widgets.get("result_schema")
 token_count_threshold = int(dbutils.widgets.get("token_count_threshold"))
 existing_result_table = dbutils.widgets.get("existing_result_table")
+file_extensions = dbutils.widgets.get("file_extensions")
+incremental = dbutils.widgets.get("incremental")
 endpoint_name = dbutils.widgets.get("endpoint_name")
 sql_dialect = dbutils.widgets.get("sql_dialect")
 comment_lang = dbutils.widgets.get("comment_lang")
 request_params = dbutils.widgets.get("request_params")
+concurrency = int(dbutils.widgets.get("concurrency"))
+run_profile = dbutils.widgets.get("run_profile")
 max_fix_attempts = int(dbutils.widgets.get("max_fix_attempts"))
 output_dir = dbutils.widgets.get("output_dir")
 
-input_dir, result_catalog, result_schema, token_count_threshold, existing_result_table, endpoint_name, sql_dialect, comment_lang, request_params, max_fix_attempts, output_dir
+input_dir, result_catalog, result_schema, token_count_threshold, existing_result_table, file_extensions, incremental, endpoint_name, sql_dialect, comment_lang, request_params, concurrency, run_profile, max_fix_attempts, output_dir
 
 # COMMAND ----------
 
@@ -238,6 +257,8 @@ result_table = dbutils.notebook.run("01_analyze_input_files", 0, {
     "result_schema": result_schema,
     "token_count_threshold": token_count_threshold,
     "existing_result_table": existing_result_table,
+    "file_extensions": file_extensions,
+    "incremental": incremental,
 })
 print(f"Conversion result table: {result_table}")
 
@@ -256,6 +277,8 @@ dbutils.notebook.run("02_convert_sql_to_databricks", 0, {
     "sql_dialect": sql_dialect,
     "comment_lang": comment_lang,
     "request_params": request_params,
+    "concurrency": concurrency,
+    "run_profile": run_profile,
 })
 
 # COMMAND ----------
@@ -299,6 +322,8 @@ for attempt in range(max_fix_attempts):
         "endpoint_name": endpoint_name,
         "result_table": result_table,
         "request_params": request_params,
+        "concurrency": concurrency,
+        "run_profile": run_profile,
     })
 
 # COMMAND ----------
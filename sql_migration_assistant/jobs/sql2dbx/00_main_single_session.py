@@ -0,0 +1,222 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # sql2dbx (single session)
+# MAGIC This notebook runs the same conversion process as <a href="$./00_main" target="_blank">00_main</a>, but in a single Python session. <a href="$./00_main" target="_blank">00_main</a> runs each step as a separate notebook with `dbutils.notebook.run`, so every step installs the packages in `requirements.txt`, restarts Python and loads the tokenizer again. This notebook installs the packages once and calls the step logic implemented in `scripts/stages` directly, so the steps share the warmed-up session.
+# MAGIC
+# MAGIC The individual notebooks (01 to 05) are thin wrappers around the same functions, so both entry points produce the same result table and notebooks.
+# MAGIC
+# MAGIC ## 🔌 Parameters
+# MAGIC The parameters are the same as <a href="$./00_main" target="_blank">00_main</a>. See its parameter table for their details.
+# MAGIC
+# MAGIC Parameter Name | Required | Default Value | Description
+# MAGIC --- | --- | --- | ---
+# MAGIC `input_dir` | Yes | | The directory containing the SQL files to be converted.
+# MAGIC `result_catalog` | Yes | | The existing catalog where the result table will be stored.
+# MAGIC `result_schema` | Yes | | The existing schema under the specified catalog where the result table will reside.
+# MAGIC `token_count_threshold` | Yes | `20000` | Specifies the maximum token count allowed without SQL comments for files to be included in the following conversion process.
+# MAGIC `existing_result_table` | No | | The existing result table to use for storing the analysis results.
+# MAGIC `file_extensions` | No | | Comma-separated file extensions to analyze (e.g., `.sql,.prc`).
+# MAGIC `incremental` | Yes | `False` | If `True`, only new or changed files are analyzed and converted again in a later run with `existing_result_table`.
+# MAGIC `endpoint_name` | Yes |  | The name of the Databricks Model Serving endpoint.
+# MAGIC `sql_dialect` | Yes | `tsql` | The SQL dialect to be converted. Currently, only tsql is supported.
+# MAGIC `comment_lang` | Yes | `English` | The language for comments to be added to the converted Databricks notebooks. Options are English or Japanese.
+# MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | The extra chat HTTP request parameters in JSON format.
+# MAGIC `concurrency` | Yes | `10` | The number of concurrent requests sent to the model serving endpoint, used for both conversion and syntax error fixing.
+# MAGIC `run_profile` | No | | The path of a run profile JSON file created by <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a>.
+# MAGIC `max_fix_attempts` | Yes | `1` | The maximum number of attempts to automatically fix syntax errors in the conversion results.
+# MAGIC `output_dir` | Yes | | The directory where Databricks notebooks are saved. Supports the path in Workspace or Repos.
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Install and import libraries
+# MAGIC The packages of all steps are installed once here.
+
+# COMMAND ----------
+
+# DBTITLE 1,Install Packages
+# MAGIC %pip install -r requirements.txt
+# MAGIC %pip install databricks-sdk --upgrade
+# MAGIC dbutils.library.restartPython()
+
+# COMMAND ----------
+
+# DBTITLE 1,Import Libraries
+import json
+
+import pandas as pd
+from pyspark.sql.functions import col
+
+from scripts import utils
+from scripts.stages.analyze import AnalysisConfig, analyze_input_files
+from scripts.stages.convert import (ConversionConfig,
+                                    convert_sql_to_databricks, create_prompts)
+from scripts.stages.endpoint_config import EndpointConfig
+from scripts.stages.export import export_notebooks
+from scripts.stages.fix import fix_syntax_errors
+from scripts.stages.syntax_check import (count_syntax_error_files,
+                                         run_static_syntax_check)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## 0. Set Up Configuration Parameters
+
+# COMMAND ----------
+
+# DBTITLE 1,Configurations
+# Params for 01_analyze_input_files
+dbutils.widgets.text("input_dir", "", "Input Directory")
+dbutils.widgets.text("result_catalog", "", "Result Catalog")
+dbutils.widgets.text("result_schema", "", "Result Schema")
+dbutils.widgets.text("token_count_threshold", "20000", "Token Count Threshold")
+dbutils.widgets.text("existing_result_table", "", "Existing Result Table (Optional)")
+dbutils.widgets.text("file_extensions", "", "File Extensions (Optional)")
+dbutils.widgets.dropdown("incremental", "False", ["True", "False"], "Incremental Analysis")
+
+# Params for 02_convert_sql_to_databricks
+dbutils.widgets.text("endpoint_name", "", "Serving Endpoint Name")
+dbutils.widgets.dropdown("sql_dialect", "tsql", ["tsql"], "SQL Dialect")
+dbutils.widgets.dropdown("comment_lang", "English", ["English", "Japanese"], "Comment Language")
+dbutils.widgets.text("request_params", '{"max_tokens": 4000, "temperature": 0}', "Chat Request Params")
+dbutils.widgets.text("concurrency", "10", "Concurrency Requests")
+dbutils.widgets.text("run_profile", "", "Run Profile Path (Optional)")
+
+# Params for 03_syntax_check_and_fix
+dbutils.widgets.text("max_fix_attempts", "1", "Maximum Fix Attempts")
+
+# Params for 04_export_to_databricks_notebooks
+dbutils.widgets.text("output_dir", "", "Output Directory")
+
+# COMMAND ----------
+
+# DBTITLE 1,Load Configurations
+analysis_config = AnalysisConfig(
+    input_dir=dbutils.widgets.get("input_dir"),
+    result_catalog=dbutils.widgets.get("result_catalog"),
+    result_schema=dbutils.widgets.get("result_schema"),
+    file_filter=utils.FileFilter(
+        extensions=utils.parse_comma_separated(dbutils.widgets.get("file_extensions")),
+    ),
+    token_count_threshold=int(dbutils.widgets.get("token_count_threshold")),
+    existing_result_table=dbutils.widgets.get("existing_result_table"),
+    incremental=dbutils.widgets.get("incremental") == "True",
+)
+
+# The run profile is applied once and shared by the conversion and fix steps
+endpoint = EndpointConfig(
+    endpoint_name=dbutils.widgets.get("endpoint_name"),
+    request_params=json.loads(dbutils.widgets.get("request_params")),
+    concurrency=int(dbutils.widgets.get("concurrency")),
+    run_profile=dbutils.widgets.get("run_profile") or None,
+)
+endpoint.apply_run_profile()
+
+sql_dialect = dbutils.widgets.get("sql_dialect")
+comment_lang = dbutils.widgets.get("comment_lang")
+max_fix_attempts = int(dbutils.widgets.get("max_fix_attempts"))
+output_dir = dbutils.widgets.get("output_dir")
+
+analysis_config, endpoint, sql_dialect, comment_lang, max_fix_attempts, output_dir
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## 1. Analyze Input Files
+# MAGIC Analyzes the input SQL files, calculates token counts, and saves the results to a Delta table.
+
+# COMMAND ----------
+
+# DBTITLE 1,Analyze Input Files
+result_table = analyze_input_files(spark, analysis_config)
+print(f"Conversion result table: {result_table}")
+
+# COMMAND ----------
+
+# DBTITLE 1,Warning for Token Count Threshold
+warning_df = spark.table(result_table).filter(col("is_conversion_target") == False)
+if warning_df.count() > 0:
+    print(f"Warning: The following files do not meet the token count threshold of "
+          f"{analysis_config.token_count_threshold} and are excluded from conversion process.")
+    display(warning_df)
+else:
+    print("No issues found. All files meet the token count threshold.")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## 2. Convert SQL to Databricks
+# MAGIC Converts the SQL code to a Python function that runs in a Databricks notebook using an LLM and updates the result table.
+
+# COMMAND ----------
+
+# DBTITLE 1,Convert SQL to Databricks Notebooks
+conversion_config = ConversionConfig(
+    result_table=result_table,
+    endpoint=endpoint,
+    sql_dialect=sql_dialect,
+    comment_lang=comment_lang,
+    token_encoding=analysis_config.token_encoding,
+)
+conversion_result = await convert_sql_to_databricks(spark, conversion_config, create_prompts(conversion_config))
+print(f"Converted {len(conversion_result.responses)} files.")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## 3. Syntax Check and Fix
+# MAGIC Performs static syntax checks on Python functions and the Spark SQL contained within them, and attempts to fix any errors found.
+
+# COMMAND ----------
+
+# DBTITLE 1,Check and Fix Syntax Errors
+for attempt in range(max_fix_attempts):
+    # Run static syntax check
+    print(f"Attempt {attempt + 1} of {max_fix_attempts}")
+    run_static_syntax_check(spark, result_table)
+
+    # Check if there are any errors
+    error_count = count_syntax_error_files(spark, result_table)
+    if error_count == 0:
+        print("No syntax errors found. Exiting fix loop.")
+        break
+
+    # Run fix syntax error
+    print(f"Found {error_count} files with syntax errors. Attempting to fix...")
+    await fix_syntax_errors(spark, result_table, endpoint)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Final Syntax Check
+# MAGIC Performs a final static syntax check after all fix attempts.
+
+# COMMAND ----------
+
+# DBTITLE 1,Run Final Syntax Check
+run_static_syntax_check(spark, result_table)
+error_count = count_syntax_error_files(spark, result_table)
+print(f"Found {error_count} files with syntax errors.")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## 4. Export to Databricks Notebooks
+# MAGIC Exports the converted code to Databricks notebooks.
+
+# COMMAND ----------
+
+# DBTITLE 1,Export to Databricks Notebooks
+export_results = export_notebooks(spark, result_table, output_dir)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Display Export Results
+# MAGIC Pay special attention to notebooks where `parse_error_count` is greater equal to `1`. These notebooks may require manual corrections.
+
+# COMMAND ----------
+
+# DBTITLE 1,Display Export Results
+export_results_df = pd.DataFrame(export_results)
+display(export_results_df)
@@ -6,9 +6,12 @@
 # MAGIC ## Task Overview
 # MAGIC The following tasks are accomplished in this notebook:
 # MAGIC
-# MAGIC 1. **Directory Scanning**: The specified directory is scanned for files, and each file is prepared for analysis.
+# MAGIC 1. **Directory Scanning**: The specified directory is scanned for files, and each file is prepared for analysis. Files can be selected with include and exclude glob patterns, file extensions and a maximum directory depth. With `analysis_mode` set to `spark`, files are read with Spark's `binaryFile` data source and analyzed on the executors instead of the driver.
 # MAGIC 2. **Tokenization**: Files are tokenized using the specified encoding to count the tokens effectively.
-# MAGIC 3. **Result Compilation and Saving**: The token counts, along with file metadata, are compiled into a structured format. Files exceeding a predefined token threshold are filtered out. The results are saved to a Delta Lake table for further analysis or reference.
+# MAGIC 3. **Result Compilation and Saving**: The token counts, along with file metadata, are compiled into a structured format. Files exceeding a predefined token threshold are filtered out. The results are saved to a Delta Lake table for further analysis or reference. In `driver` mode, the results are appended to the table in Arrow record batches of bounded size, so the driver's memory does not grow with the number of files.
+# MAGIC 4. **Near-Duplicate Detection**: Files that differ only in names or literals, such as procedures generated from a template, are clustered with MinHash signatures and locality-sensitive hashing (LSH). The clusters are saved to the result table as `similarity_cluster_id`, so that the conversion can use one converted file of a cluster as the example for the others.
+# MAGIC
+# MAGIC With `incremental` set to `True`, a manifest of the path, size, modification time and content hash of each file is saved next to the result table. When `existing_result_table` is specified in a later run, only new or changed files are read and tokenized, and they are merged into the existing table. Conversion results of unchanged files are kept.
 
 # COMMAND ----------
 
@@ -24,14 +27,10 @@
 # COMMAND ----------
 
 # DBTITLE 1,Import Libraries
-from datetime import datetime, timezone
-
-from pyspark.sql.functions import col, lit, when
-from pyspark.sql.types import (ArrayType, IntegerType, StringType, StructField,
-                               StructType, TimestampType)
-from pyspark.sql.utils import AnalysisException
+from pyspark.sql.functions import col
 
-from scripts.llm_token_count_helper import FileTokenCountHelper
+from scripts import utils
+from scripts.stages.analyze import AnalysisConfig, analyze_input_files
 
 # COMMAND ----------
 
@@ -48,11 +47,23 @@ dbutils.widgets.text("result_schema", "", "Result Schema")
 
 # Optional Parameters
 dbutils.widgets.text("token_encoding", "o200k_base", "Token Encoding for LLM")
+dbutils.widgets.text("tokenizer_cache_dir", "", "Tokenizer Cache Directory (Optional)")
 dbutils.widgets.text("file_encoding", "", "File Encoding (Optional)")
+dbutils.widgets.text("include_patterns", "", "Include Patterns (Optional)")
+dbutils.widgets.text("exclude_patterns", "", "Exclude Patterns (Optional)")
+dbutils.widgets.text("file_extensions", "", "File Extensions (Optional)")
+dbutils.widgets.text("max_depth", "", "Max Directory Depth (Optional)")
 dbutils.widgets.dropdown("is_sql", "True", ["True", "False"], "Is SQL files or not")
 dbutils.widgets.text("token_count_threshold", "20000", "Token Count Threshold")
 dbutils.widgets.text("result_table_prefix", "conversion_targets", "Result Table Prefix")
 dbutils.widgets.text("existing_result_table", "", "Existing Result Table (Optional)")
+dbutils.widgets.text("max_workers", "0", "Max Worker Processes")
+dbutils.widgets.dropdown("count_raw_tokens", "True", ["True", "False"], "Count Tokens with SQL Comments")
+dbutils.widgets.dropdown("token_count_mode", "exact", ["exact", "approximate"], "Token Count Mode")
+dbutils.widgets.dropdown("recount_near_threshold", "True", ["True", "False"], "Recount Files near Threshold")
+dbutils.widgets.dropdown("analysis_mode", "driver", ["driver", "spark"], "Analysis Mode")
+dbutils.widgets.dropdown("incremental", "False", ["True", "False"], "Incremental Analysis")
+dbutils.widgets.text("similarity_threshold", "0.8", "Similarity Threshold for Near-Duplicates")
 
 # COMMAND ----------
 
@@ -60,100 +71,73 @@ dbutils.widgets.text("existing_result_table", "", "Existing Result Table (Option
 # MAGIC ## Parameters
 # MAGIC Parameter Name | Required | Default Value | Description
 # MAGIC --- | --- | --- | ---
-# MAGIC `input_dir` | Yes | | The directory containing the files for analysis. Supports locations accessible through Python `os` module (e.g., Unity Catalog Volume, Workspace, Repos, etc.).
+# MAGIC `input_dir` | Yes | | The directory containing the files for analysis. Supports locations accessible through Python `os` module (e.g., Unity Catalog Volume, Workspace, Repos, etc.). A zip or tar archive (`.zip`, `.tar`, `.tar.gz`, `.tgz`, `.tar.bz2`, `.tar.xz`) can also be specified. Its files are streamed without extracting the archive, and their paths within the archive are stored as `input_file_path`. Archives are always analyzed in `driver` mode and cannot be used with `incremental`.
 # MAGIC `result_catalog` | Yes | | The existing catalog where the result table will be stored.
 # MAGIC `result_schema` | Yes | | The existing schema under the specified catalog where the result table will reside.
-# MAGIC `token_encoding` | Yes | `o200k_base` | The encoding used for tokenization in LLMs. Default value `o200k_base` is compatible with gpt-4o.
-# MAGIC `file_encoding` | No | | The encoding used for reading files. If unspecified, the notebook will attempt to detect the encoding automatically.
+# MAGIC `token_encoding` | Yes | `o200k_base` | The encoding used for tokenization in LLMs. Default value `o200k_base` is compatible with gpt-4o. A model name such as `gpt-4o` or `databricks-dbrx-instruct` can also be specified.
+# MAGIC `tokenizer_cache_dir` | No | | A directory with cached tokenizer files (e.g., `/Volumes/my_catalog/my_schema/my_volume/tiktoken_cache`), used instead of downloading them. Required on clusters without internet access. Run this notebook once on a cluster with internet access with the same directory to populate it. No tokenizer files are bundled with sql2dbx.
+# MAGIC `file_encoding` | No | | The encoding used for reading files. If unspecified, the notebook will attempt to detect the encoding automatically: byte order marks are checked first, then strict UTF-8 validation, then the encoding previously detected in the same directory, and finally `chardet` on a bounded sample of the file. The detection confidence is stored in `input_file_encoding_confidence`.
+# MAGIC `include_patterns` | No | | Comma-separated glob patterns (e.g., `procs/*,*.ddl`) matched against the path of each file relative to `input_dir`, with `/` as the separator. `*` also matches `/`. If specified, only files matching one of the patterns are analyzed.
+# MAGIC `exclude_patterns` | No | | Comma-separated glob patterns of files to skip, matched in the same way as `include_patterns`. A pattern ending with `/*` (e.g., `backup/*`) also skips scanning the directory.
+# MAGIC `file_extensions` | No | | Comma-separated file extensions to analyze (e.g., `.sql,.prc`), compared case-insensitively. If unspecified, files with any extension are analyzed.
+# MAGIC `max_depth` | No | | The maximum number of directory levels below `input_dir` to scan. `0` analyzes only the files directly in `input_dir`. If unspecified, all levels are scanned.
 # MAGIC `is_sql` | Yes | `True` | Indicates whether the files in the directory are SQL files. If `True`, contents without SQL comments and token count will be added to the result; if `False`, these will be `None`.
 # MAGIC `token_count_threshold` | Yes | `20000` | Specifies the maximum token count allowed without SQL comments for files to be included in the following conversion process.
 # MAGIC `result_table_prefix` | Yes | `conversion_targets` | The prefix for the result table name where the results will be stored.
-# MAGIC `existing_result_table` | No | | An optional parameter for subsequent runs. If this table exists, the notebook's processing will be skipped and the value of this parameter will be returned as output of this notebook.
+# MAGIC `existing_result_table` | No | | An optional parameter for subsequent runs. If this table exists, the notebook's processing will be skipped and the value of this parameter will be returned as output of this notebook. With `incremental` set to `True`, new and changed files are merged into this table instead.
+# MAGIC `max_workers` | Yes | `0` | The number of driver processes used to read and tokenize files. `0` uses all CPU cores of the driver; `1` processes files one at a time in the notebook process. Used only when `analysis_mode` is `driver`.
+# MAGIC `count_raw_tokens` | Yes | `True` | If `False`, the tokens of SQL files are only counted without SQL comments, which decides the conversion targets, and `input_file_token_count` is left empty. This halves the tokenization work for SQL files.
+# MAGIC `token_count_mode` | Yes | `exact` | `exact` counts tokens with the tokenizer. `approximate` counts a random sample of 200 files exactly, fits an estimator on character, word and byte statistics of the sample, and estimates the counts of all files from these statistics. This is intended for a quick size and cost estimate of a large code base. The calibrated estimator is printed with its `relative_error_bound`, the 95th percentile of the relative error on the sample. Incremental runs always count exactly.
+# MAGIC `recount_near_threshold` | Yes | `True` | Used only when `token_count_mode` is `approximate`. If `True`, SQL files whose estimated count without SQL comments may be on either side of `token_count_threshold` within the error bound are counted exactly, so `is_conversion_target` is decided by exact counts.
+# MAGIC `analysis_mode` | Yes | `driver` | `driver` reads and tokenizes files on the driver. `spark` reads files with Spark's `binaryFile` data source and performs encoding detection, comment removal and token counting in a pandas UDF on the executors, which is suitable for very large input volumes. Files are numbered in path order in `spark` mode.
+# MAGIC `incremental` | Yes | `False` | If `True`, a manifest table named `<result table>_manifest` is saved with the size, modification time and content hash of each file. If `existing_result_table` also exists, only new or changed files are analyzed and merged into it on `input_file_path`. Changed files keep their `input_file_number` and their conversion results are reset; unchanged files keep their conversion results. Removed files are reported but not deleted from the table. Incremental runs always analyze on the driver.
+# MAGIC `similarity_threshold` | Yes | `0.8` | The minimum similarity of near-duplicate files, from `0.0` to `1.0`. The similarity is the estimated Jaccard similarity of the sets of 5 consecutive tokens of the files, where string literals and numbers are normalized. Files are clustered transitively, and each cluster is identified by the smallest `input_file_number` in `similarity_cluster_id`. `0` disables the detection and leaves `similarity_cluster_id` empty.
 
 # COMMAND ----------
 
 # DBTITLE 1,Load Configurations
-input_dir = dbutils.widgets.get("input_dir")
-token_encoding = dbutils.widgets.get("token_encoding")
-file_encoding = dbutils.widgets.get("file_encoding") if dbutils.widgets.get("file_encoding") else None
-is_sql = dbutils.widgets.get("is_sql") == "True"
-token_count_threshold = int(dbutils.widgets.get("token_count_threshold"))
-result_catalog = dbutils.widgets.get("result_catalog")
-result_schema = dbutils.widgets.get("result_schema")
-result_table_prefix = dbutils.widgets.get("result_table_prefix")
-existing_result_table = dbutils.widgets.get("existing_result_table")
-
-input_dir, token_encoding, file_encoding, is_sql, token_count_threshold, result_catalog, result_schema, result_table_prefix, existing_result_table
+config = AnalysisConfig(
+    input_dir=dbutils.widgets.get("input_dir"),
+    result_catalog=dbutils.widgets.get("result_catalog"),
+    result_schema=dbutils.widgets.get("result_schema"),
+    token_encoding=dbutils.widgets.get("token_encoding"),
+    tokenizer_cache_dir=dbutils.widgets.get("tokenizer_cache_dir"),
+    file_encoding=dbutils.widgets.get("file_encoding") or None,
+    file_filter=utils.FileFilter(
+        include_patterns=utils.parse_comma_separated(dbutils.widgets.get("include_patterns")),
+        exclude_patterns=utils.parse_comma_separated(dbutils.widgets.get("exclude_patterns")),
+        extensions=utils.parse_comma_separated(dbutils.widgets.get("file_extensions")),
+        max_depth=int(dbutils.widgets.get("max_depth")) if dbutils.widgets.get("max_depth") else None,
+    ),
+    is_sql=dbutils.widgets.get("is_sql") == "True",
+    token_count_threshold=int(dbutils.widgets.get("token_count_threshold")),
+    result_table_prefix=dbutils.widgets.get("result_table_prefix"),
+    existing_result_table=dbutils.widgets.get("existing_result_table"),
+    max_workers=int(dbutils.widgets.get("max_workers")) or None,
+    count_raw_tokens=dbutils.widgets.get("count_raw_tokens") == "True",
+    token_count_mode=dbutils.widgets.get("token_count_mode"),
+    recount_near_threshold=dbutils.widgets.get("recount_near_threshold") == "True",
+    analysis_mode=dbutils.widgets.get("analysis_mode"),
+    incremental=dbutils.widgets.get("incremental") == "True",
+    similarity_threshold=float(dbutils.widgets.get("similarity_threshold")),
+)
+config
 
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ## Check if existing_result_table exists
+# MAGIC ## Analyze the input files and save the result into a target delta table
+# MAGIC The analysis is implemented in `scripts/stages/analyze.py`, so that it can also be run by <a href="$./00_main_single_session" target="_blank">00_main_single_session</a> in the same Python session as the other steps. If `existing_result_table` exists, it is returned without analysis, or with only new and changed files merged into it in incremental mode.
 
 # COMMAND ----------
 
-# DBTITLE 1,Check Result Table Existance
-if existing_result_table:
-    try:
-        spark.table(existing_result_table)
-        dbutils.notebook.exit(existing_result_table)
-    except AnalysisException:
-        print(f"'existing_result_table' is specified but the table does not exist. Continuing with the notebook processing.")
-        pass
-else:
-    print("The parameter 'existing_result_table' is not specified. Continuing with the notebook processing.")
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC ## Count tokens in all files within the specified directory
+# DBTITLE 1,Analyze Files and Save Result
+result_table = analyze_input_files(spark, config)
 
 # COMMAND ----------
 
-# DBTITLE 1,Count Tokens
-helper = FileTokenCountHelper(token_encoding=token_encoding)
-results = helper.process_directory(input_dir=input_dir, file_encoding=file_encoding, is_sql=is_sql)
-
-# COMMAND ----------
-
-# DBTITLE 1,Create Spark DataFrame
-schema = StructType([
-    StructField("input_file_number", IntegerType(), True),
-    StructField("input_file_path", StringType(), True),
-    StructField("input_file_encoding", StringType(), True),
-    StructField("tiktoken_encoding", StringType(), True),
-    StructField("input_file_token_count", IntegerType(), True),
-    StructField("input_file_token_count_without_sql_comments", IntegerType(), True),
-    StructField("input_file_content", StringType(), True),
-    StructField("input_file_content_without_sql_comments", StringType(), True),
-    StructField("is_conversion_target", StringType(), True),
-    StructField("model_serving_endpoint_for_conversion", StringType(), True),
-    StructField("model_serving_endpoint_for_fix", StringType(), True),
-    StructField("result_content", StringType(), True),
-    StructField("result_token_count", IntegerType(), True),
-    StructField("result_error", StringType(), True),
-    StructField("result_timestamp", StringType(), True),
-    StructField("result_python_parse_error", StringType(), True),
-    StructField("result_extracted_sqls", ArrayType(StringType()), True),
-    StructField("result_sql_parse_errors", ArrayType(StringType()), True),
-])
-
-result_df = (spark
-             .createDataFrame(results, schema=schema)
-             .withColumn("is_conversion_target",
-                         when(col("input_file_token_count_without_sql_comments") > token_count_threshold, False)
-                         .otherwise(True))
-             .withColumn("model_serving_endpoint_for_conversion", lit(None).cast(StringType()))
-             .withColumn("model_serving_endpoint_for_fix", lit(None).cast(StringType()))
-             .withColumn("result_content", lit(None).cast(StringType()))
-             .withColumn("result_token_count", lit(None).cast(IntegerType()))
-             .withColumn("result_error", lit(None).cast(StringType()))
-             .withColumn("result_timestamp", lit(None).cast(TimestampType()))
-             .withColumn("result_python_parse_error", lit(None).cast(StringType()))
-             .withColumn("result_extracted_sqls", lit(None).cast(ArrayType(StringType())))
-             .withColumn("result_sql_parse_errors", lit(None).cast(ArrayType(StringType())))
-             )
-
+# DBTITLE 1,Display Result Table
+result_df = spark.table(result_table)
 display(result_df)
 
 # COMMAND ----------
@@ -168,36 +152,13 @@ display(result_df)
 warning_df = result_df.filter(col("is_conversion_target") == False)
 if warning_df.count() > 0:
     print(f"Warning: The following files do not meet the token count threshold of "
-          f"{token_count_threshold} and are excluded from conversion process.")
+          f"{config.token_count_threshold} and are excluded from conversion process.")
     display(warning_df)
 else:
     print("No issues found. All files meet the token count threshold.")
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC ## Save the result dataframe into a target delta table
-
-# COMMAND ----------
-
-# DBTITLE 1,Define Target Table
-current_time = datetime.now(timezone.utc).strftime("%Y%m%d%H%M")
-result_table = f"{result_catalog}.{result_schema}.{result_table_prefix}_{current_time}"
-print(result_table)
-
-# COMMAND ----------
-
-# DBTITLE 1,Save Result
-result_df.write.format("delta").mode("overwrite").saveAsTable(result_table)
-print(f"Successfully saved result into the table: {result_table}")
-
-# COMMAND ----------
-
-# DBTITLE 1,Display Result Table
-spark.table(result_table).display()
-
-# COMMAND ----------
-
 # MAGIC %md
 # MAGIC ## Return the result table name
 
@@ -9,8 +9,8 @@
 # MAGIC The following tasks are accomplished in this notebook:
 # MAGIC
 # MAGIC 1. **Read Data**: Data is read from the input table and specified columns. The input table is assumed to have been created in the preceding notebook (<a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>), and the `input_file_content_without_sql_comments` column is utilized for processing.
-# MAGIC 2. **Request Construction and Submission**: Requests are constructed and sent to the specified Databricks model serving endpoint with concurrent processing.
-# MAGIC 3. **Persist Results**: The results of the conversion process are added to the input table.
+# MAGIC 2. **Request Construction and Submission**: Requests are constructed and sent to the specified Databricks model serving endpoint with concurrent processing. With `use_similar_file_examples` set to `True`, the first file of each cluster of near-duplicate files (`similarity_cluster_id`) is converted first, and the other files of the cluster are then converted with it as the few-shot example.
+# MAGIC 3. **Persist Results**: The results of the conversion process are merged into the input table. Only the rows of the converted files are rewritten.
 
 # COMMAND ----------
 
@@ -27,13 +27,11 @@
 
 # DBTITLE 1,Import Libraries
 import json
-import logging
 
-from scripts.batch_inference_helper import (AsyncChatClient,
-                                            BatchInferenceManager,
-                                            BatchInferenceRequest)
-from scripts.system_prompts.tsql_conversion_prompt import \
-    TsqlConversionPromptManager
+import pandas as pd
+from scripts.stages.convert import (ConversionConfig, Prompts,
+                                    convert_sql_to_databricks, create_prompts)
+from scripts.stages.endpoint_config import EndpointConfig
 
 # COMMAND ----------
 
@@ -53,11 +51,22 @@ dbutils.widgets.dropdown("sql_dialect", "tsql", ["tsql"], "SQL Dialect")
 dbutils.widgets.dropdown("comment_lang", "English", ["English", "Japanese"], "Comment Language")
 dbutils.widgets.text("request_params", '{"max_tokens": 4000, "temperature": 0}', "Chat Request Params")
 dbutils.widgets.text("concurrency", "10", "Concurrency Requests")
+dbutils.widgets.dropdown("use_similar_file_examples", "True", ["True", "False"], "Use Similar Files as Examples")
+dbutils.widgets.text("few_shot_library_table", "", "Few-Shot Library Table (Optional)")
+dbutils.widgets.text("max_few_shots", "2", "Max Few-Shots per Request")
+dbutils.widgets.text("prompt_token_budget", "24000", "Prompt Token Budget")
+dbutils.widgets.text("token_encoding", "o200k_base", "Token Encoding for LLM")
+dbutils.widgets.dropdown("prompt_sections", "all", ["all", "detected"], "System Message Sections")
+dbutils.widgets.dropdown("use_rule_based_transpiler", "True", ["True", "False"], "Use Rule-Based Transpiler")
 
 dbutils.widgets.text("logging_interval", "1", "Logging Interval")
 dbutils.widgets.text("timeout", "300", "Timeout Seconds")
 dbutils.widgets.text("max_retries_backpressure", "20", "Max Retries on Backpressure")
 dbutils.widgets.text("max_retries_other", "5", "Max Retries on Other Errors")
+dbutils.widgets.text("run_profile", "", "Run Profile Path (Optional)")
+dbutils.widgets.text("record_file", "", "Traffic Record File (Optional)")
+dbutils.widgets.text("replay_file", "", "Traffic Replay File (Optional)")
+dbutils.widgets.dropdown("replay_with_original_timing", "False", ["True", "False"], "Replay with Original Timing")
 
 # COMMAND ----------
 
@@ -71,37 +80,66 @@ dbutils.widgets.text("max_retries_other", "5", "Max Retries on Other Errors")
 # MAGIC `sql_dialect` | Yes | `tsql` | The SQL dialect to be converted. Currently, only tsql is supported.
 # MAGIC `comment_lang` | Yes | `English` | The language for comments to be added to the converted Databricks notebooks. Options are English or Japanese.
 # MAGIC `concurrency` | Yes | `10` | The number of concurrent requests sent to the model serving endpoint.
+# MAGIC `use_similar_file_examples` | Yes | `True` | If `True` and the result table has `similarity_cluster_id` (see <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>), the first conversion target of each cluster of near-duplicate files is converted first. The other files of the cluster are then converted with it and its conversion result as the few-shot example instead of the default few-shots, which usually matches them more closely. If its conversion fails, the default few-shots are used.
+# MAGIC `few_shot_library_table` | No |  | A result table of a previous conversion whose verified conversions are used as few-shot examples. Rows with `result_content` that passed the syntax check of <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a> without errors are indexed. For each input, the examples with the most similar T-SQL are selected instead of the default few-shots. If unspecified, the default few-shots are used.
+# MAGIC `max_few_shots` | Yes | `2` | The maximum number of examples selected from `few_shot_library_table` per request.
+# MAGIC `prompt_token_budget` | Yes | `24000` | The maximum prompt tokens per request, including the system message and the input, when selecting examples from `few_shot_library_table`. Examples that do not fit the remaining tokens are skipped, so large inputs get fewer or no examples. A near-duplicate file whose representative example does not fit gets the usual few-shots instead.
+# MAGIC `token_encoding` | Yes | `o200k_base` | The encoding used to count the prompt tokens. It should match the encoding used in <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>.
+# MAGIC `prompt_sections` | Yes | `all` | The guideline sections of the system message sent with each input. If `all`, every section is sent. If `detected`, sections for T-SQL features (such as transactions, cursors, temporary tables, `DELETE` and `UPDATE`) are only sent with the inputs that use them, which reduces the prompt tokens. In both cases, the token cost of each section and the prompt tokens of the run are reported after the conversion.
+# MAGIC `use_rule_based_transpiler` | Yes | `True` | If `True`, trivially convertible T-SQL procedures are converted by a rule-based transpiler without the model serving endpoint. A procedure is converted only if its parameters have numeric or string types and its body consists of plain `SELECT`, `INSERT`, `UPDATE` and `DELETE` statements without T-SQL specific constructs (such as variables, control flow, transactions, temporary tables, `UPDATE ... FROM` and T-SQL specific functions), `+` and `/` only apply to numbers that keep the same meaning, and only the last statement returns a result set. The parameters are passed to `spark.sql` as named parameter markers. Other files are sent to the endpoint. The converted files have `rule_based_transpiler` as `model_serving_endpoint_for_conversion`.
 # MAGIC `logging_interval` | Yes | `1` | The number of requests processed before logging a progress update. Controls the frequency of progress reports during batch processing, showing the total requests processed and elapsed time.
 # MAGIC `timeout` | Yes | `300` | The timeout for an HTTP request on the client side, in seconds.
 # MAGIC `max_retries_backpressure` | Yes | `20` | The maximum number of retries on backpressure status code (such as `429` or `503`).
 # MAGIC `max_retries_other` | Yes | `5` | The maximum number of retries on other errors (such as `5xx`, `408`, or `409`).
 # MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | The extra chat HTTP request parameters in JSON format (reference: [Databricks Foundation Model APIs](https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request)).
+# MAGIC `run_profile` | No |  | The path of a run profile JSON file created by <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a>. If specified, its `concurrency`, `timeout` and `max_tokens` override `concurrency`, `timeout` and `max_tokens` in `request_params`.
+# MAGIC `record_file` | No |  | If specified, all request/response pairs sent to the endpoint are recorded to this file as gzip-compressed JSON Lines (e.g., `/Volumes/my_catalog/my_schema/my_volume/traffic.jsonl.gz`). They are written to a local temporary file as they arrive and copied to this file at the end, so that it can be on a Unity Catalog Volume. If the copy fails, the path of the temporary file is logged.
+# MAGIC `replay_file` | No |  | If specified, responses are served from a file recorded with `record_file` instead of calling the endpoint. This is useful for benchmarking the non-LLM steps and for reproducing runs without model costs. Requests that were not recorded end with an error.
+# MAGIC `replay_with_original_timing` | Yes | `False` | If `True`, replayed responses wait for their recorded latency. If `False`, they are returned at maximum speed.
 
 # COMMAND ----------
 
 # DBTITLE 1,Load Configurations
 # Load configurations from widgets
-config_endpoint_name = dbutils.widgets.get("endpoint_name")
-config_timeout = int(dbutils.widgets.get("timeout"))
-config_max_retries_backpressure = int(dbutils.widgets.get("max_retries_backpressure"))
-config_max_retries_other = int(dbutils.widgets.get("max_retries_other"))
-
-config_request_params = json.loads(
-    dbutils.widgets.get("request_params")
-)  # Reference: https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request
+config = ConversionConfig(
+    result_table=dbutils.widgets.get("result_table"),
+    endpoint=EndpointConfig(
+        endpoint_name=dbutils.widgets.get("endpoint_name"),
+        request_params=json.loads(
+            dbutils.widgets.get("request_params")
+        ),  # Reference: https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request
+        concurrency=int(dbutils.widgets.get("concurrency")),
+        logging_interval=int(dbutils.widgets.get("logging_interval")),
+        timeout=int(dbutils.widgets.get("timeout")),
+        max_retries_backpressure=int(dbutils.widgets.get("max_retries_backpressure")),
+        max_retries_other=int(dbutils.widgets.get("max_retries_other")),
+        run_profile=dbutils.widgets.get("run_profile") or None,
+        record_file=dbutils.widgets.get("record_file") or None,
+        replay_file=dbutils.widgets.get("replay_file") or None,
+        replay_with_original_timing=dbutils.widgets.get("replay_with_original_timing") == "True",
+    ),
+    sql_dialect=dbutils.widgets.get("sql_dialect"),
+    comment_lang=dbutils.widgets.get("comment_lang"),
+    use_similar_file_examples=dbutils.widgets.get("use_similar_file_examples") == "True",
+    few_shot_library_table=dbutils.widgets.get("few_shot_library_table") or None,
+    max_few_shots=int(dbutils.widgets.get("max_few_shots")),
+    prompt_token_budget=int(dbutils.widgets.get("prompt_token_budget")),
+    token_encoding=dbutils.widgets.get("token_encoding"),
+    prompt_sections=dbutils.widgets.get("prompt_sections"),
+    use_rule_based_transpiler=dbutils.widgets.get("use_rule_based_transpiler") == "True",
+)
 
-config_concurrecy = int(dbutils.widgets.get("concurrency"))
-config_logging_interval = int(dbutils.widgets.get("logging_interval"))
+# COMMAND ----------
 
-config_result_table = dbutils.widgets.get("result_table")
-config_sql_dialect = dbutils.widgets.get("sql_dialect")
-config_comment_lang = dbutils.widgets.get("comment_lang")
+# DBTITLE 1,Apply Run Profile
+config.endpoint.apply_run_profile()
+config.endpoint
 
 # COMMAND ----------
 
 # MAGIC %md
 # MAGIC ## System message & few-shots by SQL dialect
-# MAGIC **Note**: Currently, the notebook supports only the `tsql` dialect. Support for additional dialects may be added in the future. You can specify your custom prompts (`system_message` and `few_shots`) by modifying the code below.
+# MAGIC **Note**: Currently, the notebook supports only the `tsql` dialect. Support for additional dialects may be added in the future. You can specify your custom prompts by replacing `prompts` below with `Prompts(system_message=..., few_shots=...)`.
 
 # COMMAND ----------
 
@@ -112,123 +150,51 @@ config_comment_lang = dbutils.widgets.get("comment_lang")
 # COMMAND ----------
 
 # DBTITLE 1,System Message and Few-Shots
-if config_sql_dialect == "tsql":
-    manager = TsqlConversionPromptManager(config_comment_lang)
-    system_message = manager.get_system_message()
-    few_shots = manager.get_few_shots()
+prompts = create_prompts(config)
 
 # COMMAND ----------
 
 # MAGIC %md
 # MAGIC ## Run batch inference
-# MAGIC The following code loads a Spark dataframe of the input data table and then converts that dataframe into a list of text that the model can process.
+# MAGIC The following code loads the conversion targets of the result table, converts the trivially convertible procedures with the rule-based transpiler if `use_rule_based_transpiler` is `True`, sends the others to the model serving endpoint and merges the output into the result table. Only the rows of the converted files are rewritten. The conversion is implemented in `scripts/stages/convert.py`, so that it can also be run by <a href="$./00_main_single_session" target="_blank">00_main_single_session</a> in the same Python session as the other steps.
 
 # COMMAND ----------
 
-# DBTITLE 1,Create Batch Inference Requests
-source_sdf = spark.table(config_result_table)
-input_sdf = (source_sdf
-    .filter("is_conversion_target == true")
-    .select(
-        "input_file_number",
-        "input_file_content_without_sql_comments")
-)
-input_df = input_sdf.toPandas()
-
-batch_inference_requests = [
-    BatchInferenceRequest(
-        index=int(row[0]),
-        text=row[1],
-        system_message=system_message,
-        few_shots=few_shots)
-    for row in input_df.itertuples(index=False, name=None)
-]
+# DBTITLE 1,Batch Inference
+conversion_result = await convert_sql_to_databricks(spark, config, prompts)
 
 # COMMAND ----------
 
 # DBTITLE 1,Display Batch Inference Requests
 display_df = spark.createDataFrame([
     (req.index, req.text, req.system_message, str(req.few_shots))
-    for req in batch_inference_requests
+    for req in conversion_result.requests
 ], ["index", "text", "system_message", "few_shots"])
 
 display(display_df)
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC The following records and stores the batch inference responses.
-
-# COMMAND ----------
-
-# DBTITLE 1,Create Batch Inference Manager
-batch_manager = BatchInferenceManager(
-    client=AsyncChatClient(
-        endpoint_name=config_endpoint_name,
-        request_params=config_request_params,
-        timeout=config_timeout,
-        max_retries_backpressure=config_max_retries_backpressure,
-        max_retries_other=config_max_retries_other,
-        log_level=logging.INFO,
-    ),
-    concurrency=config_concurrecy,
-    logging_interval=config_logging_interval,
-    log_level=logging.INFO,
-)
-
-# COMMAND ----------
-
-# DBTITLE 1,Batch Inference
-batch_inference_responses = await batch_manager.batch_inference(batch_inference_requests)
+# DBTITLE 1,Prompt Token Report
+if conversion_result.section_costs:
+    # The token count of each guideline section, the number of requests it was sent with, and their product
+    display(pd.DataFrame(
+        [(cost.name, cost.token_count, cost.request_count, cost.total_token_count)
+         for cost in conversion_result.section_costs],
+        columns=["section", "token_count", "request_count", "total_token_count"]))
 
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ## Save results
-# MAGIC The following stores the output to the result table and displays the results
-
-# COMMAND ----------
-
-# DBTITLE 1,Load Notebook Utils
-# MAGIC %run ./notebook_utils
-
-# COMMAND ----------
-
-# DBTITLE 1,Organize Output
-batch_inference_result_processor = BatchInferenceResultProcessor(model_serving_endpoint_for_conversion=config_endpoint_name)
-output_sdf = batch_inference_result_processor.process_results(source_sdf, batch_inference_responses)
-display(output_sdf)
+# MAGIC ## Display results
+# MAGIC The following displays the updated rows and the result table.
 
 # COMMAND ----------
 
-# DBTITLE 1,Save Result
-output_sdf.write.mode("overwrite").saveAsTable(config_result_table)
-print(f"Successfully saved result into the table: {config_result_table}")
+# DBTITLE 1,Display Updated Rows
+display(conversion_result.updated_sdf)
 
 # COMMAND ----------
 
 # DBTITLE 1,Display Result Table
-spark.table(config_result_table).display()
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC ## Cleaning results
-# MAGIC The following performs cleaning on `result_content`. The reason for saving the data first and then performing cleaning is to enable time travel in case there are any issues with the cleaning process.
-
-# COMMAND ----------
-
-# DBTITLE 1,Clean Result
-cleand_df = clean_conversion_results(config_result_table)
-display(cleand_df)
-
-# COMMAND ----------
-
-# DBTITLE 1,Save Cleaned Result
-cleand_df.write.mode("overwrite").saveAsTable(config_result_table)
-print(f"Successfully saved cleaned result into the table: {config_result_table}")
-
-# COMMAND ----------
-
-# DBTITLE 1,Display Cleaned Result Table
-spark.table(config_result_table).display()
+spark.table(config.result_table).display()
@@ -6,15 +6,16 @@
 # MAGIC 1. **Python Function Syntax Check**: Using `ast.parse` to parse the input strings into an Abstract Syntax Tree (AST). Only correctly formatted Python functions can be parsed, thus ensuring static syntax correctness.
 # MAGIC 2. **SQL Syntax Check**: Extracting SQL statements from the parsed Python functions and verifying their syntax using Spark's SQL parser.
 # MAGIC
-# MAGIC The extraction of SQL from Python functions is handled by the `spark_sql_extract_helper.py` script. The SQL syntax check is done using `spark._jsparkSession.sessionState().sqlParser().parsePlan()`, which can only be executed on the driver node, making this notebook slightly tricky in its implementation.
+# MAGIC The extraction of SQL from Python functions is handled by the `spark_sql_extract_helper.py` script. The SQL syntax check is done using `spark._jsparkSession.sessionState().sqlParser().parsePlan()`, which can only be executed on the driver node, making this notebook slightly tricky in its implementation. The check is implemented in `scripts/stages/syntax_check.py`, so that it can also be run by <a href="$./00_main_single_session" target="_blank">00_main_single_session</a> in the same Python session as the other steps.
 # MAGIC
 # MAGIC ## Task Overview
 # MAGIC The following tasks are accomplished in this notebook:
 # MAGIC
-# MAGIC 1. **Load Data**: The data is loaded from the specified result table.
+# MAGIC 1. **Load Data**: The data is loaded from the specified result table. If `incremental` is `True`, only the rows whose `result_content_hash` differs from their `checked_hash`, i.e. whose content changed since their last check, are loaded.
 # MAGIC 2. **Parse Python Function and Extract SQL Statements**: Python functions are parsed using `ast.parse` to ensure they are valid, and SQL statements are extracted using the script.
 # MAGIC 3. **Parse SQL Statements**: The extracted SQL statements are parsed to check for syntax errors using Spark's SQL parser.
-# MAGIC 4. **Save Results**: The original data along with any syntax errors are saved back to the specified result table by adding new columns.
+# MAGIC 4. **Save Results**: The syntax errors of the checked rows are saved back to the specified result table, and their `checked_hash` is set to the hash of the checked content.
+# MAGIC 5. **Autofix**: Common errors are fixed locally with deterministic rules, and the files that still have errors are left for <a href="$./03_02_fix_syntax_error" target="_blank">03_02_fix_syntax_error</a>.
 
 # COMMAND ----------
 
@@ -30,12 +31,7 @@
 # COMMAND ----------
 
 # DBTITLE 1,Import Libraries
-from typing import List, Tuple
-
-from pyspark.sql import DataFrame, SparkSession
-from pyspark.sql.functions import udf
-from pyspark.sql.types import ArrayType, StringType, StructField, StructType
-from scripts.spark_sql_extract_helper import SparkSQLExtractHelper
+from scripts.stages.syntax_check import run_static_syntax_check
 
 # COMMAND ----------
 
@@ -46,6 +42,8 @@ from scripts.spark_sql_extract_helper import SparkSQLExtractHelper
 
 # DBTITLE 1,Configurations
 dbutils.widgets.text("result_table", "", "Conversion Result Table (Required)")
+dbutils.widgets.dropdown("autofix", "True", ["True", "False"], "Autofix")
+dbutils.widgets.dropdown("incremental", "True", ["True", "False"], "Incremental Check")
 
 # COMMAND ----------
 
@@ -54,12 +52,16 @@ dbutils.widgets.text("result_table", "", "Conversion Result Table (Required)")
 # MAGIC Parameter Name | Required | Description
 # MAGIC --- | --- | ---
 # MAGIC `result_table` | Yes | The name of the conversion result table created in the previous notebook.
+# MAGIC `autofix` | Yes | If `True`, the files with syntax errors are fixed with the local rules described below before they are sent to the LLM. Default is `True`.
+# MAGIC `incremental` | Yes | If `True`, only the files whose content changed since their last check are checked, and the results of the other files are kept. If `False`, all files are checked again, e.g. after the Databricks Runtime version is changed. Default is `True`.
 
 # COMMAND ----------
 
 # DBTITLE 1,Load Configurations
 result_table = dbutils.widgets.get("result_table")
-result_table
+autofix = dbutils.widgets.get("autofix") == "True"
+incremental = dbutils.widgets.get("incremental") == "True"
+result_table, autofix, incremental
 
 # COMMAND ----------
 
@@ -75,86 +77,21 @@ display(original_df)
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ## Parse Python function and extract SQL statements
-
-# COMMAND ----------
-
-# DBTITLE 1,Define UDF
-def extract_sqls(func_string: str) -> Tuple[str, List[str]]:
-    helper = SparkSQLExtractHelper()
-    return helper.extract_sql_from_string(func_string)
-
-
-extract_sqls_udf = udf(extract_sqls, StructType([
-    StructField("result_python_parse_error", StringType(), True),
-    StructField("result_extracted_sqls", ArrayType(StringType()), True)
-]))
-
-# COMMAND ----------
-
-# DBTITLE 1,Parse Python and Extract SQLs
-# Extract SQL from the result_content column, adding error messages and SQL list as new columns
-new_df = original_df.withColumn("parsed_result", extract_sqls_udf("result_content"))
-
-# Split parsed_result into two new columns: python_parse_error_str and extracted_sqls
-new_df = (new_df
-          .withColumn("result_python_parse_error", new_df["parsed_result"].getItem("result_python_parse_error"))
-          .withColumn("result_extracted_sqls", new_df["parsed_result"].getItem("result_extracted_sqls"))
-          .drop("parsed_result")
-          )
-
-# Display results
-display(new_df)
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC ## Parse SQL statements
-
-# COMMAND ----------
-
-# DBTITLE 1,Define SQL Parse Function
-# Function to parse SQL statements on the driver
-def parse_sql_statements(df: DataFrame) -> List[Tuple[str, List[str]]]:
-    parser = spark._jsparkSession.sessionState().sqlParser()
-    result = []
-    for row in df.collect():
-        parsed_errors = []
-        for idx, sql in enumerate(row['result_extracted_sqls']):
-            try:
-                parser.parsePlan(sql)
-            except Exception as e:
-                parsed_errors.append(f"Error in query {idx}: {str(e)}")
-        result.append((row["input_file_number"], parsed_errors))
-    return result
-
-# COMMAND ----------
-
-# DBTITLE 1,Create DataFrame from Parsed Data
-parsed_data = parse_sql_statements(new_df)
-parsed_schema = StructType([
-    StructField("input_file_number", StringType(), True),
-    StructField("result_sql_parse_errors", ArrayType(StringType()), True)
-])
-parsed_errors_df = spark.createDataFrame(parsed_data, parsed_schema)
-display(parsed_errors_df)
+# MAGIC ## Check syntax and update table
+# MAGIC Python functions are parsed and the SQL statements are extracted with a UDF, the SQL statements are parsed on the driver, and the errors are saved to the result table.
+# MAGIC
+# MAGIC If `autofix` is `True`, the following rules are applied to the checked files with errors, and each rewrite is parsed again. A file is only updated if it has fewer errors afterwards, and the applied rules of each updated file are printed.
+# MAGIC
+# MAGIC Rule | Applied to | Rewrite
+# MAGIC --- | --- | ---
+# MAGIC `markdown_fences` | Python parse errors | Removes the lines with markdown code fences (e.g. `` ```python ``).
+# MAGIC `transaction_control` | `BEGIN TRANSACTION` and `COMMIT` statements | Replaces the `spark.sql` statement with `pass`, as transactions are not supported in Spark SQL. `ROLLBACK` and `SAVE TRANSACTION` are left to the LLM fix, because removing them would silently drop the error handling.
+# MAGIC `temp_table_prefix` | Names with `#` | Removes `#` from the names (e.g. `#TempOrders` to `TempOrders`).
+# MAGIC `variable_prefix` | Variables with `@` | Replaces `@name` with a reference to the Python variable `name` or its snake case (e.g. `@OrderID` to `{order_id}`) in an f-string, if the variable exists.
+# MAGIC `update_from` | `UPDATE ... FROM` statements | Rewrites a simple `UPDATE ... SET ... FROM ... [INNER JOIN ... ON ...] [WHERE ...]` without subqueries to `MERGE INTO`.
 
 # COMMAND ----------
 
-# DBTITLE 1,Add Parsed Errors to DataFrame
-final_df = (new_df
-            .drop("result_sql_parse_errors")
-            .join(parsed_errors_df, on="input_file_number", how="left")
-            )
+# DBTITLE 1,Check Syntax and Update Table
+final_df = run_static_syntax_check(spark, result_table, autofix=autofix, incremental=incremental)
 display(final_df)
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC ## Update table
-
-# COMMAND ----------
-
-# DBTITLE 1,Update Table
-final_df.write.mode("overwrite").saveAsTable(result_table)
-print(f"Changes applied to the result table: {result_table}.")
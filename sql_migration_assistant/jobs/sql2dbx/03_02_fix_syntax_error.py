@@ -34,11 +34,9 @@
 
 # DBTITLE 1,Import Libraries
 import json
-from typing import Optional
 
-from scripts.batch_inference_helper import (AsyncChatClient,
-                                            BatchInferenceManager,
-                                            BatchInferenceRequest)
+from scripts.stages.endpoint_config import EndpointConfig
+from scripts.stages.fix import fix_syntax_errors
 
 # COMMAND ----------
 
@@ -59,6 +57,12 @@ dbutils.widgets.text("logging_interval", "1", "Logging Interval")
 dbutils.widgets.text("timeout", "300", "Timeout Seconds")
 dbutils.widgets.text("max_retries_backpressure", "20", "Max Retries on Backpressure")
 dbutils.widgets.text("max_retries_other", "5", "Max Retries on Other Errors")
+dbutils.widgets.text("run_profile", "", "Run Profile Path (Optional)")
+dbutils.widgets.text("record_file", "", "Traffic Record File (Optional)")
+dbutils.widgets.text("replay_file", "", "Traffic Replay File (Optional)")
+dbutils.widgets.dropdown("replay_with_original_timing", "False", ["True", "False"], "Replay with Original Timing")
+dbutils.widgets.dropdown("repair_mode", "statement", ["statement", "file"], "Repair Mode")
+dbutils.widgets.text("context_lines", "3", "Context Lines")
 
 # COMMAND ----------
 
@@ -75,175 +79,56 @@ dbutils.widgets.text("max_retries_other", "5", "Max Retries on Other Errors")
 # MAGIC `max_retries_backpressure` | Yes | `20` | The maximum number of retries on backpressure status code (such as `429` or `503`).
 # MAGIC `max_retries_other` | Yes | `5` | The maximum number of retries on other errors (such as `5xx`, `408`, or `409`).
 # MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | The extra chat HTTP request parameters in JSON format (reference: [Databricks Foundation Model APIs](https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request)).
+# MAGIC `run_profile` | No |  | The path of a run profile JSON file created by <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a>. If specified, its `concurrency`, `timeout` and `max_tokens` override `concurrency`, `timeout` and `max_tokens` in `request_params`.
+# MAGIC `record_file` | No |  | If specified, all request/response pairs sent to the endpoint are recorded to this file as gzip-compressed JSON Lines (e.g., `/Volumes/my_catalog/my_schema/my_volume/traffic.jsonl.gz`). They are written to a local temporary file as they arrive and copied to this file at the end, so that it can be on a Unity Catalog Volume. If the copy fails, the path of the temporary file is logged.
+# MAGIC `replay_file` | No |  | If specified, responses are served from a file recorded with `record_file` instead of calling the endpoint. This is useful for benchmarking the non-LLM steps and for reproducing runs without model costs. Requests that were not recorded end with an error.
+# MAGIC `replay_with_original_timing` | Yes | `False` | If `True`, replayed responses wait for their recorded latency. If `False`, they are returned at maximum speed.
+# MAGIC `repair_mode` | Yes | `statement` | `statement` sends only the Spark SQL queries with parse errors to the endpoint, each with the assignment of its query variable, and splices the fixed queries back into the code. Files with Python parse errors, and files whose fixed queries cannot be spliced back into valid Python code, are sent as a whole. `file` sends every file with errors as a whole.
+# MAGIC `context_lines` | Yes | `3` | In `statement` mode, the number of lines before and after each failing query sent to the endpoint as reference.
 
 # COMMAND ----------
 
 # DBTITLE 1,Load Configurations
 # Load configurations from widgets
-config_endpoint_name = dbutils.widgets.get("endpoint_name")
-config_timeout = int(dbutils.widgets.get("timeout"))
-config_max_retries_backpressure = int(dbutils.widgets.get("max_retries_backpressure"))
-config_max_retries_other = int(dbutils.widgets.get("max_retries_other"))
-
-config_request_params = json.loads(
-    dbutils.widgets.get("request_params")
-)  # Reference: https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request
-
-config_concurrecy = int(dbutils.widgets.get("concurrency"))
-config_logging_interval = int(dbutils.widgets.get("logging_interval"))
 config_result_table = dbutils.widgets.get("result_table")
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC ## Run batch inference
-# MAGIC The following code loads a Spark dataframe of the input data table and then converts that dataframe into a list of text that the model can process.
-
-# COMMAND ----------
-
-# DBTITLE 1,Function for Creating System Message
-def create_system_message(python_error: Optional[str], sql_error: Optional[str]) -> str:
-    """
-    Create a system message for an LLM to fix errors in a Python function running in a Databricks notebook.
-
-    Args:
-        python_error (Optional[str]): The Python parsing error message, if any.
-        sql_error (Optional[str]): The Spark SQL-related error message, if any.
-
-    Returns:
-        str: A formatted system message with instructions and error details.
-    """
-    message = f"""Fix the following errors in the Python function that runs in a Databricks notebook.
-The function contains Spark SQL queries, and most errors are Spark SQL-related.
-
-Instructions:
-1. Output only Python code and comments. No other text allowed.
-2. Do not add explanations outside of Python code.
-3. If asked to continue, resume the code without adding extra phrases.
-4. Do not omit any part of the code.
-5. Ensure proper handling of Spark SQL queries in the Databricks environment.
-6. Prioritize fixing Spark SQL-related errors.
-
-Errors to fix:
-"""
-    if python_error:
-        message += f"{python_error}\n"
-    if sql_error:
-        message += f"{sql_error}\n"
-    return message
-
-# COMMAND ----------
-
-# DBTITLE 1,Extract Input Data
-input_sdf = spark.sql(f"""
-    SELECT
-        input_file_number,
-        result_content,
-        result_python_parse_error,
-        result_sql_parse_errors
-    FROM {config_result_table}
-    WHERE result_python_parse_error IS NOT NULL
-    OR (result_sql_parse_errors IS NOT NULL AND size(result_sql_parse_errors) > 0)
-""")
-display(input_sdf)
-
-# COMMAND ----------
-
-# DBTITLE 1,Create Batch Inference Requests
-input_data = input_sdf.collect()
-batch_inference_requests = [
-    BatchInferenceRequest(
-        index=row['input_file_number'],
-        text=row['result_content'],
-        system_message=create_system_message(
-            row['result_python_parse_error'], row['result_sql_parse_errors']))
-    for row in input_data
-]
-
-# COMMAND ----------
-
-# DBTITLE 1,Display Batch Inference Requests
-display_df = spark.createDataFrame([
-    (req.index, req.text, req.system_message, str(req.few_shots))
-    for req in batch_inference_requests
-], ["index", "text", "system_message", "few_shots"])
-
-display(display_df)
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC The following records and stores the batch inference responses.
-
-# COMMAND ----------
-
-# DBTITLE 1,Create Batch Inference Manager
-batch_manager = BatchInferenceManager(
-    client=AsyncChatClient(
-        endpoint_name=config_endpoint_name,
-        request_params=config_request_params,
-        timeout=config_timeout,
-        max_retries_backpressure=config_max_retries_backpressure,
-        max_retries_other=config_max_retries_other,
-    ),
-    concurrency=config_concurrecy,
-    logging_interval=config_logging_interval
+endpoint_config = EndpointConfig(
+    endpoint_name=dbutils.widgets.get("endpoint_name"),
+    request_params=json.loads(
+        dbutils.widgets.get("request_params")
+    ),  # Reference: https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request
+    concurrency=int(dbutils.widgets.get("concurrency")),
+    logging_interval=int(dbutils.widgets.get("logging_interval")),
+    timeout=int(dbutils.widgets.get("timeout")),
+    max_retries_backpressure=int(dbutils.widgets.get("max_retries_backpressure")),
+    max_retries_other=int(dbutils.widgets.get("max_retries_other")),
+    run_profile=dbutils.widgets.get("run_profile") or None,
+    record_file=dbutils.widgets.get("record_file") or None,
+    replay_file=dbutils.widgets.get("replay_file") or None,
+    replay_with_original_timing=dbutils.widgets.get("replay_with_original_timing") == "True",
 )
+config_repair_mode = dbutils.widgets.get("repair_mode")
+config_context_lines = int(dbutils.widgets.get("context_lines"))
 
 # COMMAND ----------
 
-# DBTITLE 1,Batch Inference
-batch_inference_responses = await batch_manager.batch_inference(batch_inference_requests)
+# DBTITLE 1,Apply Run Profile
+endpoint_config.apply_run_profile()
+endpoint_config
 
 # COMMAND ----------
 
 # MAGIC %md
-# MAGIC ## Save results
-# MAGIC The following stores the output to the result table and displays the results
-
-# COMMAND ----------
-
-# DBTITLE 1,Load Notebook Utils
-# MAGIC %run ./notebook_utils
+# MAGIC ## Run batch inference
+# MAGIC The following code sends fix requests for the files with syntax errors in the result table and merges the fixed code into it. In `statement` mode, a request is sent for each failing query instead of the whole file, which reduces the tokens and latency of fixing large files with few errors. Only the rows of the fixed files are rewritten. The fix is implemented in `scripts/stages/fix.py`, so that it can also be run by <a href="$./00_main_single_session" target="_blank">00_main_single_session</a> in the same Python session as the other steps.
 
 # COMMAND ----------
 
-# DBTITLE 1,Organize Output
-source_sdf = spark.table(config_result_table)
-batch_inference_result_processor = BatchInferenceResultProcessor(model_serving_endpoint_for_fix=config_endpoint_name)
-output_sdf = batch_inference_result_processor.process_results(source_sdf, batch_inference_responses)
+# DBTITLE 1,Batch Inference
+batch_inference_responses, output_sdf = await fix_syntax_errors(
+    spark, config_result_table, endpoint_config, repair_mode=config_repair_mode, context_lines=config_context_lines)
 display(output_sdf)
 
 # COMMAND ----------
 
-# DBTITLE 1,Save Result
-output_sdf.write.mode("overwrite").saveAsTable(config_result_table)
-print(f"Successfully saved result into the table: {config_result_table}")
-
-# COMMAND ----------
-
 # DBTITLE 1,Display Result Table
 spark.table(config_result_table).display()
-
-# COMMAND ----------
-
-# MAGIC %md
-# MAGIC ## Cleaning results
-# MAGIC The following performs cleaning on `result_content`. The reason for saving the data first and then performing cleaning is to enable time travel in case there are any issues with the cleaning process.
-
-# COMMAND ----------
-
-# DBTITLE 1,Clean Result
-cleand_df = clean_conversion_results(config_result_table)
-display(cleand_df)
-
-# COMMAND ----------
-
-# DBTITLE 1,Save Cleaned Result
-cleand_df.write.mode("overwrite").saveAsTable(config_result_table)
-print(f"Successfully saved cleaned result into the table: {config_result_table}")
-
-# COMMAND ----------
-
-# DBTITLE 1,Display Cleaned Result Table
-spark.table(config_result_table).display()
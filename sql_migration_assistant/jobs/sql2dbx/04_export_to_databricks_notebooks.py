@@ -26,15 +26,10 @@
 
 # DBTITLE 1,Import Libraries
 import json
-import os
-from dataclasses import asdict
 
 import pandas as pd
-from databricks.sdk import WorkspaceClient
-from databricks.sdk.service import workspace
 
-from scripts.notebook_export_helper import (ExportInput,
-                                                      NotebookExportHelper)
+from scripts.stages.export import export_notebooks
 
 # COMMAND ----------
 
@@ -72,54 +67,12 @@ result_table, output_dir
 
 # COMMAND ----------
 
-# DBTITLE 1,Prepare Export
-helper = NotebookExportHelper()
-df = spark.table(result_table)
-
-exporter_inputs = [ExportInput(input_file_path=row['input_file_path'],
-                               output_dir=output_dir,
-                               code=row['result_content'],
-                               python_parse_error=row['result_python_parse_error'],
-                               sql_parse_error=row['result_sql_parse_errors'],
-                               ) for row in df.collect()]
-results = helper.process_notebooks(exporter_inputs)
-
-# COMMAND ----------
-
 # DBTITLE 1,Export Notebooks
-ws_client = WorkspaceClient()
-
-for output in results:
-    # Create directories if they don't exist
-    os.makedirs(os.path.dirname(output.output_file_path), exist_ok=True)
-
-    # Check the size of the encoded content
-    if output.base64_encoded_content_size > 10 * 1024 * 1024:
-        output.export_error = "Content size exceeds 10MB limit"
-        continue
-
-    try:
-        # Export notebook
-        ws_client.workspace.import_(
-            content=output.base64_encoded_content,
-            path=output.output_file_path,
-            format=workspace.ImportFormat.SOURCE,
-            language=workspace.Language.PYTHON,
-            overwrite=True,
-        )
-        print(f"Exported notebook to {output.output_file_path}")
-        output.export_succeeded = True
-    except Exception as e:
-        output.export_error = str(e)
+export_results_dict = export_notebooks(spark, result_table, output_dir)
 
 # COMMAND ----------
 
 # DBTITLE 1,Display Export Results
-exclude_fields = {'base64_encoded_content'}
-export_results_dict = [
-    {k: v for k, v in output.__dict__.items() if k not in exclude_fields}
-    for output in results
-]
 display(pd.DataFrame(export_results_dict))
 
 # COMMAND ----------
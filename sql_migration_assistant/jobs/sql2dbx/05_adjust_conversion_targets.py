@@ -17,8 +17,8 @@
 # COMMAND ----------
 
 # DBTITLE 1,Import Libraries
-from pyspark.sql.functions import col, when
 from scripts import utils
+from scripts.stages.adjust import adjust_conversion_targets
 
 # COMMAND ----------
 
@@ -70,20 +70,5 @@ display(original_df)
 # COMMAND ----------
 
 # DBTITLE 1,Update Table
-update_df = original_df.withColumn(
-    "is_conversion_target",
-    when(col("input_file_number").isin(set_true_numbers), True)
-    .when(col("input_file_number").isin(set_false_numbers), False)
-    .otherwise(col("is_conversion_target")),
-)
-
+update_df = adjust_conversion_targets(spark, result_table, set_true_numbers, set_false_numbers)
 display(update_df)
-
-# COMMAND ----------
-
-# DBTITLE 1,Writing Output to a Table
-if set_true_numbers or set_false_numbers:
-    update_df.write.mode("overwrite").saveAsTable(result_table)
-    print(f"Changes applied to the result table: {result_table}.")
-else:
-    print("No changes applied to the result table: {result_table} because the parameters are empty.")
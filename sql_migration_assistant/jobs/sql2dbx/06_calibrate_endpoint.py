@@ -0,0 +1,189 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Calibrate Endpoint
+# MAGIC This notebook measures the throughput of a model serving endpoint with a representative sample of the conversion targets and recommends a run profile. The profile can be passed to <a href="$./00_main" target="_blank">00_main</a>, <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a> and <a href="$./03_02_fix_syntax_error" target="_blank">03_02_fix_syntax_error</a> through the `run_profile` parameter.
+# MAGIC
+# MAGIC ## Task Overview
+# MAGIC The following tasks are accomplished in this notebook:
+# MAGIC
+# MAGIC 1. **Sample Selection**: Conversion targets are selected from the result table created by <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>, spread evenly over their token counts.
+# MAGIC 2. **Sweep**: The sample is sent to the endpoint once for every combination of `concurrency_values`, `max_tokens_values` and `timeout_values`, measuring the wall-clock time to finish the sample and error rates.
+# MAGIC 3. **Recommendation**: The combination that finished the sample fastest within `max_error_rate` is written as a JSON run profile to `run_profile_path`.
+# MAGIC
+# MAGIC **Note**: Every trial sends real requests to the endpoint and is billed accordingly. Keep `sample_size` and the number of combinations small.
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Install and import libraries
+
+# COMMAND ----------
+
+# DBTITLE 1,Install Packages
+# MAGIC %pip install -r requirements.txt
+# MAGIC dbutils.library.restartPython()
+
+# COMMAND ----------
+
+# DBTITLE 1,Import Libraries
+import json
+from dataclasses import asdict
+
+import pandas as pd
+from pyspark.sql.functions import col
+
+from scripts import utils
+from scripts.batch_inference_helper import BatchInferenceRequest
+from scripts.endpoint_calibration_helper import (EndpointCalibrationHelper,
+                                                 select_representative_sample)
+from scripts.system_prompts.tsql_conversion_prompt import \
+    TsqlConversionPromptManager
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Set up configuration parameters
+
+# COMMAND ----------
+
+# DBTITLE 1,Configurations
+# Required Parameters
+dbutils.widgets.text("endpoint_name", "", "Serving Endpoint Name (Required)")
+dbutils.widgets.text("result_table", "", "Conversion Result Table (Required)")
+dbutils.widgets.text("run_profile_path", "", "Run Profile Path (Required)")
+
+# Optional Parameters
+dbutils.widgets.dropdown("sql_dialect", "tsql", ["tsql"], "SQL Dialect")
+dbutils.widgets.dropdown("comment_lang", "English", ["English", "Japanese"], "Comment Language")
+dbutils.widgets.text("request_params", '{"max_tokens": 4000, "temperature": 0}', "Chat Request Params")
+dbutils.widgets.text("sample_size", "10", "Sample Size")
+dbutils.widgets.text("concurrency_values", "4, 8, 16", "Concurrency Values")
+dbutils.widgets.text("max_tokens_values", "4000", "Max Tokens Values")
+dbutils.widgets.text("timeout_values", "300", "Timeout Seconds Values")
+dbutils.widgets.text("max_error_rate", "0.05", "Max Error Rate")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Parameters
+# MAGIC
+# MAGIC Parameter Name | Required | Default Value | Description
+# MAGIC --- | --- | --- | ---
+# MAGIC `endpoint_name` | Yes |  | The name of the Databricks Model Serving endpoint to calibrate.
+# MAGIC `result_table` | Yes |  | The name of the conversion result table created by <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>.
+# MAGIC `run_profile_path` | Yes |  | The file path where the recommended run profile is written in JSON format (e.g., `/Volumes/my_catalog/my_schema/my_volume/run_profile.json`).
+# MAGIC `sql_dialect` | Yes | `tsql` | The SQL dialect to be converted. Currently, only tsql is supported.
+# MAGIC `comment_lang` | Yes | `English` | The language for comments to be added to the converted Databricks notebooks.
+# MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | The extra chat HTTP request parameters in JSON format. `max_tokens` is overridden by `max_tokens_values` in each trial.
+# MAGIC `sample_size` | Yes | `10` | The number of conversion targets sent in each trial.
+# MAGIC `concurrency_values` | Yes | `4, 8, 16` | A comma-separated list or range of concurrency values to sweep (e.g., `4, 8-10`).
+# MAGIC `max_tokens_values` | Yes | `4000` | A comma-separated list of `max_tokens` values to sweep.
+# MAGIC `timeout_values` | Yes | `300` | A comma-separated list of client-side timeouts in seconds to sweep.
+# MAGIC `max_error_rate` | Yes | `0.05` | The highest error rate (including timeouts and throttling) a combination may have to be recommended.
+
+# COMMAND ----------
+
+# DBTITLE 1,Load Configurations
+config_endpoint_name = dbutils.widgets.get("endpoint_name")
+config_result_table = dbutils.widgets.get("result_table")
+config_run_profile_path = dbutils.widgets.get("run_profile_path")
+config_sql_dialect = dbutils.widgets.get("sql_dialect")
+config_comment_lang = dbutils.widgets.get("comment_lang")
+config_request_params = json.loads(dbutils.widgets.get("request_params"))
+config_sample_size = int(dbutils.widgets.get("sample_size"))
+config_concurrency_values = utils.parse_number_ranges(dbutils.widgets.get("concurrency_values"))
+config_max_tokens_values = utils.parse_number_ranges(dbutils.widgets.get("max_tokens_values"))
+config_timeout_values = utils.parse_number_ranges(dbutils.widgets.get("timeout_values"))
+config_max_error_rate = float(dbutils.widgets.get("max_error_rate"))
+
+(config_endpoint_name, config_result_table, config_run_profile_path, config_sample_size,
+ config_concurrency_values, config_max_tokens_values, config_timeout_values, config_max_error_rate)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Select a representative sample
+
+# COMMAND ----------
+
+# DBTITLE 1,Select Sample
+token_counts = {
+    row["input_file_number"]: row["input_file_token_count_without_sql_comments"] or 0
+    for row in (spark.table(config_result_table)
+                .filter("is_conversion_target == true")
+                .select("input_file_number", "input_file_token_count_without_sql_comments")
+                .collect())
+}
+sample_numbers = select_representative_sample(token_counts, config_sample_size)
+sample_df = (spark.table(config_result_table)
+             .filter(col("input_file_number").isin(sample_numbers))
+             .select("input_file_number", "input_file_token_count_without_sql_comments",
+                     "input_file_content_without_sql_comments")
+             .toPandas())
+display(sample_df[["input_file_number", "input_file_token_count_without_sql_comments"]])
+
+# COMMAND ----------
+
+# DBTITLE 1,Create Calibration Requests
+if config_sql_dialect == "tsql":
+    manager = TsqlConversionPromptManager(config_comment_lang)
+    system_message = manager.get_system_message()
+    few_shots = manager.get_few_shots()
+
+calibration_requests = [
+    BatchInferenceRequest(
+        index=int(row[0]),
+        text=row[2],
+        system_message=system_message,
+        few_shots=few_shots)
+    for row in sample_df.itertuples(index=False, name=None)
+]
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Run the sweep
+
+# COMMAND ----------
+
+# DBTITLE 1,Sweep Request Settings
+calibration_helper = EndpointCalibrationHelper(
+    endpoint_name=config_endpoint_name,
+    request_params=config_request_params,
+    concurrency_values=config_concurrency_values,
+    max_tokens_values=config_max_tokens_values,
+    timeout_values=config_timeout_values,
+    max_error_rate=config_max_error_rate,
+)
+trial_results = await calibration_helper.sweep(calibration_requests)
+
+# COMMAND ----------
+
+# DBTITLE 1,Display Trial Results
+display(pd.DataFrame([
+    {**asdict(res), "tokens_per_second": res.tokens_per_second, "error_rate": res.error_rate}
+    for res in trial_results
+]))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Save the recommended run profile
+
+# COMMAND ----------
+
+# DBTITLE 1,Save Run Profile
+run_profile = calibration_helper.recommend(trial_results)
+run_profile.save(config_run_profile_path)
+print(f"Recommended run profile: {asdict(run_profile)}")
+print(f"Successfully saved run profile to: {config_run_profile_path}")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Return the run profile path
+
+# COMMAND ----------
+
+# DBTITLE 1,Return Run Profile Path
+dbutils.notebook.exit(config_run_profile_path)
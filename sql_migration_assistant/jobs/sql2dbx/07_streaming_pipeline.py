@@ -0,0 +1,190 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Streaming Pipeline
+# MAGIC This notebook converts the conversion targets of the result table, checks their syntax and fixes their syntax errors in a single streaming pipeline. It replaces running <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a>, <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a> and <a href="$./03_02_fix_syntax_error" target="_blank">03_02_fix_syntax_error</a> one after another.
+# MAGIC
+# MAGIC Those notebooks process the files stage by stage: all files are converted, then all files are checked, then all files with errors are fixed. Each stage waits for the slowest file of the previous one. In this notebook, each file moves to its next stage as soon as its previous stage finishes, so the total time is close to the time of the slowest file rather than the sum of the slowest times of each stage.
+# MAGIC
+# MAGIC ## Task Overview
+# MAGIC The following tasks are accomplished in this notebook:
+# MAGIC
+# MAGIC 1. **Read Data**: The conversion targets are read from the result table created in <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>. The requests are built as in <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a>, with the same system message sections, few-shot library, near-duplicate examples and rule-based transpiler.
+# MAGIC 2. **Streaming Pipeline**: Each file goes through the following stages, connected by bounded queues:
+# MAGIC     - **Convert**: The conversion request is sent to the model serving endpoint and the response is cleaned.
+# MAGIC     - **Check**: The Python function is parsed, and the extracted Spark SQL statements are parsed on the driver.
+# MAGIC     - **Fix**: If there are syntax errors, a fix request is sent and the result is checked again, up to `max_fix_attempts` times.
+# MAGIC 3. **Persist Results**: The results and their syntax check results are merged into the result table. Only the rows of the converted files are rewritten.
+# MAGIC
+# MAGIC The conversion and fix requests share the `concurrency` of the endpoint. If `use_similar_file_examples` is `True`, the first file of each cluster of near-duplicate files goes through the pipeline first, and the other files of the cluster follow with its fixed result as the example. The pipeline logic is implemented in `scripts/stages/streaming.py`.
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Install and import libraries
+
+# COMMAND ----------
+
+# DBTITLE 1,Install Packages
+# MAGIC %pip install -r requirements.txt
+# MAGIC dbutils.library.restartPython()
+
+# COMMAND ----------
+
+# DBTITLE 1,Import Libraries
+import json
+
+from scripts.stages.convert import ConversionConfig, create_prompts
+from scripts.stages.endpoint_config import EndpointConfig
+from scripts.stages.streaming import run_streaming_pipeline
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Set up configuration parameters
+
+# COMMAND ----------
+
+# DBTITLE 1,Configurations
+# Required Parameters
+dbutils.widgets.text("endpoint_name", "", "Serving Endpoint Name (Required)")
+dbutils.widgets.text("result_table", "", "Conversion Result Table (Required)")
+
+# Optional Parameters
+dbutils.widgets.dropdown("sql_dialect", "tsql", ["tsql"], "SQL Dialect")
+dbutils.widgets.dropdown("comment_lang", "English", ["English", "Japanese"], "Comment Language")
+dbutils.widgets.text("request_params", '{"max_tokens": 4000, "temperature": 0}', "Chat Request Params")
+dbutils.widgets.text("concurrency", "10", "Concurrency Requests")
+dbutils.widgets.dropdown("use_similar_file_examples", "True", ["True", "False"], "Use Similar Files as Examples")
+dbutils.widgets.text("few_shot_library_table", "", "Few-Shot Library Table (Optional)")
+dbutils.widgets.text("max_few_shots", "2", "Max Few-Shots per Request")
+dbutils.widgets.text("prompt_token_budget", "24000", "Prompt Token Budget")
+dbutils.widgets.text("token_encoding", "o200k_base", "Token Encoding for LLM")
+dbutils.widgets.dropdown("prompt_sections", "all", ["all", "detected"], "System Message Sections")
+dbutils.widgets.dropdown("use_rule_based_transpiler", "True", ["True", "False"], "Use Rule-Based Transpiler")
+dbutils.widgets.text("max_fix_attempts", "1", "Maximum Fix Attempts")
+dbutils.widgets.text("queue_size", "", "Queue Size (Optional)")
+dbutils.widgets.text("logging_interval", "1", "Logging Interval")
+dbutils.widgets.text("timeout", "300", "Timeout Seconds")
+dbutils.widgets.text("max_retries_backpressure", "20", "Max Retries on Backpressure")
+dbutils.widgets.text("max_retries_other", "5", "Max Retries on Other Errors")
+dbutils.widgets.text("run_profile", "", "Run Profile Path (Optional)")
+dbutils.widgets.text("record_file", "", "Traffic Record File (Optional)")
+dbutils.widgets.text("replay_file", "", "Traffic Replay File (Optional)")
+dbutils.widgets.dropdown("replay_with_original_timing", "False", ["True", "False"], "Replay with Original Timing")
+
+# COMMAND ----------
+
+# MAGIC ## Parameters
+# MAGIC
+# MAGIC Parameter Name | Required | Default Value | Description
+# MAGIC --- | --- | --- | ---
+# MAGIC `endpoint_name` | Yes |  | The name of the Databricks Model Serving endpoint, used for both conversion and syntax error fixing. You can find the endpoint name under the `Serving` tab.
+# MAGIC `result_table` | Yes |  | The name of the conversion result table created by <a href="$./01_analyze_input_files" target="_blank">01_analyze_input_files</a>.
+# MAGIC `sql_dialect` | Yes | `tsql` | The SQL dialect to be converted. Currently, only tsql is supported.
+# MAGIC `comment_lang` | Yes | `English` | The language for comments to be added to the converted Databricks notebooks. Options are English or Japanese.
+# MAGIC `request_params` | Yes | `{"max_tokens": 4000, "temperature": 0}` | The extra chat HTTP request parameters in JSON format (reference: [Databricks Foundation Model APIs](https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request)).
+# MAGIC `concurrency` | Yes | `10` | The number of concurrent requests sent to the model serving endpoint, shared by conversion and syntax error fixing.
+# MAGIC `use_similar_file_examples` | Yes | `True` | If `True`, the other files of each cluster of near-duplicate files are converted with the first file of the cluster as the example. See <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a>.
+# MAGIC `few_shot_library_table` | No |  | A result table of a previous conversion whose verified conversions are used as few-shot examples. See <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a>.
+# MAGIC `max_few_shots` | Yes | `2` | The maximum number of examples selected from `few_shot_library_table` per request.
+# MAGIC `prompt_token_budget` | Yes | `24000` | The maximum prompt tokens per request, including the system message and the input, when adding examples.
+# MAGIC `token_encoding` | Yes | `o200k_base` | The encoding used to count the prompt tokens.
+# MAGIC `prompt_sections` | Yes | `all` | `all` or `detected` guideline sections of the system message. See <a href="$./02_convert_sql_to_databricks" target="_blank">02_convert_sql_to_databricks</a>.
+# MAGIC `use_rule_based_transpiler` | Yes | `True` | If `True`, trivially convertible T-SQL procedures are converted by the rule-based transpiler without the model serving endpoint. Their syntax is checked by the next run of <a href="$./03_01_static_syntax_check" target="_blank">03_01_static_syntax_check</a>.
+# MAGIC `max_fix_attempts` | Yes | `1` | The maximum number of attempts to fix the syntax errors of a file. `0` disables fixing.
+# MAGIC `queue_size` | No |  | The maximum number of files waiting between two stages. If unspecified, twice `concurrency`.
+# MAGIC `logging_interval` | Yes | `1` | The number of requests processed before logging a progress update.
+# MAGIC `timeout` | Yes | `300` | The timeout for an HTTP request on the client side, in seconds.
+# MAGIC `max_retries_backpressure` | Yes | `20` | The maximum number of retries on backpressure status code (such as `429` or `503`).
+# MAGIC `max_retries_other` | Yes | `5` | The maximum number of retries on other errors (such as `5xx`, `408`, or `409`).
+# MAGIC `run_profile` | No |  | The path of a run profile JSON file created by <a href="$./06_calibrate_endpoint" target="_blank">06_calibrate_endpoint</a>. If specified, its `concurrency`, `timeout` and `max_tokens` override `concurrency`, `timeout` and `max_tokens` in `request_params`.
+# MAGIC `record_file` | No |  | If specified, all request/response pairs sent to the endpoint are recorded to this file as gzip-compressed JSON Lines. They are written to a local temporary file as they arrive and copied to this file at the end, so that it can be on a Unity Catalog Volume. If the copy fails, the path of the temporary file is logged.
+# MAGIC `replay_file` | No |  | If specified, responses are served from a file recorded with `record_file` instead of calling the endpoint.
+# MAGIC `replay_with_original_timing` | Yes | `False` | If `True`, replayed responses wait for their recorded latency. If `False`, they are returned at maximum speed.
+
+# COMMAND ----------
+
+# DBTITLE 1,Load Configurations
+# Load configurations from widgets
+config = ConversionConfig(
+    result_table=dbutils.widgets.get("result_table"),
+    endpoint=EndpointConfig(
+        endpoint_name=dbutils.widgets.get("endpoint_name"),
+        request_params=json.loads(
+            dbutils.widgets.get("request_params")
+        ),  # Reference: https://docs.databricks.com/en/machine-learning/foundation-models/api-reference.html#chat-request
+        concurrency=int(dbutils.widgets.get("concurrency")),
+        logging_interval=int(dbutils.widgets.get("logging_interval")),
+        timeout=int(dbutils.widgets.get("timeout")),
+        max_retries_backpressure=int(dbutils.widgets.get("max_retries_backpressure")),
+        max_retries_other=int(dbutils.widgets.get("max_retries_other")),
+        run_profile=dbutils.widgets.get("run_profile") or None,
+        record_file=dbutils.widgets.get("record_file") or None,
+        replay_file=dbutils.widgets.get("replay_file") or None,
+        replay_with_original_timing=dbutils.widgets.get("replay_with_original_timing") == "True",
+    ),
+    sql_dialect=dbutils.widgets.get("sql_dialect"),
+    comment_lang=dbutils.widgets.get("comment_lang"),
+    use_similar_file_examples=dbutils.widgets.get("use_similar_file_examples") == "True",
+    few_shot_library_table=dbutils.widgets.get("few_shot_library_table") or None,
+    max_few_shots=int(dbutils.widgets.get("max_few_shots")),
+    prompt_token_budget=int(dbutils.widgets.get("prompt_token_budget")),
+    token_encoding=dbutils.widgets.get("token_encoding"),
+    prompt_sections=dbutils.widgets.get("prompt_sections"),
+    use_rule_based_transpiler=dbutils.widgets.get("use_rule_based_transpiler") == "True",
+)
+config_max_fix_attempts = int(dbutils.widgets.get("max_fix_attempts"))
+config_queue_size = int(dbutils.widgets.get("queue_size") or 0) or None
+
+# COMMAND ----------
+
+# DBTITLE 1,Apply Run Profile
+config.endpoint.apply_run_profile()
+config.endpoint
+
+# COMMAND ----------
+
+# DBTITLE 1,System Message and Few-Shots
+prompts = create_prompts(config)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Run the streaming pipeline
+# MAGIC The following runs the pipeline and merges the results and their syntax check results into the result table. Only the rows of the converted files are rewritten.
+
+# COMMAND ----------
+
+# DBTITLE 1,Streaming Pipeline
+streaming_result = await run_streaming_pipeline(spark, config, max_fix_attempts=config_max_fix_attempts,
+                                                queue_size=config_queue_size, prompts=prompts)
+
+# COMMAND ----------
+
+# DBTITLE 1,Pipeline Summary
+pipeline_results = streaming_result.results
+file_seconds = [result.elapsed for result in pipeline_results]
+print(f"Files: {len(pipeline_results)}, "
+      f"conversion errors: {sum(1 for r in pipeline_results if r.response.error)}, "
+      f"fixed: {sum(1 for r in pipeline_results if r.fix_attempts and not r.syntax_check.has_errors)}, "
+      f"syntax errors left: {sum(1 for r in pipeline_results if r.syntax_check and r.syntax_check.has_errors)}, "
+      f"converted by the rule-based transpiler: {len(streaming_result.transpiled_responses)}")
+if file_seconds:
+    print(f"Wall-clock time: {streaming_result.elapsed:.1f} s, slowest file: {max(file_seconds):.1f} s, "
+          f"sum of file times: {sum(file_seconds):.1f} s")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Display results
+# MAGIC The following displays the updated rows and the result table.
+
+# COMMAND ----------
+
+# DBTITLE 1,Display Updated Rows
+display(streaming_result.updated_sdf)
+
+# COMMAND ----------
+
+# DBTITLE 1,Display Result Table
+spark.table(config.result_table).display()
@@ -0,0 +1,73 @@
+"""
+Benchmarks creating Spark DataFrames from Python rows against `arrow_dataframe_helper.create_dataframe`.
+
+Run from the sql_migration_assistant directory with pyspark installed:
+
+    python -m jobs.sql2dbx.benchmarks.benchmark_arrow_dataframe --rows 10000 100000 --repeat 3
+
+The rows have the shape of the batch inference results saved by `BatchInferenceResultProcessor`.
+Each timing includes building the DataFrame and counting it, so that the data reaches the JVM.
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+import pyarrow as pa
+from pyspark.sql import SparkSession
+from pyspark.sql.types import (IntegerType, LongType, StringType, StructField,
+                               StructType, TimestampType)
+
+from jobs.sql2dbx.scripts.arrow_dataframe_helper import (ARROW_ENABLED_CONF,
+                                                         create_dataframe,
+                                                         rows_to_arrow_table)
+
+SCHEMA = StructType([
+    StructField("input_file_number", LongType(), True),
+    StructField("result_content", StringType(), True),
+    StructField("result_token_count", IntegerType(), True),
+    StructField("result_error", StringType(), True),
+    StructField("result_timestamp", TimestampType(), True),
+])
+ARROW_SCHEMA = pa.schema([
+    ("input_file_number", pa.int64()),
+    ("result_content", pa.string()),
+    ("result_token_count", pa.int32()),
+    ("result_error", pa.string()),
+    ("result_timestamp", pa.timestamp("us")),
+])
+CONTENT = "# Databricks notebook source\ndef usp_load_sales(run_date):\n    spark.sql(f\"SELECT 1\")\n" * 20
+
+
+def create_rows(num_rows: int) -> list:
+    now = datetime.now()
+    return [(i, CONTENT, 1000 + i % 100, None if i % 10 else "timeout", now) for i in range(num_rows)]
+
+
+def python_rows(spark: SparkSession, rows: list) -> int:
+    spark.conf.set(ARROW_ENABLED_CONF, "false")
+    return spark.createDataFrame(rows, schema=SCHEMA).count()
+
+
+def arrow_table(spark: SparkSession, rows: list) -> int:
+    return create_dataframe(spark, rows_to_arrow_table(rows, ARROW_SCHEMA), SCHEMA).count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="The numbers of rows.")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs per implementation.")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    for num_rows in args.rows:
+        rows = create_rows(num_rows)
+        print(f"Rows: {num_rows:,}")
+        for name, func in [("python rows", python_rows), ("arrow table", arrow_table)]:
+            func(spark, rows[:100])  # Warm up
+            seconds = min(timeit.repeat(lambda: func(spark, rows), number=1, repeat=args.repeat))
+            print(f"{name:>12}: {seconds:.3f} s ({num_rows / seconds:,.0f} rows/s)")
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmarks the single-pass `utils.remove_sql_comments` against the previous regex implementation.
+
+Run from the sql_migration_assistant directory:
+
+    python -m jobs.sql2dbx.benchmarks.benchmark_remove_sql_comments --size-mb 4 --repeat 5
+
+The `typical` case is dense with comments and literals. The `markers_in_literals` case contains
+`/*` inside string literals only, which makes the lazy block comment regex of the previous
+implementation rescan to the end of the text from every marker (quadratic time), so keep it small.
+"""
+import argparse
+import re
+import timeit
+
+from jobs.sql2dbx.scripts import utils
+
+SQL_BLOCK = """-- Load daily sales
+/* Header comment
+   /* with a nested comment */
+*/
+CREATE PROCEDURE dbo.usp_LoadSales @RunDate DATE
+AS
+BEGIN
+    SET NOCOUNT ON;   -- no row counts
+
+
+    INSERT INTO [dbo].[Sales--Archive] (Id, Note)
+    SELECT s.Id, N'It''s -- not a comment /* either */'
+    FROM dbo.Sales AS s /* inline */ WHERE s.SaleDate = @RunDate;
+END
+"""
+SQL_BLOCKS = {
+    "typical": SQL_BLOCK,
+    "markers_in_literals": "SELECT '/*' AS pattern FROM dbo.Patterns;\n",
+}
+
+
+def legacy_remove_sql_comments(sql_text: str) -> str:
+    """The previous implementation: three regex passes plus whitespace normalization."""
+    no_line_comments = re.sub(r'--.*', '', sql_text)
+    no_comments = re.sub(r'/\*.*?\*/', '', no_line_comments, flags=re.DOTALL)
+    no_comments = re.sub(r'\n\s*\n', '\n\n', no_comments)
+    return re.sub(r'\s+', ' ', no_comments)
+
+
+def single_pass_remove_sql_comments(sql_text: str) -> str:
+    return utils.remove_sql_comments(sql_text, normalize_whitespace=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=4.0, help="The size of the generated SQL text in MB.")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of timed runs per implementation.")
+    parser.add_argument("--case", choices=sorted(SQL_BLOCKS), default="typical", help="The generated SQL text.")
+    args = parser.parse_args()
+
+    block = SQL_BLOCKS[args.case]
+    sql_text = block * max(1, int(args.size_mb * 1024 * 1024 / len(block)))
+    print(f"Input size: {len(sql_text) / 1024 / 1024:.1f} MB")
+    for name, func in [("legacy (regex)", legacy_remove_sql_comments),
+                       ("single pass", single_pass_remove_sql_comments)]:
+        seconds = min(timeit.repeat(lambda: func(sql_text), number=1, repeat=args.repeat))
+        print(f"{name:>15}: {seconds:.3f} s ({len(sql_text) / 1024 / 1024 / seconds:.1f} MB/s), "
+              f"output {len(func(sql_text)):,} chars")
+
+
+if __name__ == "__main__":
+    main()
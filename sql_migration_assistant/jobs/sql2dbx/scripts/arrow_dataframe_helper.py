@@ -0,0 +1,57 @@
+"""
+This module builds Spark DataFrames from pyarrow tables with explicit schemas.
+
+Creating a DataFrame from a list of Python objects converts every row to the JVM one by one, which takes
+seconds for tens of thousands of rows. A pyarrow table is handed to Spark as Arrow record batches instead.
+The module does not import pyspark, so that it can be used and tested without a Spark session.
+"""
+from typing import Any, Iterable, Sequence
+
+import pyarrow as pa
+
+ARROW_ENABLED_CONF = "spark.sql.execution.arrow.pyspark.enabled"
+
+
+def rows_to_arrow_table(rows: Iterable[Sequence[Any]], schema: pa.Schema) -> pa.Table:
+    """
+    Builds a pyarrow table from rows of Python values, converting them column by column.
+
+    Args:
+        rows (Iterable[Sequence[Any]]): The rows, each with one value per schema field in schema order.
+        schema (pa.Schema): The Arrow schema of the table.
+
+    Returns:
+        pa.Table: The table with the given schema.
+    """
+    rows = list(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.Table.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def create_dataframe(spark, table: pa.Table, schema):
+    """
+    Creates a Spark DataFrame from a pyarrow table with an explicit schema.
+
+    Spark Connect sessions and Spark 4.0 or later accept the table as it is. Otherwise the table is
+    converted to pandas, and the DataFrame is created with Arrow-based conversion, which this function enables.
+
+    Args:
+        spark (pyspark.sql.SparkSession): The Spark session.
+        table (pa.Table): The data. Columns that are not in the schema are ignored.
+        schema (pyspark.sql.types.StructType): The schema of the DataFrame. Its field names select the table columns.
+
+    Returns:
+        pyspark.sql.DataFrame: The DataFrame.
+    """
+    table = table.select(schema.fieldNames())
+    if _accepts_arrow_tables(spark):
+        return spark.createDataFrame(table, schema=schema)
+    spark.conf.set(ARROW_ENABLED_CONF, "true")
+    # Keep integers with nulls as Python ints instead of floats, so they match integer schema fields
+    return spark.createDataFrame(table.to_pandas(integer_object_nulls=True), schema=schema)
+
+
+def _accepts_arrow_tables(spark) -> bool:
+    """Returns True if spark.createDataFrame accepts pyarrow tables."""
+    return type(spark).__module__.startswith("pyspark.sql.connect") or int(spark.version.split(".")[0]) >= 4
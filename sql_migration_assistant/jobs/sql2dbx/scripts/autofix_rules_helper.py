@@ -0,0 +1,303 @@
+"""
+This module fixes common syntax errors of converted code locally with deterministic rules, before the files are sent
+to a model serving endpoint to be fixed.
+
+Each rule is selected by the text of a failing Spark SQL statement, or by a Python parse error, and rewrites the code
+through its AST. A rewrite is only kept if the code is parsed again and has fewer syntax errors than before, so the
+rules never make a file worse.
+"""
+import ast
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .spark_sql_extract_helper import SparkSQLExtractHelper
+from .statement_repair_helper import SQL_ERROR_INDEX_PATTERN
+from .streaming_pipeline_helper import SyntaxCheckResult, check_syntax
+from .utils import to_snake_case
+
+MARKDOWN_FENCE_PATTERN = re.compile(r"^[ \t]*```[\w-]*[ \t]*$", re.MULTILINE)
+# ROLLBACK and SAVE TRANSACTION are left to the LLM fix, as removing them would drop the error handling
+TRANSACTION_PATTERN = re.compile(
+    r"^\s*(BEGIN\s+(TRAN|TRANSACTION)|COMMIT)(\s+(TRAN|TRANSACTION|WORK))?(\s+\w+)?\s*;?\s*$",
+    re.IGNORECASE)
+TEMP_TABLE_PREFIX_PATTERN = re.compile(r"(?<![\w#])#(?=[A-Za-z_])")
+VARIABLE_PREFIX_PATTERN = re.compile(r"(?<![\w@])@([A-Za-z_]\w*)")
+
+_KEYWORDS = r"(?:INNER|JOIN|LEFT|RIGHT|FULL|CROSS|OUTER|ON|WHERE|SET|FROM)\b"
+_TABLE = r"[\w.`{}\[\]]+"
+_ALIAS = rf"(?:\s+(?:AS\s+)?(?!{_KEYWORDS})(\w+))?"
+UPDATE_FROM_PATTERN = re.compile(
+    rf"^(\s*)UPDATE\s+({_TABLE})\s+SET\s+(.+?)\s+FROM\s+({_TABLE}){_ALIAS}"
+    rf"(?:\s+(?:INNER\s+)?JOIN\s+({_TABLE}){_ALIAS}\s+ON\s+(.+?))?(?:\s+WHERE\s+(.+?))?(\s*;?\s*)$",
+    re.IGNORECASE | re.DOTALL)
+
+
+@dataclass
+class AutoFixResult:
+    """
+    Data class for storing the result of the local fixes of a converted file.
+
+    Attributes:
+        content (str): The fixed content, or the original content if no rule could be applied.
+        syntax_check (SyntaxCheckResult): The syntax check result of the content.
+        applied_rules (List[str]): The names of the applied rules, in order.
+    """
+    content: str
+    syntax_check: SyntaxCheckResult
+    applied_rules: List[str] = field(default_factory=list)
+
+
+def _get_line_offsets(content: str) -> List[int]:
+    """Returns the UTF-8 byte offset of the start of each line, because AST column offsets are in bytes."""
+    offsets = [0]
+    for line in content.encode("utf-8").split(b"\n")[:-1]:
+        offsets.append(offsets[-1] + len(line) + 1)
+    return offsets
+
+
+def replace_segments(content: str, replacements: List[Tuple[ast.AST, str]]) -> str:
+    """Replaces the source segments of non-overlapping AST nodes with new text."""
+    offsets = _get_line_offsets(content)
+    encoded = content.encode("utf-8")
+    spans = sorted(((offsets[node.lineno - 1] + node.col_offset, offsets[node.end_lineno - 1] + node.end_col_offset, text)
+                    for node, text in replacements), reverse=True)
+    for start, end, text in spans:
+        encoded = encoded[:start] + text.encode("utf-8") + encoded[end:]
+    return encoded.decode("utf-8")
+
+
+def split_string_literal(source: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Splits the source of a single string literal into its prefix, quote and body.
+    Returns None for bytes and implicitly concatenated literals, e.g. `"a" "b"`.
+    """
+    match = re.match(r"^([rRuUfF]*)('''|\"\"\"|'|\")", source)
+    if not match or not source.endswith(match.group(2)) or len(source) < len(match.group(0)) + len(match.group(2)):
+        return None
+    prefix, quote = match.group(1), match.group(2)
+    body = source[len(prefix) + len(quote):len(source) - len(quote)]
+    if re.search(r"(?<!\\)" + re.escape(quote), body):
+        return None
+    return prefix, quote, body
+
+
+class AutoFixEngine:
+    # Rule names and the failing SQL statements they are tried for. None marks rules for Python parse errors.
+    RULES: Dict[str, Optional[re.Pattern]] = {
+        "markdown_fences": None,
+        "transaction_control": TRANSACTION_PATTERN,
+        "temp_table_prefix": TEMP_TABLE_PREFIX_PATTERN,
+        "variable_prefix": VARIABLE_PREFIX_PATTERN,
+        "update_from": re.compile(r"^\s*UPDATE\b.*\bFROM\b", re.IGNORECASE | re.DOTALL),
+    }
+
+    # An upper bound of the rewrites of a file, as a safeguard
+    MAX_REWRITES = 100
+
+    def __init__(self, parse_sql: Callable[[str], Any], rules: Optional[List[str]] = None):
+        """
+        Initialize the AutoFixEngine.
+
+        Args:
+            parse_sql (Callable[[str], Any]): Parses a SQL statement and raises an exception on syntax errors,
+                e.g. `spark._jsparkSession.sessionState().sqlParser().parsePlan`.
+            rules (Optional[List[str]]): The names of the rules to apply. None applies all rules of `RULES`.
+        """
+        self.parse_sql = parse_sql
+        self.rules = rules if rules is not None else list(self.RULES)
+        unknown_rules = set(self.rules) - set(self.RULES)
+        if unknown_rules:
+            raise ValueError(f"Unsupported rules: {sorted(unknown_rules)}. Supported rules are: {list(self.RULES)}")
+
+    def fix(self, content: str, syntax_check: Optional[SyntaxCheckResult] = None) -> AutoFixResult:
+        """
+        Applies the rules to a converted file one rewrite at a time.
+
+        A rewrite is kept if it does not add syntax errors, because a statement may need several rules, e.g. both
+        `temp_table_prefix` and `variable_prefix`. The rules only remove the patterns they are selected by, so the
+        rewrites end. The rewritten content is only returned if it has fewer syntax errors than the original.
+
+        Args:
+            content (str): The converted Python code.
+            syntax_check (Optional[SyntaxCheckResult]): The syntax check result of the content. Checked if None.
+
+        Returns:
+            AutoFixResult: The fixed content, its syntax check result and the applied rules.
+        """
+        original = AutoFixResult(content, syntax_check or check_syntax(content, self.parse_sql))
+        result = original
+        for _ in range(self.MAX_REWRITES):
+            if not result.syntax_check.has_errors:
+                break
+            for rule, candidate in self._generate_candidates(result.content, result.syntax_check):
+                candidate_check = check_syntax(candidate, self.parse_sql)
+                if not self._is_worse(result.syntax_check, candidate_check):
+                    result = AutoFixResult(candidate, candidate_check, result.applied_rules + [rule])
+                    break
+            else:
+                break
+        # The rewrites are only returned if the original has more errors
+        return result if self._is_worse(result.syntax_check, original.syntax_check) else original
+
+    @staticmethod
+    def _is_worse(before: SyntaxCheckResult, after: SyntaxCheckResult) -> bool:
+        """Returns True if `after` has more syntax errors than `before`, where a Python parse error is the worst."""
+        if after.python_parse_error or before.python_parse_error:
+            return bool(after.python_parse_error) and not before.python_parse_error
+        return len(after.sql_parse_errors) > len(before.sql_parse_errors)
+
+    def _generate_candidates(self, content: str, syntax_check: SyntaxCheckResult):
+        """Yields the rule name and the rewritten content of each rule that applies to an error."""
+        if syntax_check.python_parse_error:
+            if "markdown_fences" in self.rules:
+                candidate = MARKDOWN_FENCE_PATTERN.sub("", content)
+                if candidate != content:
+                    yield "markdown_fences", candidate
+            return
+        helper = SparkSQLExtractHelper()
+        helper.extract_sql_from_string(content)
+        tree = ast.parse(content)
+        calls = {(node.lineno, node.col_offset): node for node in ast.walk(tree) if isinstance(node, ast.Call)}
+        for error in syntax_check.sql_parse_errors:
+            match = SQL_ERROR_INDEX_PATTERN.match(error)
+            if not match or int(match.group(1)) >= len(helper.sql_calls):
+                continue
+            index = int(match.group(1))
+            call = helper.sql_calls[index]
+            call = calls[(call.lineno, call.col_offset)]
+            for rule in self.rules:
+                pattern = self.RULES[rule]
+                if pattern is None or not pattern.search(syntax_check.extracted_sqls[index]):
+                    continue
+                candidate = getattr(self, f"_fix_{rule}")(content, tree, call)
+                if candidate and candidate != content:
+                    yield rule, candidate
+
+    @staticmethod
+    def _get_query_literals(tree: ast.AST, call: ast.Call) -> List[ast.expr]:
+        """
+        Returns the string literals that build the query of a `spark.sql` call: the literals of the argument, or of
+        the last assignment of the query variable before the call and the `+=` assignments after it.
+        """
+        arg = call.args[0]
+        values = [arg]
+        if isinstance(arg, ast.Name):
+            assignments = []
+            for node in ast.walk(tree):
+                target = node.targets[0] if isinstance(node, ast.Assign) else getattr(node, "target", None)
+                if isinstance(node, (ast.Assign, ast.AugAssign)) and node.lineno < call.lineno \
+                        and isinstance(target, ast.Name) and target.id == arg.id:
+                    assignments.append(node)
+            assignments.sort(key=lambda node: node.lineno)
+            starts = [i for i, node in enumerate(assignments) if isinstance(node, ast.Assign)]
+            values = [node.value for node in assignments[starts[-1]:]] if starts else []
+        literals = []
+        f_string_parts = set()
+        for value in values:
+            # ast.walk visits an f-string before its parts, which are not literals of their own
+            for node in ast.walk(value):
+                if id(node) in f_string_parts:
+                    continue
+                if isinstance(node, ast.JoinedStr):
+                    literals.append(node)
+                    f_string_parts.update(id(child) for child in ast.walk(node) if child is not node)
+                elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                    literals.append(node)
+        return literals
+
+    def _rewrite_literals(self, content: str, tree: ast.AST, call: ast.Call,
+                          rewrite: Callable[[str, str], Optional[Tuple[str, str]]]) -> Optional[str]:
+        """
+        Rewrites the query literals of a call with a function that takes the prefix and body of a literal and returns
+        the new ones, or None to leave the literal unchanged.
+        """
+        replacements = []
+        for literal in self._get_query_literals(tree, call):
+            parts = split_string_literal(ast.get_source_segment(content, literal) or "")
+            if parts is None:
+                continue
+            prefix, quote, body = parts
+            rewritten = rewrite(prefix, body)
+            if rewritten is not None:
+                replacements.append((literal, f"{rewritten[0]}{quote}{rewritten[1]}{quote}"))
+        return replace_segments(content, replacements) if replacements else None
+
+    @staticmethod
+    def _fix_transaction_control(content: str, tree: ast.AST, call: ast.Call) -> Optional[str]:
+        """Replaces a `spark.sql` statement with BEGIN TRANSACTION or COMMIT with `pass`."""
+        stmt = next((node for node in ast.walk(tree) if isinstance(node, ast.Expr) and node.value is call), None)
+        if stmt is None:
+            return None
+        lines = content.split("\n")
+        first_line, last_line = lines[stmt.lineno - 1], lines[stmt.end_lineno - 1]
+        # The statement must be on its own lines, e.g. not `x = 1; spark.sql("COMMIT")`
+        if first_line.encode("utf-8")[:stmt.col_offset].strip() \
+                or last_line.encode("utf-8")[stmt.end_col_offset:].strip().startswith(b";"):
+            return None
+        indent = first_line[:len(first_line) - len(first_line.lstrip())]
+        lines[stmt.lineno - 1:stmt.end_lineno] = [
+            f"{indent}pass  # Transaction control is not supported in Spark SQL and was removed by autofix"]
+        return "\n".join(lines)
+
+    def _fix_temp_table_prefix(self, content: str, tree: ast.AST, call: ast.Call) -> Optional[str]:
+        """Removes `#` from temporary table names, as the conversion guidelines do."""
+        def rewrite(prefix: str, body: str) -> Optional[Tuple[str, str]]:
+            new_body = TEMP_TABLE_PREFIX_PATTERN.sub("", body)
+            return (prefix, new_body) if new_body != body else None
+        return self._rewrite_literals(content, tree, call, rewrite)
+
+    def _fix_variable_prefix(self, content: str, tree: ast.AST, call: ast.Call) -> Optional[str]:
+        """
+        Replaces `@name` with an f-string reference to the Python variable `name`, or its snake case, e.g.
+        `@OrderID` with `{order_id}`. The literal is left unchanged if any of its variables is not defined.
+        """
+        python_names = ({node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)}
+                        | {node.arg for node in ast.walk(tree) if isinstance(node, ast.arg)})
+
+        def resolve(name: str) -> Optional[str]:
+            return next((n for n in (name, to_snake_case(name)) if n in python_names), None)
+
+        def rewrite(prefix: str, body: str) -> Optional[Tuple[str, str]]:
+            names = VARIABLE_PREFIX_PATTERN.findall(body)
+            if not names or any(resolve(name) is None for name in names):
+                return None
+            if "f" not in prefix.lower():
+                if "u" in prefix.lower():
+                    return None
+                body = body.replace("{", "{{").replace("}", "}}")
+                prefix = "f" + prefix
+            return prefix, VARIABLE_PREFIX_PATTERN.sub(lambda m: "{" + resolve(m.group(1)) + "}", body)
+        return self._rewrite_literals(content, tree, call, rewrite)
+
+    def _fix_update_from(self, content: str, tree: ast.AST, call: ast.Call) -> Optional[str]:
+        """
+        Rewrites a simple `UPDATE ... SET ... FROM ... [JOIN ... ON ...] [WHERE ...]` in a single literal
+        to `MERGE INTO`. Statements with subqueries or outer joins are left unchanged.
+        """
+        def rewrite(prefix: str, body: str) -> Optional[Tuple[str, str]]:
+            match = UPDATE_FROM_PATTERN.match(body)
+            if not match or re.search(r"\bSELECT\b", body, re.IGNORECASE):
+                return None
+            (leading, target, set_clause, from_table, from_alias,
+             join_table, join_alias, on_clause, where_clause, trailing) = match.groups()
+            from_source = f"{from_table} {from_alias}" if from_alias else from_table
+            if join_table is None:
+                # UPDATE t SET ... FROM s WHERE t.id = s.id: the WHERE condition joins the target and the source
+                if where_clause is None or target in (from_table, from_alias):
+                    return None
+                merge_target, source, condition, matched_condition = target, from_source, where_clause, None
+            else:
+                join_source = f"{join_table} {join_alias}" if join_alias else join_table
+                if target in (from_table, from_alias):
+                    merge_target, source = from_source, join_source
+                elif target in (join_table, join_alias):
+                    merge_target, source = join_source, from_source
+                else:
+                    return None
+                condition, matched_condition = on_clause, where_clause
+            separator = "\n" + leading.lstrip("\r\n") if "\n" in body.strip() else " "
+            merge = (f"MERGE INTO {merge_target}{separator}USING {source}{separator}ON {condition}{separator}"
+                     f"WHEN MATCHED{f' AND ({matched_condition})' if matched_condition else ''} THEN UPDATE SET {set_clause}")
+            return prefix, f"{leading}{merge}{trailing}"
+        return self._rewrite_literals(content, tree, call, rewrite)
@@ -3,10 +3,17 @@ This module provides asynchronous batch inference capabilities for LLM API inter
 It includes an AsyncChatClient for API communication and a BatchInferenceManager for handling batch processing.
 """
 import asyncio
+import gzip
+import hashlib
 import json
 import logging
+import os
+import shutil
+import tempfile
 import time
 import traceback
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -59,6 +66,11 @@ class AsyncChatClient:
     This client handles API communication, including request formatting,
     error handling, and response processing. It implements a retry mechanism
     for handling transient errors and rate limiting.
+
+    The client can also record every request/response pair to a gzip-compressed
+    JSON Lines file (`record_file`) and serve them back later without calling
+    the endpoint (`replay_file`). Replayed responses are matched by the request
+    payload, so a replay is deterministic for the same inputs.
     """
 
     def __init__(
@@ -69,6 +81,9 @@ class AsyncChatClient:
         max_retries_backpressure: int = 20,
         max_retries_other: int = 5,
         log_level: int = logging.INFO,
+        record_file: Optional[str] = None,
+        replay_file: Optional[str] = None,
+        replay_with_original_timing: bool = False,
     ):
         """
         Initialize the AsyncChatClient with the given parameters.
@@ -80,15 +95,39 @@ class AsyncChatClient:
             max_retries_backpressure (int): Maximum number of retries for backpressure errors.
             max_retries_other (int): Maximum number of retries for other errors.
             log_level (int): The logging level for the client.
+            record_file (Optional[str]): If specified, request/response pairs are recorded to this file. They are
+                written to a local temporary file as they arrive and copied to this file on close, so that it can
+                be on storage without append support such as a Unity Catalog Volume. An existing file is overwritten.
+            replay_file (Optional[str]): If specified, responses are served from this recording instead of the endpoint.
+            replay_with_original_timing (bool): If True, replayed responses wait for their recorded latency.
+                Otherwise they are returned at maximum speed.
         """
+        if record_file and replay_file:
+            raise ValueError("record_file and replay_file cannot be specified at the same time.")
         self.client = httpx.AsyncClient(timeout=timeout)
         self.endpoint_name = endpoint_name
         self.request_params = request_params
         self.max_retries_backpressure = max_retries_backpressure
         self.max_retries_other = max_retries_other
+        self.record_file = record_file
+        self.replay_file = replay_file
+        self.replay_with_original_timing = replay_with_original_timing
+        self._recorded_count = 0
+        self._record_temp_file: Optional[str] = None
+        self._record_executor: Optional[ThreadPoolExecutor] = None
+        self._replay_exchanges: Dict[str, deque] = self._load_recording(replay_file) if replay_file else {}
         self.logger = setup_logger('AsyncChatClient', level=log_level)
         self.logger.info(f"Initialized AsyncChatClient with endpoint: {endpoint_name}")
         self.logger.info(f"Request parameters: {self.request_params}")
+        if record_file:
+            # A single thread writes the recording, so that the event loop never waits for file I/O
+            fd, self._record_temp_file = tempfile.mkstemp(prefix="sql2dbx_recording_", suffix=".jsonl.gz")
+            os.close(fd)
+            self._record_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncChatClientRecorder")
+            self.logger.info(f"Recording traffic to: {record_file} (temporary file: {self._record_temp_file})")
+        if replay_file:
+            self.logger.info(f"Replaying traffic from: {replay_file} "
+                             f"({sum(len(v) for v in self._replay_exchanges.values())} recorded responses)")
 
     @staticmethod
     def _is_backpressure(error: httpx.HTTPStatusError) -> bool:
@@ -145,13 +184,6 @@ class AsyncChatClient:
         )
         async def _predict_with_retry():
             try:
-                credentials = get_databricks_host_creds("databricks")
-                url = f"{credentials.host}/serving-endpoints/{self.endpoint_name}/invocations"
-                headers = {
-                    "Authorization": f"Bearer {credentials.token}",
-                    "Content-Type": "application/json",
-                }
-
                 messages = self._initialize_messages(request)
                 self.logger.debug(f"Initialized messages for request {request.index}: "
                                   f"{json.dumps(messages, ensure_ascii=False)}")
@@ -161,14 +193,7 @@ class AsyncChatClient:
 
                 while True:
                     self.logger.info(f"Sending request for index: {request.index}")
-                    response = await self.client.post(
-                        url=url,
-                        headers=headers,
-                        json={"messages": messages, **self.request_params},
-                    )
-                    self.logger.info(f"Received response for index: {request.index}, status: {response.status_code}")
-                    response.raise_for_status()
-                    response_data = response.json()
+                    response_data = await self._send({"messages": messages, **self.request_params}, request.index)
 
                     content = response_data["choices"][0]["message"]["content"]
                     finish_reason = response_data["choices"][0]["finish_reason"]
@@ -199,6 +224,89 @@ class AsyncChatClient:
 
         return await _predict_with_retry()
 
+    async def _send(self, payload: Dict[str, Any], index: int) -> Dict[str, Any]:
+        """
+        Send a single chat request, or serve it from the recording in replay mode.
+
+        Args:
+            payload (Dict[str, Any]): The JSON payload of the chat request.
+            index (int): The index of the request, used for logging.
+
+        Returns:
+            Dict[str, Any]: The JSON response data.
+
+        Raises:
+            httpx.HTTPStatusError: If the endpoint returns an error status.
+            LookupError: If no recorded response matches the payload in replay mode.
+        """
+        key = self._payload_key(payload)
+        if self.replay_file:
+            exchanges = self._replay_exchanges.get(key)
+            if not exchanges:
+                raise LookupError(f"No recorded response for index {index} in {self.replay_file}")
+            exchange = exchanges.popleft()
+            if self.replay_with_original_timing:
+                await asyncio.sleep(exchange["elapsed"])
+            self.logger.info(f"Replayed response for index: {index}")
+            return exchange["response"]
+
+        credentials = get_databricks_host_creds("databricks")
+        url = f"{credentials.host}/serving-endpoints/{self.endpoint_name}/invocations"
+        headers = {
+            "Authorization": f"Bearer {credentials.token}",
+            "Content-Type": "application/json",
+        }
+        start_time = time.time()
+        response = await self.client.post(url=url, headers=headers, json=payload)
+        elapsed = time.time() - start_time
+        self.logger.info(f"Received response for index: {index}, status: {response.status_code}")
+        response.raise_for_status()
+        response_data = response.json()
+        if self._record_executor:
+            self._record_executor.submit(self._append_recording,
+                                         {"key": key, "elapsed": round(elapsed, 3), "response": response_data})
+        return response_data
+
+    @staticmethod
+    def _payload_key(payload: Dict[str, Any]) -> str:
+        """Return a stable hash of a request payload, used to match recorded responses."""
+        serialized = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _load_recording(replay_file: str) -> Dict[str, deque]:
+        """Load a recording, grouping responses by payload key in their recorded order."""
+        exchanges = defaultdict(deque)
+        with gzip.open(replay_file, "rt", encoding="utf-8") as file:
+            for line in file:
+                exchange = json.loads(line)
+                exchanges[exchange["key"]].append(exchange)
+        return exchanges
+
+    def _append_recording(self, exchange: Dict[str, Any]) -> None:
+        """
+        Append an exchange to the temporary recording as a gzip-compressed JSON line. Each append adds a complete
+        gzip member, which gzip reads as one stream, so the exchanges recorded before a crash can still be replayed.
+        Runs on the recorder thread. Errors are logged, so that they never fail the request.
+        """
+        try:
+            line = json.dumps(exchange, ensure_ascii=False, separators=(",", ":")) + "\n"
+            with open(self._record_temp_file, "ab") as file:
+                file.write(gzip.compress(line.encode("utf-8")))
+            self._recorded_count += 1
+        except Exception as e:
+            self.logger.error(f"Failed to record a response to {self._record_temp_file}: {str(e)}")
+
+    def _save_recording(self) -> None:
+        """Copy the temporary recording to record_file. Runs on the recorder thread after the last append."""
+        try:
+            shutil.copyfile(self._record_temp_file, self.record_file)
+            os.remove(self._record_temp_file)
+            self.logger.info(f"Recorded {self._recorded_count} responses to: {self.record_file}")
+        except Exception as e:
+            self.logger.error(f"Failed to save the recording to {self.record_file}: {str(e)}. "
+                              f"The recording is kept at: {self._record_temp_file}")
+
     def _initialize_messages(self, request: 'BatchInferenceRequest') -> List[Dict[str, str]]:
         """
         Initialize the message list with system message, few-shot examples, and user message.
@@ -226,6 +334,10 @@ class AsyncChatClient:
         to ensure proper resource cleanup.
         """
         await self.client.aclose()
+        if self._record_executor:
+            await asyncio.wrap_future(self._record_executor.submit(self._save_recording))
+            self._record_executor.shutdown()
+            self._record_executor = None
         self.logger.info("Closed AsyncChatClient")
 
 
@@ -253,68 +365,79 @@ class BatchInferenceManager:
         self.client = client
         self.concurrency = concurrency
         self.logging_interval = logging_interval
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._counter = AsyncCounter()
+        self._start_time = time.time()
         self.logger = setup_logger('BatchInferenceManager', level=log_level)
         self.logger.info(f"Initialized BatchInferenceManager with concurrency: {concurrency}")
 
-    async def _generate(self, i: int, request: BatchInferenceRequest,
-                        semaphore: asyncio.Semaphore, counter: 'AsyncCounter',
-                        start_time: float) -> BatchInferenceResponse:
+    def start_batch(self) -> None:
+        """
+        Start a new batch: reset the concurrency limit, the progress counter and the start time used by
+        `generate_one`. Call it before the first `generate_one` of a batch run in a new event loop.
         """
-        Generate a response for a single text input.
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._counter = AsyncCounter()
+        self._start_time = time.time()
+
+    async def generate_one(self, request: BatchInferenceRequest, i: Optional[int] = None) -> BatchInferenceResponse:
+        """
+        Generate a response for a single request, within the concurrency limit of the current batch.
 
         Args:
-            i (int): The iteration number.
             request (BatchInferenceRequest): The request data containing text, system message, and few-shots.
-            semaphore (asyncio.Semaphore): Semaphore for controlling concurrency.
-            counter (AsyncCounter): Counter for tracking progress.
-            start_time (float): The start time of the batch process.
+            i (Optional[int]): The position of the request in the batch, used for logging.
 
         Returns:
             BatchInferenceResponse: The response object containing the result or error information.
         """
-        async with semaphore:
+        if self._semaphore is None:
+            self.start_batch()
+        name = f"request {i} (index {request.index})" if i is not None else f"index {request.index}"
+        async with self._semaphore:
             try:
-                self.logger.info(f"Starting generation for request {i} (index {request.index})")
+                self.logger.info(f"Starting generation for {name}")
                 content, num_tokens = await self.client.predict(request)
                 response = BatchInferenceResponse(index=request.index, content=content,
                                                   token_count=num_tokens, error=None)
-                self.logger.info(f"Completed generation for request {i} (index {request.index})")
+                self.logger.info(f"Completed generation for {name}")
             except httpx.HTTPStatusError as e:
-                self.logger.error(f"HTTP error in generation for request {i} (index {request.index}): {str(e)}")
+                self.logger.error(f"HTTP error in generation for {name}: {str(e)}")
                 response = BatchInferenceResponse(index=request.index, content=None, token_count=0, error=str(e))
             except httpx.RequestError as e:
-                self.logger.error(f"Request error in generation for request {i} (index {request.index}): {str(e)}")
+                self.logger.error(f"Request error in generation for {name}: {str(e)}")
                 response = BatchInferenceResponse(index=request.index, content=None, token_count=0, error=str(e))
             except Exception as e:
-                self.logger.error(f"Unexpected error in generation for request {i} (index {request.index}): {str(e)}")
+                self.logger.error(f"Unexpected error in generation for {name}: {str(e)}")
                 self.logger.error(f"Traceback: {traceback.format_exc()}")
                 response = BatchInferenceResponse(index=request.index, content=None, token_count=0, error=str(e))
 
-            await counter.increment()
-            if counter.value % self.logging_interval == 0:
-                elapsed_time = time.time() - start_time
-                self.logger.info(f"Processed total {counter.value} requests in {elapsed_time:.2f} seconds.")
+            await self._counter.increment()
+            if self._counter.value % self.logging_interval == 0:
+                elapsed_time = time.time() - self._start_time
+                self.logger.info(f"Processed total {self._counter.value} requests in {elapsed_time:.2f} seconds.")
             return response
 
-    async def batch_inference(self, requests: List[BatchInferenceRequest]) -> List[BatchInferenceResponse]:
+    async def batch_inference(self, requests: List[BatchInferenceRequest],
+                              close_client: bool = True) -> List[BatchInferenceResponse]:
         """
         Perform batch inference on a list of requests.
 
         Args:
             requests (List[BatchInferenceRequest]): A list of BatchInferenceRequest objects for each input.
+            close_client (bool): If True, the client is closed afterwards. Set it to False to run another batch
+                with the same client, e.g. requests that depend on the responses of this batch.
 
         Returns:
             List[BatchInferenceResponse]: A list of BatchInferenceResponse objects containing the results.
         """
         self.logger.info(f"Starting batch inference for {len(requests)} requests")
-        semaphore = asyncio.Semaphore(self.concurrency)
-        counter = AsyncCounter()
-        start_time = time.time()
+        self.start_batch()
 
-        tasks = [self._generate(i, request, semaphore, counter, start_time)
-                 for i, request in enumerate(requests)]
+        tasks = [self.generate_one(request, i) for i, request in enumerate(requests)]
         responses = await asyncio.gather(*tasks)
-        await self.client.close()
+        if close_client:
+            await self.client.close()
 
         self.logger.info(f"Completed batch inference for {len(requests)} requests")
         return responses
@@ -11,6 +11,14 @@ class ConversionResultCleanHelper:
         """
         return [self.clean_python_code_blocks]
 
+    def clean(self, text: str) -> str:
+        """
+        Applies all cleaning functions of `get_udf_functions` to the text in order.
+        """
+        for clean_func in self.get_udf_functions():
+            text = clean_func(text)
+        return text
+
     def clean_python_code_blocks(self, text: str) -> str:
         """
         Extracts code blocks delimited by `python` and removes any intervening `python` occurrences.
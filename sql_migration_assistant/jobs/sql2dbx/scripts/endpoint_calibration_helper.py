@@ -0,0 +1,248 @@
+"""
+This module provides throughput calibration for a model serving endpoint.
+It sweeps concurrency, max_tokens and timeout over a sample of requests, measures the wall-clock time to
+finish the sample and error rates, and recommends a RunProfile that the conversion and fix notebooks can consume.
+"""
+import itertools
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .batch_inference_helper import (AsyncChatClient, BatchInferenceManager,
+                                     BatchInferenceRequest)
+from .utils import setup_logger
+
+
+@dataclass
+class RunProfile:
+    """
+    A class to represent a recommended run profile for a model serving endpoint.
+
+    Attributes:
+        endpoint_name (str): The name of the endpoint the profile was calibrated against.
+        concurrency (int): The recommended number of concurrent requests.
+        max_tokens (int): The recommended `max_tokens` request parameter.
+        timeout (int): The recommended client-side timeout in seconds.
+        elapsed_seconds (Optional[float]): The wall-clock time to finish the calibration sample with these settings.
+        tokens_per_second (Optional[float]): The total tokens per second measured with these settings, for reference.
+        error_rate (Optional[float]): The error rate measured with these settings.
+        created_at (Optional[str]): The UTC timestamp when the profile was created.
+    """
+    endpoint_name: str
+    concurrency: int
+    max_tokens: int
+    timeout: int
+    elapsed_seconds: Optional[float] = None
+    tokens_per_second: Optional[float] = None
+    error_rate: Optional[float] = None
+    created_at: Optional[str] = field(default=None)
+
+    def apply_request_params(self, request_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns a copy of the request parameters with `max_tokens` taken from the profile."""
+        return {**request_params, "max_tokens": self.max_tokens}
+
+    def save(self, path: str) -> None:
+        """Saves the profile as a JSON file (e.g. in a Unity Catalog Volume or the Workspace)."""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(asdict(self), file, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'RunProfile':
+        """Loads a profile previously written by `save`."""
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(**json.load(file))
+
+
+@dataclass
+class CalibrationTrialResult:
+    """
+    A class to represent the measurements of a single calibration trial.
+
+    Attributes:
+        concurrency (int): The concurrency used in the trial.
+        max_tokens (int): The `max_tokens` request parameter used in the trial.
+        timeout (int): The client-side timeout used in the trial.
+        request_count (int): The number of requests sent.
+        error_count (int): The number of requests that ended with an error.
+        total_tokens (int): The total number of tokens reported by the endpoint, including the prompts sent again for
+            continuations and retries.
+        elapsed_seconds (float): The wall-clock time to finish all requests of the trial.
+    """
+    concurrency: int
+    max_tokens: int
+    timeout: int
+    request_count: int
+    error_count: int
+    total_tokens: int
+    elapsed_seconds: float
+
+    @property
+    def tokens_per_second(self) -> float:
+        """
+        The total tokens per second, for reference only. Settings that need more continuations, such as a smaller
+        max_tokens, send the prompts again and count more tokens for the same work, so trials are not ranked by it.
+        """
+        return self.total_tokens / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.error_count / self.request_count if self.request_count > 0 else 0.0
+
+
+def select_representative_sample(token_counts: Dict[int, int], sample_size: int) -> List[int]:
+    """
+    Selects keys spread evenly over the token count distribution, so the sample covers small and large inputs.
+
+    Args:
+        token_counts (Dict[int, int]): A mapping of input_file_number to token count.
+        sample_size (int): The number of keys to select.
+
+    Returns:
+        List[int]: The selected input_file_number values, ordered by token count.
+    """
+    ordered = sorted(token_counts, key=lambda k: (token_counts[k], k))
+    if sample_size >= len(ordered):
+        return ordered
+    if sample_size <= 1:
+        return ordered[len(ordered) // 2:len(ordered) // 2 + 1]
+    step = (len(ordered) - 1) / (sample_size - 1)
+    return [ordered[round(i * step)] for i in range(sample_size)]
+
+
+class EndpointCalibrationHelper:
+    """
+    Sweeps request settings against a model serving endpoint and recommends a RunProfile.
+    """
+
+    def __init__(
+        self,
+        endpoint_name: str,
+        request_params: Dict[str, Any],
+        concurrency_values: List[int],
+        max_tokens_values: List[int],
+        timeout_values: List[int],
+        max_error_rate: float = 0.05,
+        max_retries_backpressure: int = 3,
+        max_retries_other: int = 1,
+        log_level: int = logging.INFO,
+    ):
+        """
+        Initialize the EndpointCalibrationHelper.
+
+        Args:
+            endpoint_name (str): The name of the API endpoint.
+            request_params (Dict[str, Any]): Base request parameters. `max_tokens` is overridden per trial.
+            concurrency_values (List[int]): The concurrency values to sweep.
+            max_tokens_values (List[int]): The `max_tokens` values to sweep.
+            timeout_values (List[int]): The client-side timeout values to sweep, in seconds.
+            max_error_rate (float): The highest error rate a trial may have to be recommended.
+            max_retries_backpressure (int): Retries on backpressure errors. Kept low so throttling shows up as errors.
+            max_retries_other (int): Retries on other errors.
+            log_level (int): The logging level for the helper.
+        """
+        self.endpoint_name = endpoint_name
+        self.request_params = request_params
+        self.concurrency_values = concurrency_values
+        self.max_tokens_values = max_tokens_values
+        self.timeout_values = timeout_values
+        self.max_error_rate = max_error_rate
+        self.max_retries_backpressure = max_retries_backpressure
+        self.max_retries_other = max_retries_other
+        self.log_level = log_level
+        self.logger = setup_logger('EndpointCalibrationHelper', level=log_level)
+
+    async def run_trial(self, requests: List[BatchInferenceRequest], concurrency: int,
+                        max_tokens: int, timeout: int) -> CalibrationTrialResult:
+        """
+        Sends all requests with the given settings and measures throughput and errors.
+
+        Args:
+            requests (List[BatchInferenceRequest]): The sample requests.
+            concurrency (int): The number of concurrent requests.
+            max_tokens (int): The `max_tokens` request parameter.
+            timeout (int): The client-side timeout in seconds.
+
+        Returns:
+            CalibrationTrialResult: The measurements of the trial.
+        """
+        self.logger.info(f"Starting trial: concurrency={concurrency}, max_tokens={max_tokens}, timeout={timeout}")
+        manager = BatchInferenceManager(
+            client=AsyncChatClient(
+                endpoint_name=self.endpoint_name,
+                request_params={**self.request_params, "max_tokens": max_tokens},
+                timeout=timeout,
+                max_retries_backpressure=self.max_retries_backpressure,
+                max_retries_other=self.max_retries_other,
+                log_level=self.log_level,
+            ),
+            concurrency=concurrency,
+            logging_interval=max(len(requests), 1),
+            log_level=self.log_level,
+        )
+        start_time = time.time()
+        responses = await manager.batch_inference(requests)
+        elapsed_seconds = time.time() - start_time
+
+        result = CalibrationTrialResult(
+            concurrency=concurrency,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            request_count=len(responses),
+            error_count=sum(1 for res in responses if res.error is not None),
+            total_tokens=sum(res.token_count for res in responses),
+            elapsed_seconds=elapsed_seconds,
+        )
+        self.logger.info(f"Finished trial: {result.elapsed_seconds:.1f} seconds, "
+                         f"{result.tokens_per_second:.1f} tokens/sec, error rate {result.error_rate:.2%}")
+        return result
+
+    async def sweep(self, requests: List[BatchInferenceRequest]) -> List[CalibrationTrialResult]:
+        """
+        Runs one trial for every combination of concurrency, max_tokens and timeout.
+
+        Trials run one after another so they do not compete for the endpoint's capacity.
+        """
+        results = []
+        for max_tokens, timeout, concurrency in itertools.product(
+                self.max_tokens_values, self.timeout_values, self.concurrency_values):
+            results.append(await self.run_trial(requests, concurrency, max_tokens, timeout))
+        return results
+
+    def recommend(self, results: List[CalibrationTrialResult]) -> RunProfile:
+        """
+        Recommends the trial that finished the sample fastest among those within the error rate limit.
+
+        All trials send the same sample, so the wall-clock time compares the settings for the same work, including
+        the continuations of truncated responses. If no trial is within the limit, the trial with the lowest error
+        rate is recommended instead. Ties are broken in favour of lower concurrency.
+
+        Args:
+            results (List[CalibrationTrialResult]): The results of a sweep.
+
+        Returns:
+            RunProfile: The recommended run profile.
+        """
+        if not results:
+            raise ValueError("At least one calibration trial result is required.")
+
+        acceptable = [res for res in results if res.error_rate <= self.max_error_rate]
+        if acceptable:
+            best = min(acceptable, key=lambda res: (res.elapsed_seconds, res.concurrency))
+        else:
+            self.logger.warning(f"No trial had an error rate at or below {self.max_error_rate:.2%}. "
+                                f"Recommending the trial with the lowest error rate.")
+            best = min(results, key=lambda res: (res.error_rate, res.elapsed_seconds, res.concurrency))
+
+        return RunProfile(
+            endpoint_name=self.endpoint_name,
+            concurrency=best.concurrency,
+            max_tokens=best.max_tokens,
+            timeout=best.timeout,
+            elapsed_seconds=round(best.elapsed_seconds, 2),
+            tokens_per_second=round(best.tokens_per_second, 2),
+            error_rate=round(best.error_rate, 4),
+            created_at=datetime.now(timezone.utc).isoformat(),
+        )
@@ -0,0 +1,85 @@
+"""
+This module selects few-shot examples for each conversion request from a library of verified conversion pairs.
+Examples are ranked by the TF-IDF cosine similarity of their normalized SQL tokens to the input, and the most
+similar ones are selected as long as they fit the token budget of the request.
+"""
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from .similarity_cluster_helper import normalize_sql_tokens
+from .utils import TokenCounter
+
+
+@dataclass
+class FewShotExample:
+    """Data class for storing a verified conversion pair, e.g. from a previous result table."""
+    source_sql: str
+    converted_code: str
+
+
+class FewShotSelector:
+    def __init__(self, examples: List[FewShotExample], token_counter: TokenCounter,
+                 max_examples: int = 2, min_similarity: float = 0.1):
+        """
+        Initialize the FewShotSelector and index the examples.
+
+        Args:
+            examples (List[FewShotExample]): The library of verified conversion pairs.
+            token_counter (TokenCounter): Counts the tokens of the examples, with the encoding of the model.
+            max_examples (int): The maximum number of examples selected for a request.
+            min_similarity (float): Examples less similar to the input than this are never selected.
+        """
+        self.examples = examples
+        self.max_examples = max_examples
+        self.min_similarity = min_similarity
+        term_counts = [Counter(normalize_sql_tokens(e.source_sql)) for e in examples]
+        document_frequencies = Counter(term for counts in term_counts for term in counts)
+        self._idf = {term: math.log((1 + len(examples)) / (1 + df)) + 1 for term, df in document_frequencies.items()}
+        self._vectors = [self._to_vector(counts) for counts in term_counts]
+        self.token_counts = token_counter.count_tokens_batch(
+            [e.source_sql + e.converted_code for e in examples]) if examples else []
+
+    def _to_vector(self, term_counts: Counter) -> Dict[str, float]:
+        """Returns the L2-normalized TF-IDF vector of the term counts. Terms unknown to the library are ignored."""
+        vector = {term: (1 + math.log(count)) * self._idf[term]
+                  for term, count in term_counts.items() if term in self._idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def select(self, sql_text: str, token_budget: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Selects the most similar examples for the input that fit the token budget.
+
+        Args:
+            sql_text (str): The input SQL.
+            token_budget (Optional[int]): The maximum total tokens of the selected examples. None has no limit.
+
+        Returns:
+            List[Dict[str, str]]: The examples as user and assistant messages, with the most similar example last,
+                closest to the input. Empty if no example is similar enough or fits the budget.
+        """
+        query = self._to_vector(Counter(normalize_sql_tokens(sql_text)))
+        scores = []
+        for i, vector in enumerate(self._vectors):
+            similarity = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            if similarity >= self.min_similarity and self.examples[i].source_sql != sql_text:
+                scores.append((similarity, i))
+
+        selected = []
+        remaining_budget = token_budget
+        for _, i in sorted(scores, reverse=True):
+            if len(selected) >= self.max_examples:
+                break
+            if remaining_budget is not None:
+                if self.token_counts[i] > remaining_budget:
+                    continue
+                remaining_budget -= self.token_counts[i]
+            selected.append(self.examples[i])
+
+        few_shots = []
+        for example in reversed(selected):
+            few_shots.append({"role": "user", "content": example.source_sql})
+            few_shots.append({"role": "assistant", "content": example.converted_code})
+        return few_shots
@@ -0,0 +1,86 @@
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List
+
+
+@dataclass
+class FileManifestEntry:
+    """Data class for storing the manifest entry of an input file."""
+    input_file_path: str
+    input_file_size: int
+    input_file_mtime: float
+    input_file_content_hash: str
+
+
+@dataclass
+class FileManifestDiff:
+    """Data class for storing the differences between the input files and a previous manifest."""
+    new: List[FileManifestEntry] = field(default_factory=list)
+    changed: List[FileManifestEntry] = field(default_factory=list)
+    unchanged: List[FileManifestEntry] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    @property
+    def entries(self) -> List[FileManifestEntry]:
+        """Returns the manifest entries of all current files, to be saved as the next manifest."""
+        return self.new + self.changed + self.unchanged
+
+
+class FileManifestHelper:
+    def __init__(self, hash_block_size: int = 1024 * 1024):
+        """Initialize the FileManifestHelper with the block size used for hashing file contents."""
+        self.hash_block_size = hash_block_size
+
+    def diff(self, file_paths: Iterable[str], previous: Dict[str, FileManifestEntry]) -> FileManifestDiff:
+        """
+        Compares the input files with a previous manifest.
+
+        A file whose size and modification time match its previous entry is unchanged without being read.
+        Otherwise its content hash is computed, and the file is only reported as changed if the hash differs.
+
+        Args:
+            file_paths (Iterable[str]): The paths of the current input files.
+            previous (Dict[str, FileManifestEntry]): The previous manifest, keyed by input_file_path.
+
+        Returns:
+            FileManifestDiff: The new, changed, unchanged and removed files.
+        """
+        result = FileManifestDiff()
+        seen_paths = set()
+        for file_path in file_paths:
+            seen_paths.add(file_path)
+            stat = os.stat(file_path)
+            previous_entry = previous.get(file_path)
+            if (previous_entry and previous_entry.input_file_size == stat.st_size
+                    and previous_entry.input_file_mtime == stat.st_mtime):
+                result.unchanged.append(previous_entry)
+                continue
+
+            entry = FileManifestEntry(
+                input_file_path=file_path,
+                input_file_size=stat.st_size,
+                input_file_mtime=stat.st_mtime,
+                input_file_content_hash=self.compute_content_hash(file_path),
+            )
+            if previous_entry is None:
+                result.new.append(entry)
+            elif previous_entry.input_file_content_hash != entry.input_file_content_hash:
+                result.changed.append(entry)
+            else:
+                result.unchanged.append(entry)  # Touched but not modified
+
+        result.removed = [path for path in previous if path not in seen_paths]
+        return result
+
+    def create_entries(self, file_paths: Iterable[str]) -> List[FileManifestEntry]:
+        """Creates manifest entries for the given files, e.g. to build the first manifest of a result table."""
+        return self.diff(file_paths, previous={}).new
+
+    def compute_content_hash(self, file_path: str) -> str:
+        """Returns the SHA-256 hex digest of a file's content."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(self.hash_block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
@@ -1,48 +1,371 @@
-import re
+import itertools
+import math
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
 
 from . import utils
 
 
-@dataclass
+@dataclass(slots=True)
 class FileTokenMetadata:
-    """Data class for storing metadata of a file with token counts."""
+    """Data class for storing metadata of a file with token counts. Slots keep per-file overhead small."""
     input_file_number: Optional[int]
     input_file_path: str
     input_file_encoding: str
+    input_file_encoding_confidence: Optional[float]
     input_file_content: str
     input_file_content_without_sql_comments: Optional[str]
-    input_file_token_count: int
+    input_file_token_count: Optional[int]
     input_file_token_count_without_sql_comments: Optional[int]
     tiktoken_encoding: str
 
 
+FILE_TOKEN_METADATA_ARROW_SCHEMA = pa.schema([
+    ("input_file_number", pa.int32()),
+    ("input_file_path", pa.string()),
+    ("input_file_encoding", pa.string()),
+    ("input_file_encoding_confidence", pa.float64()),
+    ("input_file_content", pa.string()),
+    ("input_file_content_without_sql_comments", pa.string()),
+    ("input_file_token_count", pa.int32()),
+    ("input_file_token_count_without_sql_comments", pa.int32()),
+    ("tiktoken_encoding", pa.string()),
+])
+
+
+def to_record_batch(results: List[FileTokenMetadata]) -> pa.RecordBatch:
+    """Converts FileTokenMetadata objects to an Arrow record batch with FILE_TOKEN_METADATA_ARROW_SCHEMA."""
+    return pa.RecordBatch.from_arrays(
+        [pa.array([getattr(res, name) for res in results], type=field.type)
+         for name, field in zip(FILE_TOKEN_METADATA_ARROW_SCHEMA.names, FILE_TOKEN_METADATA_ARROW_SCHEMA)],
+        schema=FILE_TOKEN_METADATA_ARROW_SCHEMA)
+
+
+def to_record_batches(results: Iterable[FileTokenMetadata], max_batch_rows: int = 10000,
+                      max_batch_bytes: int = 256 * 1024 * 1024) -> Iterator[pa.RecordBatch]:
+    """
+    Groups FileTokenMetadata objects into Arrow record batches of bounded size.
+
+    A batch is closed when it reaches `max_batch_rows` files or when the file contents in it reach
+    `max_batch_bytes` characters, whichever comes first, so memory use does not grow with the number of files.
+    """
+    batch, batch_bytes = [], 0
+    for res in results:
+        batch.append(res)
+        batch_bytes += len(res.input_file_content) + len(res.input_file_content_without_sql_comments or "")
+        if len(batch) >= max_batch_rows or batch_bytes >= max_batch_bytes:
+            yield to_record_batch(batch)
+            batch, batch_bytes = [], 0
+    if batch:
+        yield to_record_batch(batch)
+
+
+def _chunked(items: Iterable, chunk_size: int) -> Iterator[list]:
+    """Yields lists of up to chunk_size consecutive items."""
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
+
+
+@dataclass
+class TokenEstimator:
+    """
+    Approximates token counts from character statistics without running the tokenizer.
+
+    The estimate is a linear combination of the number of characters, the number of whitespace-separated
+    words and the number of extra UTF-8 bytes (a proxy for non-ASCII text, which needs more tokens per
+    character). The coefficients are fitted with `calibrate` against exact counts of a sample.
+
+    Error bounds: `relative_error_bound` is the `quantile` (95% by default) of the relative error
+    |estimate - exact| / exact measured on the calibration sample. For files from the same corpus,
+    about that share of exact counts lies within `bounds(estimate)`. The bound is corpus specific and
+    should be checked before relying on estimates: it is small for homogeneous SQL code and grows for
+    corpora that mix languages or contain large data literals.
+
+    Attributes:
+        char_coefficient (float): Tokens per character.
+        word_coefficient (float): Tokens per whitespace-separated word.
+        extra_byte_coefficient (float): Tokens per extra UTF-8 byte.
+        relative_error_bound (float): The relative error bound of estimates.
+    """
+    char_coefficient: float = 0.25
+    word_coefficient: float = 0.0
+    extra_byte_coefficient: float = 0.0
+    relative_error_bound: float = 0.5
+
+    @staticmethod
+    def features(text: str) -> Tuple[int, int, int]:
+        """Returns the character, word and extra UTF-8 byte counts of a text."""
+        return len(text), len(text.split()), len(text.encode('utf-8', errors='replace')) - len(text)
+
+    def estimate(self, text: str) -> int:
+        """Returns the estimated number of tokens in a text string."""
+        chars, words, extra_bytes = self.features(text)
+        return max(0, round(self.char_coefficient * chars + self.word_coefficient * words
+                            + self.extra_byte_coefficient * extra_bytes))
+
+    def bounds(self, estimate: int) -> Tuple[float, float]:
+        """Returns the range of exact counts that are consistent with an estimate within the error bound."""
+        upper = estimate / (1 - self.relative_error_bound) if self.relative_error_bound < 1 else math.inf
+        return estimate / (1 + self.relative_error_bound), upper
+
+    def is_near(self, estimate: int, threshold: int) -> bool:
+        """Returns True if the exact count may be on either side of the threshold."""
+        lower, upper = self.bounds(estimate)
+        return lower <= threshold < upper
+
+    @classmethod
+    def calibrate(cls, texts: List[str], token_counts: List[int], quantile: float = 0.95) -> 'TokenEstimator':
+        """
+        Fits an estimator to exact token counts of sample texts.
+
+        Args:
+            texts (List[str]): The sample texts.
+            token_counts (List[int]): The exact token counts of the texts.
+            quantile (float): The quantile of the relative errors used as the error bound.
+
+        Returns:
+            TokenEstimator: The calibrated estimator. With fewer than 3 non-empty texts, the default estimator.
+        """
+        pairs = [(text, count) for text, count in zip(texts, token_counts) if text]
+        if len(pairs) < 3:
+            return cls()
+        features = np.array([cls.features(text) for text, _ in pairs], dtype=float)
+        counts = np.array([count for _, count in pairs], dtype=float)
+        coefficients = np.linalg.lstsq(features, counts, rcond=None)[0]
+        estimator = cls(*(float(c) for c in coefficients))
+        errors = [abs(estimator.estimate(text) - count) / max(count, 1) for text, count in pairs]
+        estimator.relative_error_bound = float(np.quantile(errors, quantile))
+        return estimator
+
+
 class FileTokenCountHelper:
-    def __init__(self, token_encoding: str = "o200k_base"):
-        """Initialize the FileTokenCounter with a specified token encoding."""
+    def __init__(self, token_encoding: str = "o200k_base", count_raw_tokens: bool = True, num_threads: int = 8,
+                 estimator: Optional[TokenEstimator] = None, recount_threshold: Optional[int] = None):
+        """
+        Initialize the FileTokenCounter with a specified token encoding.
+
+        Args:
+            token_encoding (str): The tiktoken encoding used for token counting.
+            count_raw_tokens (bool): If False, the tokens of the raw content of SQL files are not counted and
+                input_file_token_count is None. Only the count without SQL comments decides the conversion targets.
+            num_threads (int): The number of threads used to encode a batch of files.
+            estimator (Optional[TokenEstimator]): If given, token counts are estimated instead of counted.
+            recount_threshold (Optional[int]): With an estimator, SQL files whose estimated count without
+                comments may be on either side of this threshold are counted exactly.
+        """
         self.token_encoding = token_encoding
+        self.count_raw_tokens = count_raw_tokens
+        self.num_threads = num_threads
+        self.estimator = estimator
+        self.recount_threshold = recount_threshold
         self.token_counter = utils.TokenCounter(token_encoding)
+        self.encoding_detector = utils.EncodingDetector()
 
     def process_directory(self, input_dir: str, file_encoding: Optional[str] = None,
-                          is_sql: bool = True) -> List[FileTokenMetadata]:
+                          is_sql: bool = True, max_workers: Optional[int] = 1,
+                          chunk_size: int = 64, approximate: bool = False,
+                          recount_threshold: Optional[int] = None,
+                          calibration_sample_size: int = 200,
+                          file_filter: Optional[utils.FileFilter] = None) -> List[FileTokenMetadata]:
         """
         Process all files in a directory and return a list of FileTokenMetadata objects with file details.
 
         Args:
-            input_dir (str): The directory containing the files to be processed.
-            file_encoding (Optional[str]): The encoding to use for reading the files. If not specified, the encoding is automatically detected using chardet.detect.
+            input_dir (str): The directory containing the files to be processed, or a zip or tar archive
+                whose files are processed without extracting it (see `iter_archive`).
+            file_encoding (Optional[str]): The encoding to use for reading the files. If not specified, the encoding is automatically detected with utils.EncodingDetector.
             is_sql (bool): Flag indicating whether the files are SQL files. If True, SQL comments will be removed for token counting.
+            max_workers (Optional[int]): The number of worker processes. 1 processes files in the current process; None uses all CPU cores.
+            chunk_size (int): The number of files tokenized as one batch and submitted to a worker process as one task.
+            approximate (bool): If True, token counts are estimated with a TokenEstimator calibrated on a sample of the files.
+            recount_threshold (Optional[int]): In approximate mode, SQL files whose estimate is near this threshold
+                (e.g. token_count_threshold) are counted exactly.
+            calibration_sample_size (int): The number of files counted exactly to calibrate the estimator.
+            file_filter (Optional[utils.FileFilter]): Selects the files to process. If None, all files are processed.
 
         Returns:
-            List[FileTokenMetadata]: A list of metadata objects for each processed file.
+            List[FileTokenMetadata]: A list of metadata objects for each processed file, in input_file_number order.
         """
-        results = []
-        for i, file_path in enumerate(utils.list_files_recursively(input_dir), start=1):
-            sql_file_token_metadata = self.process_file(
-                input_file_path=file_path, input_file_number=i, file_encoding=file_encoding, is_sql=is_sql)
-            results.append(sql_file_token_metadata)
-        return results
+        if utils.is_archive(input_dir):
+            helper = self
+            if approximate:
+                helper = self.create_estimating_helper_for_archive(input_dir, file_encoding=file_encoding,
+                                                                   is_sql=is_sql, recount_threshold=recount_threshold,
+                                                                   sample_size=calibration_sample_size,
+                                                                   file_filter=file_filter)
+            return list(helper.iter_archive(input_dir, file_encoding=file_encoding, is_sql=is_sql,
+                                            max_workers=max_workers, chunk_size=chunk_size,
+                                            file_filter=file_filter))
+
+        numbered_paths = list(enumerate(utils.iter_files(input_dir, file_filter), start=1))
+        if approximate:
+            helper = self.create_estimating_helper(numbered_paths, file_encoding=file_encoding, is_sql=is_sql,
+                                                   recount_threshold=recount_threshold,
+                                                   sample_size=calibration_sample_size)
+            return helper.process_files(numbered_paths, file_encoding=file_encoding, is_sql=is_sql,
+                                        max_workers=max_workers, chunk_size=chunk_size)
+        return self.process_files(numbered_paths, file_encoding=file_encoding, is_sql=is_sql,
+                                  max_workers=max_workers, chunk_size=chunk_size)
+
+    def create_estimating_helper(self, numbered_paths: List[Tuple[int, str]], file_encoding: Optional[str] = None,
+                                 is_sql: bool = True, recount_threshold: Optional[int] = None,
+                                 sample_size: int = 200, seed: int = 0) -> 'FileTokenCountHelper':
+        """
+        Calibrates a TokenEstimator on a random sample of the files and returns a helper that uses it.
+
+        Args:
+            numbered_paths (List[Tuple[int, str]]): Pairs of input_file_number and input_file_path to sample from.
+            file_encoding (Optional[str]): The encoding to use for reading the files.
+            is_sql (bool): Flag indicating whether the files are SQL files.
+            recount_threshold (Optional[int]): The threshold near which the returned helper counts exactly.
+            sample_size (int): The number of files counted exactly for calibration.
+            seed (int): The seed of the random sample.
+
+        Returns:
+            FileTokenCountHelper: A helper with the same settings, the calibrated estimator and the recount threshold.
+        """
+        sample = random.Random(seed).sample(numbered_paths, min(sample_size, len(numbered_paths)))
+        return self._create_calibrated_helper(self.process_files(sample, file_encoding=file_encoding, is_sql=is_sql),
+                                              recount_threshold)
+
+    def create_estimating_helper_for_archive(self, archive_path: str, file_encoding: Optional[str] = None,
+                                             is_sql: bool = True, recount_threshold: Optional[int] = None,
+                                             sample_size: int = 200,
+                                             file_filter: Optional[utils.FileFilter] = None) -> 'FileTokenCountHelper':
+        """
+        Calibrates a TokenEstimator on the first files of an archive and returns a helper that uses it.
+
+        Archives such as tar.gz can only be read sequentially, so the sample is not random.
+        Takes the same arguments as `create_estimating_helper`, and `file_filter` of `iter_archive`.
+        """
+        sample = itertools.islice(self.iter_archive(archive_path, file_encoding=file_encoding, is_sql=is_sql,
+                                                    file_filter=file_filter),
+                                  sample_size)
+        return self._create_calibrated_helper(list(sample), recount_threshold)
+
+    def _create_calibrated_helper(self, sample: List[FileTokenMetadata],
+                                  recount_threshold: Optional[int]) -> 'FileTokenCountHelper':
+        """Returns a helper with the same settings and a TokenEstimator calibrated on the exact counts of the sample."""
+        texts, counts = [], []
+        for res in sample:
+            for text, count in [(res.input_file_content, res.input_file_token_count),
+                                (res.input_file_content_without_sql_comments,
+                                 res.input_file_token_count_without_sql_comments)]:
+                if text is not None and count is not None:
+                    texts.append(text)
+                    counts.append(count)
+        return FileTokenCountHelper(self.token_encoding, count_raw_tokens=self.count_raw_tokens,
+                                    num_threads=self.num_threads, estimator=TokenEstimator.calibrate(texts, counts),
+                                    recount_threshold=recount_threshold)
+
+    def process_files(self, numbered_paths: List[Tuple[int, str]], file_encoding: Optional[str] = None,
+                      is_sql: bool = True, max_workers: Optional[int] = 1,
+                      chunk_size: int = 64) -> List[FileTokenMetadata]:
+        """
+        Process the given files and return a list of FileTokenMetadata objects with file details.
+
+        Args:
+            numbered_paths (List[Tuple[int, str]]): Pairs of input_file_number and input_file_path to be processed.
+            file_encoding (Optional[str]): The encoding to use for reading the files. If not specified, the encoding is automatically detected with utils.EncodingDetector.
+            is_sql (bool): Flag indicating whether the files are SQL files. If True, SQL comments will be removed for token counting.
+            max_workers (Optional[int]): The number of worker processes. 1 processes files in the current process; None uses all CPU cores.
+            chunk_size (int): The number of files tokenized as one batch and submitted to a worker process as one task.
+
+        Returns:
+            List[FileTokenMetadata]: A list of metadata objects for each processed file, in the given order.
+        """
+        return list(self.iter_files(numbered_paths, file_encoding=file_encoding, is_sql=is_sql,
+                                    max_workers=max_workers, chunk_size=chunk_size))
+
+    def iter_files(self, numbered_paths: List[Tuple[int, str]], file_encoding: Optional[str] = None,
+                   is_sql: bool = True, max_workers: Optional[int] = 1,
+                   chunk_size: int = 64) -> Iterator[FileTokenMetadata]:
+        """
+        Process the given files and yield FileTokenMetadata objects one by one, in the given order.
+
+        Takes the same arguments as `process_files`. Only the chunks being processed are held in memory.
+        """
+        chunks = _chunked(numbered_paths, chunk_size)
+        if max_workers == 1:
+            for chunk in chunks:
+                yield from _process_chunk(chunk, file_encoding, is_sql, helper=self)
+        else:
+            yield from self._process_in_pool(chunks, _process_chunk, file_encoding, is_sql, max_workers)
+
+    def iter_archive(self, archive_path: str, file_encoding: Optional[str] = None, is_sql: bool = True,
+                     max_workers: Optional[int] = 1, chunk_size: int = 64,
+                     file_filter: Optional[utils.FileFilter] = None) -> Iterator[FileTokenMetadata]:
+        """
+        Process the files in a zip or tar archive without extracting it, and yield FileTokenMetadata objects.
+
+        Files are numbered in archive order, and their paths within the archive are recorded as input_file_path.
+        Only the chunks being processed are held in memory.
+
+        Args:
+            archive_path (str): The path of the archive (see utils.is_archive for the supported formats).
+            file_encoding (Optional[str]): The encoding to use for reading the files. If not specified, the encoding is automatically detected with utils.EncodingDetector.
+            is_sql (bool): Flag indicating whether the files are SQL files. If True, SQL comments will be removed for token counting.
+            max_workers (Optional[int]): The number of worker processes. 1 processes files in the current process; None uses all CPU cores.
+            chunk_size (int): The number of files tokenized as one batch and submitted to a worker process as one task.
+            file_filter (Optional[utils.FileFilter]): Selects the files to process by their path within the archive.
+                Files that are not selected are skipped without being read.
+
+        Yields:
+            FileTokenMetadata: Metadata objects for each file in the archive, in archive order.
+        """
+        numbered_contents = ((number, path, content) for number, (path, content)
+                             in enumerate(utils.iter_archive_members(archive_path, file_filter), start=1))
+        chunks = _chunked(numbered_contents, chunk_size)
+        if max_workers == 1:
+            for chunk in chunks:
+                yield from self.process_contents(chunk, file_encoding=file_encoding, is_sql=is_sql)
+        else:
+            yield from self._process_in_pool(chunks, _process_contents_chunk, file_encoding, is_sql, max_workers)
+
+    def iter_record_batches(self, numbered_paths: List[Tuple[int, str]], file_encoding: Optional[str] = None,
+                            is_sql: bool = True, max_workers: Optional[int] = 1, chunk_size: int = 64,
+                            max_batch_rows: int = 10000,
+                            max_batch_bytes: int = 256 * 1024 * 1024) -> Iterator[pa.RecordBatch]:
+        """
+        Process the given files and yield the results as Arrow record batches of bounded size.
+
+        Takes the same arguments as `iter_files`, and `max_batch_rows` and `max_batch_bytes` of `to_record_batches`.
+
+        Returns:
+            Iterator[pa.RecordBatch]: Record batches with FILE_TOKEN_METADATA_ARROW_SCHEMA.
+        """
+        results = self.iter_files(numbered_paths, file_encoding=file_encoding, is_sql=is_sql,
+                                  max_workers=max_workers, chunk_size=chunk_size)
+        return to_record_batches(results, max_batch_rows=max_batch_rows, max_batch_bytes=max_batch_bytes)
+
+    def _process_in_pool(self, chunks: Iterator[list], task: Callable[..., List[FileTokenMetadata]],
+                         file_encoding: Optional[str], is_sql: bool,
+                         max_workers: Optional[int]) -> Iterator[FileTokenMetadata]:
+        """
+        Process chunks of files with a task function in a process pool, yielding results in submission order.
+
+        Chunks are submitted through a bounded window of in-flight tasks, so results of
+        finished chunks do not pile up while an earlier chunk is still running.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(self.token_encoding, self.count_raw_tokens, self.num_threads,
+                                           self.estimator, self.recount_threshold)) as executor:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(task, chunk, file_encoding, is_sql))
+                if len(in_flight) >= max_workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
 
     def process_file(self, input_file_path: str, input_file_number: Optional[int] = None,
                      file_encoding: Optional[str] = None, is_sql: bool = True) -> FileTokenMetadata:
@@ -52,30 +375,127 @@ class FileTokenCountHelper:
         Args:
             input_file_path (str): The path of the file to be processed.
             input_file_number (Optional[int]): The number of the input file. If not provided, it will be generated automatically.
-            file_encoding (Optional[str]): The encoding to use for reading the file. If not specified, the encoding is automatically detected using chardet.detect.
+            file_encoding (Optional[str]): The encoding to use for reading the file. If not specified, the encoding is automatically detected with utils.EncodingDetector.
             is_sql (bool): Flag indicating whether the file is a SQL file. If True, SQL comments will be removed for token counting.
 
         Returns:
             FileTokenMetadata: Metadata object containing file details and token counts.
         """
-        content, input_file_encoding = utils.get_file_content(input_file_path, encoding=file_encoding)
-        token_count = self.token_counter.count_tokens(content)
+        with open(input_file_path, 'rb') as file:
+            raw_data = file.read()
+        return self.process_content(raw_data=raw_data, input_file_path=input_file_path,
+                                    input_file_number=input_file_number, file_encoding=file_encoding, is_sql=is_sql)
 
-        content_without_sql_comments = None
-        token_count_without_sql_comments = None
+    def process_content(self, raw_data: bytes, input_file_path: str, input_file_number: Optional[int] = None,
+                        file_encoding: Optional[str] = None, is_sql: bool = True) -> FileTokenMetadata:
+        """
+        Process the raw content of a file and return its details including token counts.
+
+        This is used directly when file contents are read by other means than the local file system,
+        such as Spark's `binaryFile` data source.
 
+        Args:
+            raw_data (bytes): The raw content of the file.
+            input_file_path (str): The path of the file, recorded in the metadata.
+            input_file_number (Optional[int]): The number of the input file.
+            file_encoding (Optional[str]): The encoding to use for decoding the content. If not specified, the encoding is automatically detected with utils.EncodingDetector.
+            is_sql (bool): Flag indicating whether the file is a SQL file. If True, SQL comments will be removed for token counting.
+
+        Returns:
+            FileTokenMetadata: Metadata object containing file details and token counts.
+        """
+        return self.process_contents([(input_file_number, input_file_path, raw_data)],
+                                     file_encoding=file_encoding, is_sql=is_sql)[0]
+
+    def process_contents(self, numbered_contents: List[Tuple[Optional[int], str, bytes]],
+                         file_encoding: Optional[str] = None, is_sql: bool = True) -> List[FileTokenMetadata]:
+        """
+        Process the raw contents of multiple files, counting the tokens of all of them in one batch.
+
+        Args:
+            numbered_contents (List[Tuple[Optional[int], str, bytes]]): Tuples of input_file_number, input_file_path and raw content.
+            file_encoding (Optional[str]): The encoding to use for decoding the contents. If not specified, the encoding is automatically detected with utils.EncodingDetector.
+            is_sql (bool): Flag indicating whether the files are SQL files. If True, SQL comments will be removed for token counting.
+
+        Returns:
+            List[FileTokenMetadata]: Metadata objects containing file details and token counts, in the given order.
+        """
+        results = []
+        for input_file_number, input_file_path, raw_data in numbered_contents:
+            content, detection = utils.decode_file_content(raw_data, encoding=file_encoding,
+                                                           detector=self.encoding_detector, file_path=input_file_path)
+            results.append(FileTokenMetadata(
+                input_file_number=input_file_number,
+                input_file_path=input_file_path,
+                input_file_encoding=detection.encoding,
+                input_file_encoding_confidence=detection.confidence,
+                input_file_content=content,
+                input_file_content_without_sql_comments=(
+                    utils.remove_sql_comments(content, normalize_whitespace=True) if is_sql else None),
+                input_file_token_count=None,
+                input_file_token_count_without_sql_comments=None,
+                tiktoken_encoding=self.token_encoding
+            ))
+        self._count_tokens(results, is_sql)
+        return results
+
+    def _count_tokens(self, results: List[FileTokenMetadata], is_sql: bool) -> None:
+        """Sets the token counts of the results with a single batch call to the tokenizer, or with the estimator."""
+        count_raw_tokens = self.count_raw_tokens or not is_sql
+        texts = []
+        if count_raw_tokens:
+            texts.extend(res.input_file_content for res in results)
         if is_sql:
-            content_without_sql_comments = utils.remove_sql_comments(content)
-            content_without_sql_comments = re.sub(r'\s+', ' ', content_without_sql_comments)
-            token_count_without_sql_comments = self.token_counter.count_tokens(content_without_sql_comments)
-
-        return FileTokenMetadata(
-            input_file_number=input_file_number,
-            input_file_path=input_file_path,
-            input_file_encoding=input_file_encoding,
-            input_file_content=content,
-            input_file_content_without_sql_comments=content_without_sql_comments,
-            input_file_token_count=token_count,
-            input_file_token_count_without_sql_comments=token_count_without_sql_comments,
-            tiktoken_encoding=self.token_encoding
-        )
+            texts.extend(res.input_file_content_without_sql_comments for res in results)
+        if not texts:
+            return
+
+        if self.estimator is None:
+            counts = self.token_counter.count_tokens_batch(texts, num_threads=self.num_threads)
+        else:
+            counts = [self.estimator.estimate(text) for text in texts]
+            if is_sql and self.recount_threshold is not None:
+                # Only the counts without SQL comments decide the conversion targets
+                first = len(results) if count_raw_tokens else 0
+                near = [i for i in range(first, len(texts))
+                        if self.estimator.is_near(counts[i], self.recount_threshold)]
+                exact_counts = self.token_counter.count_tokens_batch([texts[i] for i in near],
+                                                                     num_threads=self.num_threads)
+                for i, count in zip(near, exact_counts):
+                    counts[i] = count
+        counts = iter(counts)
+        if count_raw_tokens:
+            for res in results:
+                res.input_file_token_count = next(counts)
+        if is_sql:
+            for res in results:
+                res.input_file_token_count_without_sql_comments = next(counts)
+
+
+# Helper used by worker processes of FileTokenCountHelper.process_directory
+_worker_helper: Optional[FileTokenCountHelper] = None
+
+
+def _init_worker(token_encoding: str, count_raw_tokens: bool, num_threads: int,
+                 estimator: Optional[TokenEstimator], recount_threshold: Optional[int]) -> None:
+    """Create one FileTokenCountHelper per worker process, so the tokenizer is loaded once per process."""
+    global _worker_helper
+    _worker_helper = FileTokenCountHelper(token_encoding, count_raw_tokens=count_raw_tokens, num_threads=num_threads,
+                                          estimator=estimator, recount_threshold=recount_threshold)
+
+
+def _process_chunk(numbered_paths: List[Tuple[int, str]], file_encoding: Optional[str], is_sql: bool,
+                   helper: Optional[FileTokenCountHelper] = None) -> List[FileTokenMetadata]:
+    """Process a chunk of (input_file_number, input_file_path) pairs with the given or per-process helper."""
+    helper = helper or _worker_helper
+    numbered_contents = []
+    for number, file_path in numbered_paths:
+        with open(file_path, 'rb') as file:
+            numbered_contents.append((number, file_path, file.read()))
+    return helper.process_contents(numbered_contents, file_encoding=file_encoding, is_sql=is_sql)
+
+
+def _process_contents_chunk(numbered_contents: List[Tuple[int, str, bytes]], file_encoding: Optional[str],
+                            is_sql: bool) -> List[FileTokenMetadata]:
+    """Process a chunk of (input_file_number, input_file_path, content) tuples with the per-process helper."""
+    return _worker_helper.process_contents(numbered_contents, file_encoding=file_encoding, is_sql=is_sql)
@@ -0,0 +1,119 @@
+"""
+This module builds system messages from guideline sections and reports the token cost of the prompts.
+
+A system message is sent with every request, so a guideline that the input does not need is paid for once per file.
+Sections can have a trigger, a regular expression matched against the input, and are then only included
+for inputs that match it. Sections without a trigger are always included.
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from .utils import TokenCounter
+
+
+@dataclass
+class PromptSection:
+    """Data class for storing a guideline section of a system message."""
+    name: str
+    text: str
+    trigger: Optional[str] = None
+
+
+@dataclass
+class SectionCost:
+    """Data class for storing the token cost of a guideline section over the requests of a run."""
+    name: str
+    token_count: int
+    request_count: int = 0
+
+    @property
+    def total_token_count(self) -> int:
+        return self.token_count * self.request_count
+
+
+class PromptBuilder:
+    def __init__(self, header: str, sections: List[PromptSection], token_counter: TokenCounter,
+                 format_args: Optional[Dict[str, str]] = None, detect_sections: bool = True):
+        """
+        Initialize the PromptBuilder and measure the token count of each section.
+
+        Args:
+            header (str): The text before the numbered sections.
+            sections (List[PromptSection]): The guideline sections, in prompt order.
+            token_counter (TokenCounter): Counts the tokens, with the encoding of the model.
+            format_args (Optional[Dict[str, str]]): The values of the placeholders in the header and sections.
+            detect_sections (bool): If False, all sections are included regardless of their triggers.
+        """
+        self.header = header
+        self.sections = sections
+        self.token_counter = token_counter
+        self.format_args = format_args or {}
+        self.detect_sections = detect_sections
+        self._triggers = [re.compile(s.trigger, re.IGNORECASE) if s.trigger else None for s in sections]
+        token_counts = token_counter.count_tokens_batch(
+            [self.format_prompt("", [s]).format(**self.format_args) for s in sections])
+        self.header_token_count = token_counter.count_tokens(header.format(**self.format_args))
+        self.costs = [SectionCost(s.name, count) for s, count in zip(sections, token_counts)]
+
+    @staticmethod
+    def format_prompt(header: str, sections: List[PromptSection]) -> str:
+        """Returns the header followed by the section texts, numbered in order."""
+        return header + "".join(f"{i}. {section.text}\n" for i, section in enumerate(sections, start=1))
+
+    def select_sections(self, sql_text: str) -> List[PromptSection]:
+        """Returns the sections needed for the input: those without a trigger and those whose trigger matches."""
+        return [section for section, trigger in zip(self.sections, self._triggers)
+                if not self.detect_sections or trigger is None or trigger.search(sql_text)]
+
+    def build(self, sql_text: str) -> str:
+        """
+        Builds the system message for the input and records the usage of its sections in `costs`.
+
+        Args:
+            sql_text (str): The input SQL.
+
+        Returns:
+            str: The system message with the selected sections, renumbered from 1.
+        """
+        selected = self.select_sections(sql_text)
+        selected_names = {section.name for section in selected}
+        for cost in self.costs:
+            if cost.name in selected_names:
+                cost.request_count += 1
+        return self.format_prompt(self.header, selected).format(**self.format_args)
+
+    def get_full_token_count(self) -> int:
+        """Returns the approximate token count of the system message with all sections."""
+        return self.header_token_count + sum(cost.token_count for cost in self.costs)
+
+
+def summarize_prompt_tokens(requests: List[List[Dict[str, str]]], token_counter: TokenCounter) -> Dict[str, int]:
+    """
+    Sums the prompt tokens of the requests by message kind.
+
+    Args:
+        requests (List[List[Dict[str, str]]]): The messages of each request. The first message is the system message,
+            the last one the input, and those in between are few-shots.
+        token_counter (TokenCounter): Counts the tokens, with the encoding of the model.
+
+    Returns:
+        Dict[str, int]: The token counts of the system messages, few-shots and inputs, their total,
+            and the percentage of the total that is spent on system messages and few-shots.
+    """
+    cache = {}
+
+    def count(text: str) -> int:
+        if text not in cache:
+            cache[text] = token_counter.count_tokens(text)
+        return cache[text]
+
+    summary = {"system_message": 0, "few_shots": 0, "input": 0}
+    for messages in requests:
+        summary["system_message"] += count(messages[0]["content"])
+        summary["few_shots"] += sum(count(message["content"]) for message in messages[1:-1])
+        summary["input"] += count(messages[-1]["content"])
+    summary["total"] = sum(summary.values())
+    overhead = summary["system_message"] + summary["few_shots"]
+    summary["overhead_percent"] = round(100 * overhead / summary["total"]) if summary["total"] else 0
+    return summary
@@ -0,0 +1,173 @@
+"""
+This module detects near-duplicate input files, such as procedures that differ only in table names or literals.
+It computes MinHash signatures over shingles of normalized SQL tokens and clusters similar files with
+locality-sensitive hashing (LSH), without comparing every pair of files.
+"""
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+_SQL_TOKEN = re.compile(r"N?'(?:[^']|'')*'|\d+(?:\.\d+)?|[A-Za-z_@#][\w@#$]*|\S")
+
+
+def normalize_sql_tokens(sql_text: str) -> List[str]:
+    """
+    Splits SQL text into lowercase tokens, replacing string literals with `'?'` and numbers with `0`.
+
+    Args:
+        sql_text (str): The SQL text, preferably without comments.
+
+    Returns:
+        List[str]: The normalized tokens.
+    """
+    tokens = []
+    for token in _SQL_TOKEN.findall(sql_text):
+        if token.endswith("'") and len(token) > 1:
+            tokens.append("'?'")
+        elif token[0].isdigit():
+            tokens.append("0")
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+
+class SimilarityClusterHelper:
+    """
+    Clusters near-duplicate texts with MinHash signatures and LSH.
+
+    Two texts are similar if the estimated Jaccard similarity of their token shingles is at least
+    `threshold`. Candidate pairs that share an LSH band bucket are verified against the threshold,
+    and similar texts are clustered transitively.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, num_bands: int = 16,
+                 shingle_size: int = 5, seed: int = 0):
+        """
+        Initialize the SimilarityClusterHelper.
+
+        Args:
+            threshold (float): The minimum estimated Jaccard similarity of two similar texts.
+            num_perm (int): The number of hash functions of a MinHash signature.
+            num_bands (int): The number of LSH bands. num_perm must be divisible by it. More bands find
+                pairs with a lower similarity as candidates, at the cost of more verifications.
+            shingle_size (int): The number of consecutive tokens in a shingle.
+            seed (int): The seed of the hash functions. Signatures are only comparable with the same seed.
+        """
+        if num_perm % num_bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by num_bands ({num_bands}).")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.num_bands = num_bands
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def compute_signature(self, sql_text: str, block_size: int = 4096) -> Optional[np.ndarray]:
+        """
+        Computes the MinHash signature of a text.
+
+        Args:
+            sql_text (str): The text.
+            block_size (int): The number of shingles hashed at once, which bounds the memory used for large texts.
+
+        Returns:
+            Optional[np.ndarray]: The signature as num_perm uint32 values, or None if the text has no tokens.
+        """
+        tokens = normalize_sql_tokens(sql_text)
+        if not tokens:
+            return None
+        size = min(self.shingle_size, len(tokens))
+        shingles = {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), block_size):
+            block = hashes[start:start + block_size, np.newaxis]
+            permuted = np.bitwise_and((block * self._a + self._b) % _MERSENNE_PRIME, _MAX_HASH)
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return signature.astype(np.uint32)
+
+    def estimate_similarity(self, signature1: np.ndarray, signature2: np.ndarray) -> float:
+        """Returns the estimated Jaccard similarity of two signatures."""
+        return float(np.mean(signature1 == signature2))
+
+    def cluster(self, numbered_texts: Iterable[Tuple[int, Optional[str]]]) -> Dict[int, int]:
+        """
+        Clusters near-duplicate texts.
+
+        Texts are consumed one at a time, and only their signatures are kept in memory.
+
+        Args:
+            numbered_texts (Iterable[Tuple[int, Optional[str]]]): Pairs of a unique number (e.g. input_file_number) and a text.
+
+        Returns:
+            Dict[int, int]: The cluster ID of each number, which is the smallest number in its cluster.
+                Texts without similar texts form a cluster of their own.
+        """
+        signatures = {}
+        clusters = {}
+        for number, text in numbered_texts:
+            signature = self.compute_signature(text) if text else None
+            if signature is None:
+                clusters[number] = number  # Texts without tokens cannot be compared
+            else:
+                signatures[number] = signature
+
+        parents = {number: number for number in signatures}
+
+        def find(number):
+            while parents[number] != number:
+                parents[number] = parents[parents[number]]
+                number = parents[number]
+            return number
+
+        # Each member of a bucket is verified against the first member only, which keeps buckets of
+        # many exact duplicates linear. Similar pairs missed this way are usually joined through other bands.
+        rows_per_band = self.num_perm // self.num_bands
+        for band in range(self.num_bands):
+            buckets = defaultdict(list)
+            for number, signature in signatures.items():
+                buckets[signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes()].append(number)
+            for members in buckets.values():
+                first = members[0]
+                for other in members[1:]:
+                    if find(first) == find(other):
+                        continue
+                    if self.estimate_similarity(signatures[first], signatures[other]) >= self.threshold:
+                        root1, root2 = find(first), find(other)
+                        parents[max(root1, root2)] = min(root1, root2)
+
+        clusters.update({number: find(number) for number in signatures})
+        return clusters
+
+
+def order_by_representatives(clusters: Dict[int, int],
+                             numbers: Iterable[int]) -> Tuple[List[int], Dict[int, int]]:
+    """
+    Selects the smallest number of each cluster among the given numbers as its representative.
+
+    Args:
+        clusters (Dict[int, int]): The cluster ID of each number, as returned by SimilarityClusterHelper.cluster.
+            Numbers that are not in it form a cluster of their own.
+        numbers (Iterable[int]): The numbers to process, e.g. the conversion targets.
+
+    Returns:
+        Tuple[List[int], Dict[int, int]]: The representatives, and the representative of each other number.
+    """
+    representatives = {}
+    followers = {}
+    for number in sorted(numbers):
+        cluster_id = clusters.get(number, number)
+        if cluster_id in representatives:
+            followers[number] = representatives[cluster_id]
+        else:
+            representatives[cluster_id] = number
+    return list(representatives.values()), followers
@@ -7,12 +7,16 @@ class SparkSQLExtractHelper:
 
     def __init__(self) -> None:
         self.sql_statements: List[str] = []
+        self.sql_calls: List[ast.Call] = []
         self.variables: dict = {}
 
     def extract_sql_from_string(self, func_string: str) -> Tuple[Optional[str], List[str]]:
         """
         Parses a Python function string and extracts Spark SQL statements.
 
+        The `spark.sql` call node of each extracted statement is kept in `sql_calls` in the same order,
+        so that the location of a statement in the function can be found by its index.
+
         Args:
             func_string (str): The Python function as a string.
 
@@ -138,6 +142,7 @@ class SparkSQLExtractHelper:
                 sql = self.extract_value(arg)
                 if sql:
                     self.sql_statements.append(sql)
+                    self.sql_calls.append(node)
 
 
 # Usage example
@@ -0,0 +1,36 @@
+"""
+This module sets the conversion targets of the result table.
+It is the stage logic of 05_adjust_conversion_targets.
+"""
+from typing import List
+
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql.functions import col, when
+
+
+def adjust_conversion_targets(spark: SparkSession, result_table: str, set_true_numbers: List[int],
+                              set_false_numbers: List[int]) -> DataFrame:
+    """
+    Sets `is_conversion_target` of the given input_file_number values to True or False.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        result_table (str): The name of the conversion result table.
+        set_true_numbers (List[int]): The files to set as conversion targets.
+        set_false_numbers (List[int]): The files to set as non-targets.
+
+    Returns:
+        DataFrame: The result table with the updated conversion targets.
+    """
+    update_df = spark.table(result_table).withColumn(
+        "is_conversion_target",
+        when(col("input_file_number").isin(set_true_numbers), True)
+        .when(col("input_file_number").isin(set_false_numbers), False)
+        .otherwise(col("is_conversion_target")),
+    )
+    if set_true_numbers or set_false_numbers:
+        update_df.write.mode("overwrite").saveAsTable(result_table)
+        print(f"Changes applied to the result table: {result_table}.")
+    else:
+        print(f"No changes applied to the result table: {result_table} because the parameters are empty.")
+    return spark.table(result_table)
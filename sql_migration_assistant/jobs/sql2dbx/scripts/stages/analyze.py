@@ -0,0 +1,430 @@
+"""
+This module analyzes the input files and saves their token counts and contents into the result table.
+It is the stage logic of 01_analyze_input_files.
+"""
+import os
+import shutil
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+from delta.tables import DeltaTable
+from pyspark.sql import DataFrame, SparkSession, Window
+from pyspark.sql.functions import (broadcast, col, lit, pandas_udf,
+                                   regexp_replace, row_number, udf, when)
+from pyspark.sql.types import (ArrayType, BooleanType, DoubleType,
+                               IntegerType, LongType, StringType, StructField,
+                               StructType, TimestampType)
+
+from .. import utils
+from ..arrow_dataframe_helper import create_dataframe, rows_to_arrow_table
+from ..file_manifest_helper import FileManifestEntry, FileManifestHelper
+from ..llm_token_count_helper import (FileTokenCountHelper, to_record_batch,
+                                      to_record_batches)
+from ..similarity_cluster_helper import SimilarityClusterHelper
+from .syntax_check import add_hash_columns
+
+SCHEMA = StructType([
+    StructField("input_file_number", IntegerType(), True),
+    StructField("input_file_path", StringType(), True),
+    StructField("input_file_encoding", StringType(), True),
+    StructField("input_file_encoding_confidence", DoubleType(), True),
+    StructField("tiktoken_encoding", StringType(), True),
+    StructField("input_file_token_count", IntegerType(), True),
+    StructField("input_file_token_count_without_sql_comments", IntegerType(), True),
+    StructField("input_file_content", StringType(), True),
+    StructField("input_file_content_without_sql_comments", StringType(), True),
+    StructField("is_conversion_target", BooleanType(), True),
+    StructField("similarity_cluster_id", IntegerType(), True),
+    StructField("model_serving_endpoint_for_conversion", StringType(), True),
+    StructField("model_serving_endpoint_for_fix", StringType(), True),
+    StructField("result_content", StringType(), True),
+    StructField("result_token_count", IntegerType(), True),
+    StructField("result_error", StringType(), True),
+    StructField("result_timestamp", TimestampType(), True),
+    StructField("result_python_parse_error", StringType(), True),
+    StructField("result_extracted_sqls", ArrayType(StringType()), True),
+    StructField("result_sql_parse_errors", ArrayType(StringType()), True),
+    StructField("result_content_hash", StringType(), True),
+    StructField("checked_hash", StringType(), True),
+])
+# The names and SQL data types of the result table columns
+RESULT_COLUMNS = [(f.name, f.dataType.simpleString()) for f in SCHEMA.fields]
+ANALYSIS_COLUMNS = [
+    "input_file_number",
+    "input_file_path",
+    "input_file_encoding",
+    "input_file_encoding_confidence",
+    "tiktoken_encoding",
+    "input_file_token_count",
+    "input_file_token_count_without_sql_comments",
+    "input_file_content",
+    "input_file_content_without_sql_comments",
+]
+ANALYSIS_SCHEMA = StructType([SCHEMA[name] for name in ANALYSIS_COLUMNS])
+MANIFEST_SCHEMA = StructType([
+    StructField("input_file_path", StringType(), True),
+    StructField("input_file_size", LongType(), True),
+    StructField("input_file_mtime", DoubleType(), True),
+    StructField("input_file_content_hash", StringType(), True),
+])
+MANIFEST_ARROW_SCHEMA = pa.schema([
+    ("input_file_path", pa.string()),
+    ("input_file_size", pa.int64()),
+    ("input_file_mtime", pa.float64()),
+    ("input_file_content_hash", pa.string()),
+])
+CLUSTERS_SCHEMA = StructType([
+    StructField("input_file_number", IntegerType(), True),
+    StructField("similarity_cluster_id", IntegerType(), True),
+])
+CLUSTERS_ARROW_SCHEMA = pa.schema([
+    ("input_file_number", pa.int32()),
+    ("similarity_cluster_id", pa.int32()),
+])
+# The directory that contains the scripts package, which is shipped to the executors in spark mode
+PACKAGE_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@dataclass
+class AnalysisConfig:
+    """
+    A class to represent the settings of the analysis stage. See 01_analyze_input_files for their details.
+
+    Attributes:
+        input_dir (str): The directory or archive containing the files for analysis.
+        result_catalog (str): The catalog of the result table.
+        result_schema (str): The schema of the result table.
+        token_encoding (str): The encoding used for tokenization.
+        tokenizer_cache_dir (str): A directory with cached tokenizer files.
+        file_encoding (Optional[str]): The encoding used for reading files. If None, it is detected.
+        file_filter (utils.FileFilter): Selects the files to analyze.
+        is_sql (bool): Whether the files are SQL files.
+        token_count_threshold (int): The maximum token count without SQL comments of conversion targets.
+        result_table_prefix (str): The prefix of the result table name.
+        existing_result_table (str): The result table of a previous run.
+        max_workers (Optional[int]): The number of driver processes. None uses all CPU cores.
+        count_raw_tokens (bool): If False, the tokens of SQL files are only counted without SQL comments.
+        token_count_mode (str): `exact` or `approximate`.
+        recount_near_threshold (bool): If True, estimated counts near the threshold are counted exactly.
+        analysis_mode (str): `driver` or `spark`.
+        incremental (bool): If True, a manifest is saved and only new or changed files are merged into
+            `existing_result_table`.
+        similarity_threshold (float): The minimum similarity of near-duplicate files. 0 disables the detection.
+    """
+    input_dir: str
+    result_catalog: str
+    result_schema: str
+    token_encoding: str = "o200k_base"
+    tokenizer_cache_dir: str = ""
+    file_encoding: Optional[str] = None
+    file_filter: utils.FileFilter = field(default_factory=utils.FileFilter)
+    is_sql: bool = True
+    token_count_threshold: int = 20000
+    result_table_prefix: str = "conversion_targets"
+    existing_result_table: str = ""
+    max_workers: Optional[int] = None
+    count_raw_tokens: bool = True
+    token_count_mode: str = "exact"
+    recount_near_threshold: bool = True
+    analysis_mode: str = "driver"
+    incremental: bool = False
+    similarity_threshold: float = 0.8
+
+
+class InputFileAnalyzer:
+    def __init__(self, spark: SparkSession, config: AnalysisConfig):
+        """
+        Initialize the InputFileAnalyzer.
+
+        Args:
+            spark (SparkSession): The Spark session.
+            config (AnalysisConfig): The settings of the analysis stage.
+        """
+        self.spark = spark
+        self.config = config
+        self.input_is_archive = utils.is_archive(config.input_dir)
+        utils.set_tokenizer_cache_dir(config.tokenizer_cache_dir)
+
+    def analyze(self) -> str:
+        """
+        Analyzes the input files into a new result table, or merges new and changed files into
+        `existing_result_table` in incremental mode.
+
+        Returns:
+            str: The name of the result table. If `existing_result_table` exists and `incremental` is False,
+                it is returned without analysis.
+        """
+        config = self.config
+        if config.existing_result_table:
+            if self.spark.catalog.tableExists(config.existing_result_table):
+                if not config.incremental:
+                    return config.existing_result_table
+                if self.input_is_archive:
+                    raise ValueError("Incremental mode does not support archives. "
+                                     "Extract the archive or run without 'existing_result_table'.")
+                print(f"Incremental mode: new and changed files will be merged into '{config.existing_result_table}'.")
+                self.merge_changed_files(config.existing_result_table)
+                return config.existing_result_table
+            print("'existing_result_table' is specified but the table does not exist. Continuing with the analysis.")
+        else:
+            print("The parameter 'existing_result_table' is not specified. Continuing with the analysis.")
+
+        analysis_mode = config.analysis_mode
+        if self.input_is_archive and analysis_mode == "spark":
+            print("The input is an archive, which is analyzed in driver mode.")
+            analysis_mode = "driver"
+
+        current_time = datetime.now(timezone.utc).strftime("%Y%m%d%H%M")
+        result_table = f"{config.result_catalog}.{config.result_schema}.{config.result_table_prefix}_{current_time}"
+        print(result_table)
+        if analysis_mode == "spark":
+            self.to_result_df(self.analyze_on_executors()).write.format("delta").mode("overwrite").saveAsTable(result_table)
+        else:
+            self.analyze_on_driver(result_table)
+        print(f"Successfully saved result into the table: {result_table}")
+        self.assign_similarity_clusters(result_table)
+
+        # Save the manifest so that later runs can analyze new and changed files only
+        if config.incremental and not self.input_is_archive:
+            self.save_manifest(FileManifestHelper().create_entries(utils.iter_files(config.input_dir, config.file_filter)),
+                               f"{result_table}_manifest")
+        return result_table
+
+    def to_result_df(self, analysis_df: DataFrame) -> DataFrame:
+        """Adds the conversion target flag and empty conversion result columns to the analysis results."""
+        return (analysis_df
+                .withColumn("is_conversion_target",
+                            when(col("input_file_token_count_without_sql_comments") > self.config.token_count_threshold, False)
+                            .otherwise(True))
+                # Each file is a cluster of its own until assign_similarity_clusters finds similar files
+                .withColumn("similarity_cluster_id",
+                            col("input_file_number") if self.config.similarity_threshold > 0
+                            else lit(None).cast(IntegerType()))
+                .withColumn("model_serving_endpoint_for_conversion", lit(None).cast(StringType()))
+                .withColumn("model_serving_endpoint_for_fix", lit(None).cast(StringType()))
+                .withColumn("result_content", lit(None).cast(StringType()))
+                .withColumn("result_token_count", lit(None).cast(IntegerType()))
+                .withColumn("result_error", lit(None).cast(StringType()))
+                .withColumn("result_timestamp", lit(None).cast(TimestampType()))
+                .withColumn("result_python_parse_error", lit(None).cast(StringType()))
+                .withColumn("result_extracted_sqls", lit(None).cast(ArrayType(StringType())))
+                .withColumn("result_sql_parse_errors", lit(None).cast(ArrayType(StringType())))
+                .withColumn("result_content_hash", lit(None).cast(StringType()))
+                .withColumn("checked_hash", lit(None).cast(StringType()))
+                )
+
+    def create_analysis_df(self, record_batch: pa.RecordBatch) -> DataFrame:
+        """Creates a DataFrame with the analysis columns from an Arrow record batch of FileTokenMetadata."""
+        return create_dataframe(self.spark, pa.Table.from_batches([record_batch]), ANALYSIS_SCHEMA)
+
+    def assign_similarity_clusters(self, table: str) -> None:
+        """
+        Clusters near-duplicate files of the table and updates the similarity_cluster_id of the files whose cluster
+        changed, so that the files of the table without similar files are not rewritten.
+        Contents are streamed to the driver one partition at a time, and only their MinHash signatures are kept.
+        """
+        if self.config.similarity_threshold <= 0:
+            return
+        text_column = "input_file_content_without_sql_comments" if self.config.is_sql else "input_file_content"
+        rows = self.spark.table(table).select("input_file_number", "similarity_cluster_id", text_column).toLocalIterator()
+        current_cluster_ids = {}
+
+        def numbered_texts() -> Iterator[Tuple[int, Optional[str]]]:
+            for row in rows:
+                current_cluster_ids[row["input_file_number"]] = row["similarity_cluster_id"]
+                yield row["input_file_number"], row[text_column]
+
+        clusters = SimilarityClusterHelper(threshold=self.config.similarity_threshold).cluster(numbered_texts())
+        changed_clusters = [(number, cluster_id) for number, cluster_id in clusters.items()
+                            if current_cluster_ids.get(number) != cluster_id]
+        if changed_clusters:
+            clusters_df = create_dataframe(self.spark, rows_to_arrow_table(changed_clusters, CLUSTERS_ARROW_SCHEMA),
+                                           CLUSTERS_SCHEMA)
+            (DeltaTable.forName(self.spark, table).alias("t")
+             .merge(clusters_df.alias("s"), "t.input_file_number = s.input_file_number")
+             .whenMatchedUpdate(set={"similarity_cluster_id": "s.similarity_cluster_id"})
+             .execute())
+        print(f"Updated the similarity_cluster_id of {len(changed_clusters)} files.")
+        num_similar_files = sum(1 for number, cluster_id in clusters.items() if number != cluster_id)
+        print(f"Found {num_similar_files} files similar to another file, in {len(set(clusters.values()))} clusters.")
+
+    def save_manifest(self, entries: Iterable[FileManifestEntry], manifest_table: str) -> None:
+        """Overwrites the manifest table with the given manifest entries."""
+        rows = [(e.input_file_path, e.input_file_size, e.input_file_mtime, e.input_file_content_hash) for e in entries]
+        manifest_df = create_dataframe(self.spark, rows_to_arrow_table(rows, MANIFEST_ARROW_SCHEMA), MANIFEST_SCHEMA)
+        manifest_df.write.format("delta").mode("overwrite").saveAsTable(manifest_table)
+        print(f"Successfully saved manifest into the table: {manifest_table}")
+
+    def create_helper(self) -> FileTokenCountHelper:
+        """Creates a FileTokenCountHelper, with a TokenEstimator calibrated on a sample of the files in approximate mode."""
+        config = self.config
+        helper = FileTokenCountHelper(token_encoding=config.token_encoding, count_raw_tokens=config.count_raw_tokens)
+        if config.token_count_mode != "approximate":
+            return helper
+        recount_threshold = config.token_count_threshold if config.recount_near_threshold else None
+        if self.input_is_archive:
+            helper = helper.create_estimating_helper_for_archive(config.input_dir, file_encoding=config.file_encoding,
+                                                                 is_sql=config.is_sql,
+                                                                 recount_threshold=recount_threshold,
+                                                                 file_filter=config.file_filter)
+        else:
+            numbered_paths = list(enumerate(utils.iter_files(config.input_dir, config.file_filter), start=1))
+            helper = helper.create_estimating_helper(numbered_paths, file_encoding=config.file_encoding,
+                                                     is_sql=config.is_sql, recount_threshold=recount_threshold)
+        print(f"Calibrated token estimator: {helper.estimator}")
+        return helper
+
+    def analyze_on_driver(self, result_table: str) -> None:
+        """
+        Reads and tokenizes all files on the driver and appends them to the result table in bounded batches,
+        so the driver's memory does not grow with the number of files.
+        """
+        config = self.config
+        helper = self.create_helper()
+        if self.input_is_archive:
+            results = helper.iter_archive(config.input_dir, file_encoding=config.file_encoding, is_sql=config.is_sql,
+                                          max_workers=config.max_workers, file_filter=config.file_filter)
+        else:
+            numbered_paths = list(enumerate(utils.iter_files(config.input_dir, config.file_filter), start=1))
+            results = helper.iter_files(numbered_paths, file_encoding=config.file_encoding, is_sql=config.is_sql,
+                                        max_workers=config.max_workers)
+
+        write_mode = "overwrite"
+        for record_batch in to_record_batches(results):
+            (self.to_result_df(self.create_analysis_df(record_batch))
+             .write.format("delta").mode(write_mode).saveAsTable(result_table))
+            write_mode = "append"
+            print(f"Saved {record_batch.num_rows} files into the table: {result_table}")
+        if write_mode == "overwrite":
+            # No input files, so create an empty table
+            (self.to_result_df(self.spark.createDataFrame([], schema=ANALYSIS_SCHEMA))
+             .write.format("delta").mode(write_mode).saveAsTable(result_table))
+
+    def analyze_on_executors(self) -> DataFrame:
+        """Reads files with the binaryFile data source and tokenizes them in a pandas UDF on the executors."""
+        config = self.config
+        # Ship the scripts package to the executors so that the UDF can import it
+        scripts_archive = shutil.make_archive("/tmp/sql2dbx_scripts", "zip", root_dir=PACKAGE_ROOT_DIR,
+                                              base_dir="scripts")
+        self.spark.sparkContext.addPyFile(scripts_archive)
+
+        # In approximate mode, the estimator is calibrated on the driver and shipped to the executors with the UDF
+        driver_helper = self.create_helper()
+        estimator, recount_threshold = driver_helper.estimator, driver_helper.recount_threshold
+        udf_columns = [f for f in SCHEMA.fields if f.name in ANALYSIS_COLUMNS
+                       and f.name not in ("input_file_number", "input_file_path")]
+        token_encoding, count_raw_tokens = config.token_encoding, config.count_raw_tokens
+        tokenizer_cache_dir, file_encoding, is_sql = config.tokenizer_cache_dir, config.file_encoding, config.is_sql
+
+        @pandas_udf(StructType(udf_columns))
+        def analyze_files(paths: pd.Series, contents: pd.Series) -> pd.DataFrame:
+            utils.set_tokenizer_cache_dir(tokenizer_cache_dir)
+            helper = FileTokenCountHelper(token_encoding=token_encoding, count_raw_tokens=count_raw_tokens,
+                                          estimator=estimator, recount_threshold=recount_threshold)
+            results = helper.process_contents([(None, path, bytes(content)) for path, content in zip(paths, contents)],
+                                              file_encoding=file_encoding, is_sql=is_sql)
+            return pd.DataFrame([{f.name: getattr(res, f.name) for f in udf_columns} for res in results],
+                                columns=[f.name for f in udf_columns])
+
+        # Paths are returned as URIs (e.g. dbfs:/Volumes/...), so strip the scheme to match the driver mode
+        files_df = (self.spark.read.format("binaryFile")
+                    .option("recursiveFileLookup", "true")
+                    .load(config.input_dir)
+                    .select(regexp_replace(col("path"), "^(dbfs|file):", "").alias("input_file_path"), "content"))
+        if config.file_filter != utils.FileFilter():
+            input_prefix = config.input_dir.rstrip("/") + "/"
+            file_filter = config.file_filter
+
+            @udf(BooleanType())
+            def is_selected(path: str) -> bool:
+                return path.startswith(input_prefix) and file_filter.matches(path[len(input_prefix):])
+
+            files_df = files_df.filter(is_selected(col("input_file_path")))
+
+        # Number the files in path order. Only the paths go through the single-partition window.
+        numbers_df = (files_df
+                      .select("input_file_path")
+                      .withColumn("input_file_number",
+                                  row_number().over(Window.orderBy("input_file_path")).cast(IntegerType())))
+
+        return (files_df
+                .join(broadcast(numbers_df), on="input_file_path")
+                .withColumn("analysis", analyze_files(col("input_file_path"), col("content")))
+                .select("input_file_number", "input_file_path", "analysis.*")
+                .select(*ANALYSIS_COLUMNS))
+
+    def merge_changed_files(self, existing_result_table: str) -> None:
+        """Compares the input files with the manifest and merges new and changed files into the existing result table."""
+        config = self.config
+        manifest_helper = FileManifestHelper()
+        manifest_table = f"{existing_result_table}_manifest"
+        existing_numbers = {
+            row["input_file_path"]: row["input_file_number"]
+            for row in self.spark.table(existing_result_table).select("input_file_path", "input_file_number").collect()
+        }
+        input_paths = utils.list_files_recursively(config.input_dir, config.file_filter)
+        if self.spark.catalog.tableExists(manifest_table):
+            previous_manifest = {row["input_file_path"]: FileManifestEntry(**row.asDict())
+                                 for row in self.spark.table(manifest_table).collect()}
+        else:
+            # Without a manifest, files already in the result table are assumed to be up to date
+            print(f"Manifest table '{manifest_table}' does not exist. Creating it from the existing result table.")
+            previous_manifest = {e.input_file_path: e
+                                 for e in manifest_helper.create_entries(p for p in input_paths if p in existing_numbers)}
+
+        manifest_diff = manifest_helper.diff(input_paths, previous_manifest)
+        print(f"New files: {len(manifest_diff.new)}, changed files: {len(manifest_diff.changed)}, "
+              f"unchanged files: {len(manifest_diff.unchanged)}, removed files: {len(manifest_diff.removed)}")
+        if manifest_diff.removed:
+            print("Warning: The following files no longer exist in the input directory and are kept in the result table:")
+            for path in manifest_diff.removed:
+                print(f"  {path}")
+
+        # Changed files keep their number, new files are numbered after the existing ones
+        next_number = max(existing_numbers.values(), default=0) + 1
+        numbered_paths = []
+        for entry in manifest_diff.changed + manifest_diff.new:
+            number = existing_numbers.get(entry.input_file_path)
+            if number is None:
+                number, next_number = next_number, next_number + 1
+            numbered_paths.append((number, entry.input_file_path))
+
+        if numbered_paths:
+            # Result tables created by older versions lack some columns, which the MERGE below cannot resolve.
+            # The hash columns are added first, so that the hashes of the existing contents are backfilled.
+            add_hash_columns(self.spark, existing_result_table)
+            added_columns = utils.add_missing_columns(self.spark, existing_result_table, RESULT_COLUMNS)
+            if added_columns:
+                print(f"Added columns to the table {existing_result_table}: {', '.join(added_columns)}")
+            helper = FileTokenCountHelper(token_encoding=config.token_encoding, count_raw_tokens=config.count_raw_tokens)
+            results = helper.process_files(numbered_paths, file_encoding=config.file_encoding, is_sql=config.is_sql,
+                                           max_workers=config.max_workers)
+            changes_df = self.to_result_df(self.create_analysis_df(to_record_batch(results)))
+            (DeltaTable.forName(self.spark, existing_result_table).alias("t")
+             .merge(changes_df.alias("s"), "t.input_file_path = s.input_file_path")
+             .whenMatchedUpdateAll()
+             .whenNotMatchedInsertAll()
+             .execute())
+            print(f"Successfully merged {len(numbered_paths)} files into the table: {existing_result_table}")
+            self.assign_similarity_clusters(existing_result_table)
+        else:
+            print(f"No new or changed files found. The table is up to date: {existing_result_table}")
+
+        self.save_manifest(manifest_diff.entries, manifest_table)
+
+
+def analyze_input_files(spark: SparkSession, config: AnalysisConfig) -> str:
+    """
+    Analyzes the input files and returns the name of the result table. See `InputFileAnalyzer.analyze`.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        config (AnalysisConfig): The settings of the analysis stage.
+
+    Returns:
+        str: The name of the result table.
+    """
+    return InputFileAnalyzer(spark, config).analyze()
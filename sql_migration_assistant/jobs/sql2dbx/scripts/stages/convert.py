@@ -0,0 +1,356 @@
+"""
+This module converts the SQL files of the result table to Python functions with a model serving endpoint.
+It is the stage logic of 02_convert_sql_to_databricks.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql.functions import lit
+
+from ..batch_inference_helper import (BatchInferenceRequest,
+                                      BatchInferenceResponse)
+from ..few_shot_selector import FewShotExample, FewShotSelector
+from ..prompt_builder import PromptBuilder, SectionCost, summarize_prompt_tokens
+from ..similarity_cluster_helper import order_by_representatives
+from ..system_prompts.tsql_conversion_prompt import TsqlConversionPromptManager
+from ..tsql_rule_based_transpiler import TsqlRuleBasedTranspiler
+from ..utils import TokenCounter
+from .endpoint_config import EndpointConfig
+from .result_processor import BatchInferenceResultProcessor
+
+# The value of model_serving_endpoint_for_conversion of the files converted by the rule-based transpiler
+RULE_BASED_TRANSPILER_NAME = "rule_based_transpiler"
+
+
+@dataclass
+class ConversionConfig:
+    """
+    A class to represent the settings of the conversion stage. See 02_convert_sql_to_databricks for their details.
+
+    Attributes:
+        result_table (str): The name of the conversion result table.
+        endpoint (EndpointConfig): The settings of the model serving endpoint.
+        sql_dialect (str): The SQL dialect to be converted.
+        comment_lang (str): The language for comments in the converted code.
+        use_similar_file_examples (bool): If True, near-duplicate files are converted with a converted file
+            of their cluster as the example.
+        few_shot_library_table (Optional[str]): A result table whose verified conversions are used as examples.
+        max_few_shots (int): The maximum number of examples selected from the library per request.
+        prompt_token_budget (int): The maximum prompt tokens per request when selecting examples from the library.
+        token_encoding (str): The encoding used to count the prompt tokens.
+        prompt_sections (str): `all` or `detected` guideline sections of the system message.
+        use_rule_based_transpiler (bool): If True, trivially convertible T-SQL procedures are converted by
+            TsqlRuleBasedTranspiler instead of the model serving endpoint.
+    """
+    result_table: str
+    endpoint: EndpointConfig
+    sql_dialect: str = "tsql"
+    comment_lang: str = "English"
+    use_similar_file_examples: bool = True
+    few_shot_library_table: Optional[str] = None
+    max_few_shots: int = 2
+    prompt_token_budget: int = 24000
+    token_encoding: str = "o200k_base"
+    prompt_sections: str = "all"
+    use_rule_based_transpiler: bool = True
+
+
+@dataclass
+class Prompts:
+    """
+    A class to represent the prompts of the conversion requests.
+
+    Attributes:
+        system_message (str): The system message with all guideline sections.
+        few_shots (List[Dict[str, str]]): The default few-shots.
+        prompt_builder (Optional[PromptBuilder]): Builds the system message of each input from the guideline sections.
+            If None, `system_message` is sent with every input.
+    """
+    system_message: str
+    few_shots: List[Dict[str, str]]
+    prompt_builder: Optional[PromptBuilder] = None
+
+
+@dataclass
+class ConversionResult:
+    """
+    A class to represent the result of the conversion stage.
+
+    Attributes:
+        requests (List[BatchInferenceRequest]): The requests sent, the representatives of near-duplicate clusters first.
+        responses (List[BatchInferenceResponse]): The responses, in the order of the requests.
+        prompt_token_summary (Dict[str, int]): The prompt tokens of the requests by message kind.
+        section_costs (List[SectionCost]): The token cost of each guideline section. Empty without a prompt builder.
+        updated_sdf (DataFrame): The updated rows of the result table.
+        transpiled_responses (List[BatchInferenceResponse]): The files converted by the rule-based transpiler,
+            without requests.
+    """
+    requests: List[BatchInferenceRequest]
+    responses: List[BatchInferenceResponse]
+    prompt_token_summary: Dict[str, int]
+    section_costs: List[SectionCost] = field(default_factory=list)
+    updated_sdf: Optional[DataFrame] = None
+    transpiled_responses: List[BatchInferenceResponse] = field(default_factory=list)
+
+
+def create_prompts(config: ConversionConfig) -> Prompts:
+    """Returns the system message and the default few-shots of the SQL dialect."""
+    if config.sql_dialect == "tsql":
+        manager = TsqlConversionPromptManager(config.comment_lang)
+        # Builds the system message of each input from the guideline sections, and measures their token cost
+        prompt_builder = manager.get_prompt_builder(TokenCounter(config.token_encoding),
+                                                    detect_sections=config.prompt_sections == "detected")
+        return Prompts(manager.get_system_message(), manager.get_few_shots(), prompt_builder)
+    raise ValueError(f"Unsupported SQL dialect: {config.sql_dialect}")
+
+
+def load_few_shot_selector(spark: SparkSession, library_table: str, token_counter: TokenCounter,
+                           max_examples: int) -> FewShotSelector:
+    """Indexes the conversions of the library table that passed the static syntax check without errors."""
+    library_df = (spark.table(library_table)
+                  .filter("result_content IS NOT NULL AND result_error IS NULL AND result_extracted_sqls IS NOT NULL "
+                          "AND result_python_parse_error IS NULL "
+                          "AND (result_sql_parse_errors IS NULL OR size(result_sql_parse_errors) = 0)")
+                  .select("input_file_content_without_sql_comments", "result_content"))
+    few_shot_selector = FewShotSelector([FewShotExample(row[0], row[1]) for row in library_df.collect()],
+                                        token_counter, max_examples=max_examples)
+    print(f"Indexed {len(few_shot_selector.examples)} verified conversions from: {library_table}")
+    return few_shot_selector
+
+
+class ConversionRequestBuilder:
+    def __init__(self, config: ConversionConfig, prompts: Prompts, input_texts: Dict[int, str],
+                 input_token_counts: Dict[int, int], token_counter: TokenCounter,
+                 few_shot_selector: Optional[FewShotSelector] = None):
+        """
+        Initialize the ConversionRequestBuilder and build the system message of each input.
+
+        Args:
+            config (ConversionConfig): The settings of the conversion stage.
+            prompts (Prompts): The prompts of the conversion requests.
+            input_texts (Dict[int, str]): The SQL of each input, keyed by input_file_number.
+            input_token_counts (Dict[int, int]): The known token counts of the inputs. Missing ones are counted.
+            token_counter (TokenCounter): Counts the prompt tokens.
+            few_shot_selector (Optional[FewShotSelector]): Selects examples from a library of verified conversions.
+        """
+        self.config = config
+        self.prompts = prompts
+        self.input_texts = input_texts
+        self.input_token_counts = input_token_counts
+        self.token_counter = token_counter
+        self.few_shot_selector = few_shot_selector
+        self.system_messages = {number: self._build_system_message(text) for number, text in input_texts.items()}
+        self._system_message_token_counts = {}
+
+    def _build_system_message(self, text: str) -> str:
+        """Returns the system message of an input, with only the detected guideline sections if `prompt_sections` is `detected`."""
+        if self.prompts.prompt_builder is None:
+            return self.prompts.system_message
+        return self.prompts.prompt_builder.build(text)
+
+    def _count_input_tokens(self, number: int) -> int:
+        """Returns the token count of an input, counting it if it is not known."""
+        input_token_count = self.input_token_counts.get(number)
+        if input_token_count is None:
+            input_token_count = self.token_counter.count_tokens(self.input_texts[number])
+        return input_token_count
+
+    def _get_few_shot_token_budget(self, number: int) -> int:
+        """Returns the prompt tokens of an input left for its few-shots after its system message and itself."""
+        input_token_count = self._count_input_tokens(number)
+        system_message = self.system_messages[number]
+        if system_message not in self._system_message_token_counts:
+            self._system_message_token_counts[system_message] = self.token_counter.count_tokens(system_message)
+        token_budget = (self.config.prompt_token_budget - self._system_message_token_counts[system_message]
+                        - input_token_count)
+        return max(token_budget, 0)
+
+    def select_few_shots(self, number: int) -> List[Dict[str, str]]:
+        """Returns the few-shots of an input: the most similar verified conversions that fit the prompt token budget, or the default few-shots."""
+        if self.few_shot_selector is None:
+            return self.prompts.few_shots
+        return self.few_shot_selector.select(self.input_texts[number],
+                                             token_budget=self._get_few_shot_token_budget(number))
+
+    def create_request(self, number: int) -> BatchInferenceRequest:
+        """Creates the conversion request of an input."""
+        return BatchInferenceRequest(
+            index=number,
+            text=self.input_texts[number],
+            system_message=self.system_messages[number],
+            few_shots=self.select_few_shots(number))
+
+    def create_similar_file_request(self, number: int, representative: int,
+                                    response: BatchInferenceResponse) -> BatchInferenceRequest:
+        """Creates the request of an input with the representative and its conversion result as the few-shot example, or the usual few-shots if it failed or does not fit the prompt token budget."""
+        if response.error or not response.content:
+            return self.create_request(number)
+        example_token_count = (self._count_input_tokens(representative)
+                               + self.token_counter.count_tokens(response.content))
+        if example_token_count > self._get_few_shot_token_budget(number):
+            return self.create_request(number)
+        return BatchInferenceRequest(
+            index=number,
+            text=self.input_texts[number],
+            system_message=self.system_messages[number],
+            few_shots=[
+                {"role": "user", "content": self.input_texts[representative]},
+                {"role": "assistant", "content": response.content},
+            ])
+
+
+@dataclass
+class ConversionPlan:
+    """
+    A class to represent the conversion targets and the order in which they are sent to the endpoint.
+
+    Attributes:
+        request_builder (ConversionRequestBuilder): Creates the requests of the targets sent to the endpoint.
+        representatives (List[int]): The targets converted first, with the usual few-shots.
+        followers (Dict[int, int]): The targets converted afterwards, keyed by input_file_number, with the
+            representative of their near-duplicate cluster as the example.
+        transpiled_responses (List[BatchInferenceResponse]): The targets converted by the rule-based transpiler.
+    """
+    request_builder: ConversionRequestBuilder
+    representatives: List[int]
+    followers: Dict[int, int]
+    transpiled_responses: List[BatchInferenceResponse] = field(default_factory=list)
+
+
+def transpile_trivial_files(input_texts: Dict[int, str], comment_lang: str) -> List[BatchInferenceResponse]:
+    """
+    Converts the trivially convertible T-SQL procedures with TsqlRuleBasedTranspiler.
+
+    Args:
+        input_texts (Dict[int, str]): The input SQL without comments, keyed by input_file_number.
+        comment_lang (str): The language for comments in the converted code.
+
+    Returns:
+        List[BatchInferenceResponse]: The converted code of the files that the transpiler supports.
+    """
+    transpiler = TsqlRuleBasedTranspiler(comment_lang)
+    responses = []
+    for number, text in input_texts.items():
+        content = transpiler.transpile(text)
+        if content is not None:
+            responses.append(BatchInferenceResponse(index=number, content=content, token_count=0, error=None))
+    return responses
+
+
+def plan_conversion(spark: SparkSession, config: ConversionConfig, prompts: Prompts) -> ConversionPlan:
+    """
+    Loads the conversion targets of the result table, converts the trivial ones with the rule-based transpiler,
+    and orders the others by their near-duplicate clusters.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        config (ConversionConfig): The settings of the conversion stage.
+        prompts (Prompts): The prompts of the conversion requests.
+
+    Returns:
+        ConversionPlan: The request builder, the order of the requests and the transpiled results.
+    """
+    token_counter = TokenCounter(config.token_encoding)
+    few_shot_selector = None
+    if config.few_shot_library_table:
+        few_shot_selector = load_few_shot_selector(spark, config.few_shot_library_table, token_counter,
+                                                   config.max_few_shots)
+
+    source_sdf = spark.table(config.result_table)
+    use_clusters = config.use_similar_file_examples and "similarity_cluster_id" in source_sdf.columns
+    rows = (source_sdf
+            .filter("is_conversion_target == true")
+            .select(
+                "input_file_number",
+                "input_file_content_without_sql_comments",
+                "input_file_token_count_without_sql_comments",
+                "similarity_cluster_id" if use_clusters else lit(None).alias("similarity_cluster_id"))
+            .collect())
+    input_texts = {row[0]: row[1] for row in rows}
+    input_token_counts = {row[0]: row[2] for row in rows if row[2] is not None}
+    transpiled_responses = []
+    if config.use_rule_based_transpiler and config.sql_dialect == "tsql":
+        transpiled_responses = transpile_trivial_files(input_texts, config.comment_lang)
+        for res in transpiled_responses:
+            del input_texts[res.index]
+        print(f"Converted {len(transpiled_responses)} files with the rule-based transpiler without the endpoint.")
+    clusters = {row[0]: row[3] for row in rows if row[3] is not None}
+    representatives, followers = order_by_representatives(clusters, input_texts)
+    print(f"Conversion targets: {len(input_texts)}, converted first: {len(representatives)}, "
+          f"converted with a similar file as the example: {len(followers)}")
+
+    request_builder = ConversionRequestBuilder(config, prompts, input_texts, input_token_counts, token_counter,
+                                               few_shot_selector)
+    return ConversionPlan(request_builder, representatives, followers, transpiled_responses)
+
+
+def summarize_request_prompt_tokens(requests: List[BatchInferenceRequest], token_counter: TokenCounter) -> Dict[str, int]:
+    """Prints and returns the prompt tokens of the requests by message kind."""
+    prompt_token_summary = summarize_prompt_tokens(
+        [[{"role": "system", "content": req.system_message}, *(req.few_shots or []), {"role": "user", "content": req.text}]
+         for req in requests],
+        token_counter)
+    print(f"Prompt tokens of {len(requests)} requests: {prompt_token_summary['total']:,} "
+          f"(system messages: {prompt_token_summary['system_message']:,}, "
+          f"few-shots: {prompt_token_summary['few_shots']:,}, inputs: {prompt_token_summary['input']:,}). "
+          f"System messages and few-shots are {prompt_token_summary['overhead_percent']}% of the prompt tokens.")
+    return prompt_token_summary
+
+
+def merge_transpiled_responses(spark: SparkSession, result_table: str,
+                               transpiled_responses: List[BatchInferenceResponse]) -> DataFrame:
+    """Merges the results of the rule-based transpiler into the result table, and returns the updated rows."""
+    transpiled_sdf = BatchInferenceResultProcessor(
+        spark, model_serving_endpoint_for_conversion=RULE_BASED_TRANSPILER_NAME
+    ).merge_results(result_table, transpiled_responses)
+    print(f"Successfully merged {len(transpiled_responses)} transpiled results into the table: {result_table}")
+    return transpiled_sdf
+
+
+async def convert_sql_to_databricks(spark: SparkSession, config: ConversionConfig, prompts: Optional[Prompts] = None,
+                                    log_level: int = logging.INFO) -> ConversionResult:
+    """
+    Converts the conversion targets of the result table and merges the results into it.
+
+    Representatives of near-duplicate clusters are converted first, and the other files follow with their results
+    as examples.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        config (ConversionConfig): The settings of the conversion stage.
+        prompts (Optional[Prompts]): The prompts of the conversion requests. Defaults to `create_prompts(config)`.
+        log_level (int): The logging level of the batch inference.
+
+    Returns:
+        ConversionResult: The requests, the responses, their prompt tokens and the updated rows.
+    """
+    prompts = prompts or create_prompts(config)
+    plan = plan_conversion(spark, config, prompts)
+    request_builder, followers = plan.request_builder, plan.followers
+    requests = [request_builder.create_request(number) for number in plan.representatives]
+    batch_manager = config.endpoint.create_batch_manager(log_level=log_level)
+    responses = await batch_manager.batch_inference(requests, close_client=not followers)
+    if followers:
+        representative_responses = {res.index: res for res in responses}
+        similar_file_requests = [
+            request_builder.create_similar_file_request(number, representative,
+                                                        representative_responses[representative])
+            for number, representative in followers.items()
+        ]
+        requests += similar_file_requests
+        responses += await batch_manager.batch_inference(similar_file_requests)
+
+    prompt_token_summary = summarize_request_prompt_tokens(requests, request_builder.token_counter)
+
+    result_processor = BatchInferenceResultProcessor(
+        spark, model_serving_endpoint_for_conversion=config.endpoint.endpoint_name)
+    updated_sdf = result_processor.merge_results(config.result_table, responses)
+    print(f"Successfully merged {len(responses)} results into the table: {config.result_table}")
+    if plan.transpiled_responses:
+        updated_sdf = updated_sdf.unionByName(
+            merge_transpiled_responses(spark, config.result_table, plan.transpiled_responses))
+    return ConversionResult(requests, responses, prompt_token_summary,
+                            prompts.prompt_builder.costs if prompts.prompt_builder else [], updated_sdf,
+                            plan.transpiled_responses)
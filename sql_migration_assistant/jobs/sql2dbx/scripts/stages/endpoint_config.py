@@ -0,0 +1,72 @@
+"""
+This module holds the model serving endpoint settings shared by the conversion and syntax error fix stages.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from ..batch_inference_helper import AsyncChatClient, BatchInferenceManager
+from ..endpoint_calibration_helper import RunProfile
+
+
+@dataclass
+class EndpointConfig:
+    """
+    A class to represent the settings of the requests sent to a model serving endpoint.
+
+    Attributes:
+        endpoint_name (str): The name of the model serving endpoint.
+        request_params (Dict[str, Any]): The extra chat HTTP request parameters.
+        concurrency (int): The number of concurrent requests.
+        logging_interval (int): The number of requests processed before logging a progress update.
+        timeout (int): The client-side timeout in seconds.
+        max_retries_backpressure (int): The maximum number of retries on backpressure status codes.
+        max_retries_other (int): The maximum number of retries on other errors.
+        run_profile (Optional[str]): The path of a run profile created by 06_calibrate_endpoint.
+        record_file (Optional[str]): The file to record the request/response pairs to, copied from a local temporary file on close.
+        replay_file (Optional[str]): The file to serve the responses from instead of calling the endpoint.
+        replay_with_original_timing (bool): If True, replayed responses wait for their recorded latency.
+    """
+    endpoint_name: str
+    request_params: Dict[str, Any] = field(default_factory=lambda: {"max_tokens": 4000, "temperature": 0})
+    concurrency: int = 10
+    logging_interval: int = 1
+    timeout: int = 300
+    max_retries_backpressure: int = 20
+    max_retries_other: int = 5
+    run_profile: Optional[str] = None
+    record_file: Optional[str] = None
+    replay_file: Optional[str] = None
+    replay_with_original_timing: bool = False
+
+    def apply_run_profile(self) -> None:
+        """Overrides concurrency, timeout and `max_tokens` with the run profile, if one is specified."""
+        if not self.run_profile:
+            return
+        run_profile = RunProfile.load(self.run_profile)
+        if run_profile.endpoint_name != self.endpoint_name:
+            print(f"Warning: The run profile was calibrated for the endpoint '{run_profile.endpoint_name}', "
+                  f"not '{self.endpoint_name}'.")
+        self.concurrency = run_profile.concurrency
+        self.timeout = run_profile.timeout
+        self.request_params = run_profile.apply_request_params(self.request_params)
+        print(f"Applied run profile: {self.run_profile}")
+
+    def create_batch_manager(self, log_level: int = logging.INFO) -> BatchInferenceManager:
+        """Creates a BatchInferenceManager with a new AsyncChatClient for the endpoint."""
+        return BatchInferenceManager(
+            client=AsyncChatClient(
+                endpoint_name=self.endpoint_name,
+                request_params=self.request_params,
+                timeout=self.timeout,
+                max_retries_backpressure=self.max_retries_backpressure,
+                max_retries_other=self.max_retries_other,
+                record_file=self.record_file,
+                replay_file=self.replay_file,
+                replay_with_original_timing=self.replay_with_original_timing,
+                log_level=log_level,
+            ),
+            concurrency=self.concurrency,
+            logging_interval=self.logging_interval,
+            log_level=log_level,
+        )
@@ -0,0 +1,66 @@
+"""
+This module exports the converted code of the result table to Databricks notebooks.
+It is the stage logic of 04_export_to_databricks_notebooks.
+"""
+import os
+from typing import Any, Dict, List
+
+from databricks.sdk import WorkspaceClient
+from databricks.sdk.service import workspace
+from pyspark.sql import SparkSession
+
+from ..notebook_export_helper import ExportInput, NotebookExportHelper
+
+MAX_NOTEBOOK_SIZE = 10 * 1024 * 1024
+
+
+def export_notebooks(spark: SparkSession, result_table: str, output_dir: str) -> List[Dict[str, Any]]:
+    """
+    Exports the converted code of each file of the result table as a notebook in the output directory.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        result_table (str): The name of the conversion result table.
+        output_dir (str): The directory where the notebooks are saved, in the Workspace or Repos.
+
+    Returns:
+        List[Dict[str, Any]]: The export result of each notebook, without its encoded content.
+    """
+    helper = NotebookExportHelper()
+    exporter_inputs = [ExportInput(input_file_path=row['input_file_path'],
+                                   output_dir=output_dir,
+                                   code=row['result_content'],
+                                   python_parse_error=row['result_python_parse_error'],
+                                   sql_parse_error=row['result_sql_parse_errors'],
+                                   ) for row in spark.table(result_table).collect()]
+    results = helper.process_notebooks(exporter_inputs)
+
+    ws_client = WorkspaceClient()
+    for output in results:
+        # Create directories if they don't exist
+        os.makedirs(os.path.dirname(output.output_file_path), exist_ok=True)
+
+        # Check the size of the encoded content
+        if output.base64_encoded_content_size > MAX_NOTEBOOK_SIZE:
+            output.export_error = "Content size exceeds 10MB limit"
+            continue
+
+        try:
+            # Export notebook
+            ws_client.workspace.import_(
+                content=output.base64_encoded_content,
+                path=output.output_file_path,
+                format=workspace.ImportFormat.SOURCE,
+                language=workspace.Language.PYTHON,
+                overwrite=True,
+            )
+            print(f"Exported notebook to {output.output_file_path}")
+            output.export_succeeded = True
+        except Exception as e:
+            output.export_error = str(e)
+
+    exclude_fields = {'base64_encoded_content'}
+    return [
+        {k: v for k, v in output.__dict__.items() if k not in exclude_fields}
+        for output in results
+    ]
@@ -0,0 +1,90 @@
+"""
+This module fixes the syntax errors found by the static syntax check with a model serving endpoint.
+It is the stage logic of 03_02_fix_syntax_error.
+"""
+import logging
+from typing import List, Tuple
+
+from pyspark.sql import DataFrame, SparkSession
+
+from ..batch_inference_helper import (BatchInferenceRequest,
+                                      BatchInferenceResponse)
+from ..statement_repair_helper import (FixTarget, StatementRepairPlanner,
+                                       create_file_fix_request)
+from .endpoint_config import EndpointConfig
+from .result_processor import BatchInferenceResultProcessor
+
+REPAIR_MODES = ["statement", "file"]
+
+
+def get_fix_targets(spark: SparkSession, result_table: str) -> List[FixTarget]:
+    """Returns the files of the result table with syntax errors."""
+    input_sdf = spark.sql(f"""
+        SELECT
+            input_file_number,
+            result_content,
+            result_python_parse_error,
+            result_sql_parse_errors
+        FROM {result_table}
+        WHERE result_python_parse_error IS NOT NULL
+        OR (result_sql_parse_errors IS NOT NULL AND size(result_sql_parse_errors) > 0)
+    """)
+    return [
+        FixTarget(
+            input_file_number=row['input_file_number'],
+            content=row['result_content'],
+            python_parse_error=row['result_python_parse_error'],
+            sql_parse_errors=list(row['result_sql_parse_errors'] or []))
+        for row in input_sdf.collect()
+    ]
+
+
+def create_fix_requests(spark: SparkSession, result_table: str) -> List[BatchInferenceRequest]:
+    """Creates a whole-file fix request for each file of the result table with syntax errors."""
+    return [create_file_fix_request(target) for target in get_fix_targets(spark, result_table)]
+
+
+async def fix_syntax_errors(spark: SparkSession, result_table: str, endpoint: EndpointConfig,
+                            repair_mode: str = "statement", context_lines: int = 3,
+                            log_level: int = logging.INFO) -> Tuple[List[BatchInferenceResponse], DataFrame]:
+    """
+    Sends fix requests for the files with syntax errors and merges the fixed code into the result table.
+
+    In `statement` mode, only the failing Spark SQL queries are sent with a few lines of surrounding code, and the
+    fixed fragments are spliced back into the files. Files whose fragments cannot be located or spliced are fixed as
+    a whole in a second round. In `file` mode, every file is sent as a whole.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        result_table (str): The name of the conversion result table.
+        endpoint (EndpointConfig): The settings of the model serving endpoint.
+        repair_mode (str): `statement` or `file`.
+        context_lines (int): The number of lines before and after each fragment sent as reference in `statement` mode.
+        log_level (int): The logging level of the batch inference.
+
+    Returns:
+        Tuple[List[BatchInferenceResponse], DataFrame]: The responses, indexed by input_file_number,
+            and the updated rows of the result table.
+    """
+    if repair_mode not in REPAIR_MODES:
+        raise ValueError(f"Unsupported repair mode: {repair_mode}. Supported modes are: {REPAIR_MODES}")
+    targets = get_fix_targets(spark, result_table)
+    batch_manager = endpoint.create_batch_manager(log_level=log_level)
+    if repair_mode == "file":
+        responses = await batch_manager.batch_inference([create_file_fix_request(target) for target in targets])
+    else:
+        planner = StatementRepairPlanner(targets, context_lines=context_lines)
+        requests = planner.create_requests()
+        print(f"Sending {len(requests) - len(planner.whole_file_targets)} statement fix requests for "
+              f"{len(planner.fragments)} files and {len(planner.whole_file_targets)} whole-file fix requests.")
+        responses, fallback_targets = planner.assemble(
+            await batch_manager.batch_inference(requests, close_client=False))
+        if fallback_targets:
+            print(f"Sending whole-file fix requests for {len(fallback_targets)} files whose fixed statements "
+                  f"could not be spliced.")
+        responses += await batch_manager.batch_inference(
+            [create_file_fix_request(target) for target in fallback_targets])
+    result_processor = BatchInferenceResultProcessor(spark, model_serving_endpoint_for_fix=endpoint.endpoint_name)
+    updated_sdf = result_processor.merge_results(result_table, responses)
+    print(f"Successfully merged {len(responses)} results into the table: {result_table}")
+    return responses, updated_sdf
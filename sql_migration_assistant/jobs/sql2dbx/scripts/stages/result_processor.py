@@ -0,0 +1,199 @@
+"""
+This module merges the responses of the conversion and syntax error fix stages into the result table.
+"""
+from dataclasses import replace
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+from delta.tables import DeltaTable
+from pyspark.sql import Column, DataFrame, SparkSession
+from pyspark.sql.functions import coalesce, col, lit, sha2, when
+from pyspark.sql.types import (ArrayType, BooleanType, IntegerType, LongType,
+                               StringType, StructField, StructType,
+                               TimestampType)
+
+from ..arrow_dataframe_helper import create_dataframe, rows_to_arrow_table
+from ..batch_inference_helper import BatchInferenceResponse
+from ..conversion_result_clean_helper import ConversionResultCleanHelper
+from ..streaming_pipeline_helper import PipelineResult
+from .syntax_check import add_hash_columns
+
+
+class BatchInferenceResultProcessor:
+    """
+    A class to process batch inference results and merge them into the result table in a Databricks environment.
+    """
+
+    def __init__(self, spark: SparkSession, model_serving_endpoint_for_conversion: Optional[str] = None,
+                 model_serving_endpoint_for_fix: Optional[str] = None, size_ratio_threshold: float = 0.9):
+        """
+        Initialize the BatchInferenceResultProcessor with the schema for inference responses and model serving endpoints.
+
+        Args:
+            spark (SparkSession): The Spark session.
+            model_serving_endpoint_for_conversion (Optional[str]): The model serving endpoint for conversion.
+            model_serving_endpoint_for_fix (Optional[str]): The model serving endpoint for fix.
+            size_ratio_threshold (float): The threshold for the ratio of cleaned content size to original content size. If the ratio is below this threshold, a warning is printed. Default is 0.9 (90%).
+        """
+        self.spark = spark
+        self.model_serving_endpoint_for_conversion = model_serving_endpoint_for_conversion
+        self.model_serving_endpoint_for_fix = model_serving_endpoint_for_fix
+        self.size_ratio_threshold = size_ratio_threshold
+        self.clean_helper = ConversionResultCleanHelper()
+        self.schema = StructType([
+            StructField("input_file_number", LongType(), True),
+            StructField("result_content", StringType(), True),
+            StructField("result_token_count", IntegerType(), True),
+            StructField("result_error", StringType(), True),
+            StructField("result_timestamp", TimestampType(), True),
+        ])
+        self.arrow_schema = pa.schema([
+            ("input_file_number", pa.int64()),
+            ("result_content", pa.string()),
+            ("result_token_count", pa.int32()),
+            ("result_error", pa.string()),
+            ("result_timestamp", pa.timestamp("us")),
+        ])
+
+    def merge_results(self, target_table: str, responses: List[BatchInferenceResponse]) -> DataFrame:
+        """
+        Merge the batch inference results into the target table.
+
+        The response contents are cleaned with ConversionResultCleanHelper before they are written, so the table
+        is written once. Only the rows of the responses are updated through a Delta MERGE keyed on input_file_number,
+        so the unchanged rows, including their input file contents, are not rewritten.
+
+        Args:
+            target_table (str): The name of the result table.
+            responses (List[BatchInferenceResponse]): The list of responses from batch inference.
+
+        Returns:
+            DataFrame: The updated rows of the target table.
+        """
+        cleaned_responses, small_contents = self._clean_responses(responses)
+        if small_contents:
+            self._warn_small_contents(target_table, small_contents)
+        result_sdf = self._create_result_dataframe(cleaned_responses)
+        return self._merge(target_table, result_sdf, self._get_update_columns())
+
+    def merge_pipeline_results(self, target_table: str, results: List[PipelineResult]) -> DataFrame:
+        """
+        Merge the results of StreamingConversionPipeline into the target table, together with their syntax check results.
+
+        The contents were already cleaned by the pipeline. model_serving_endpoint_for_fix is only set for the files
+        for which fix requests were sent.
+
+        Args:
+            target_table (str): The name of the result table.
+            results (List[PipelineResult]): The results of the pipeline.
+
+        Returns:
+            DataFrame: The updated rows of the target table.
+        """
+        current_time = datetime.now()
+        rows = []
+        for result in results:
+            res, check = result.response, result.syntax_check
+            rows.append((res.index, res.content, res.token_count, res.error, current_time,
+                         check.python_parse_error if check else None,
+                         check.extracted_sqls if check else None,
+                         check.sql_parse_errors if check else None,
+                         result.fix_attempts > 0,
+                         check is not None))
+        schema = StructType(self.schema.fields + [
+            StructField("result_python_parse_error", StringType(), True),
+            StructField("result_extracted_sqls", ArrayType(StringType()), True),
+            StructField("result_sql_parse_errors", ArrayType(StringType()), True),
+            StructField("fixed", BooleanType(), True),
+            StructField("checked", BooleanType(), True),
+        ])
+        arrow_schema = (self.arrow_schema
+                        .append(pa.field("result_python_parse_error", pa.string()))
+                        .append(pa.field("result_extracted_sqls", pa.list_(pa.string())))
+                        .append(pa.field("result_sql_parse_errors", pa.list_(pa.string())))
+                        .append(pa.field("fixed", pa.bool_()))
+                        .append(pa.field("checked", pa.bool_())))
+        result_sdf = create_dataframe(self.spark, rows_to_arrow_table(rows, arrow_schema), schema)
+        update_columns = self._get_update_columns()
+        update_columns.update({
+            "result_python_parse_error": col("result.result_python_parse_error"),
+            "result_extracted_sqls": col("result.result_extracted_sqls"),
+            "result_sql_parse_errors": col("result.result_sql_parse_errors"),
+            "checked_hash": when(col("result.checked"), update_columns["result_content_hash"])
+            .otherwise(lit(None).cast(StringType())),
+            "model_serving_endpoint_for_fix": when(col("result.fixed"), coalesce(lit(self.model_serving_endpoint_for_fix), col("target.model_serving_endpoint_for_fix")))
+            .otherwise(col("target.model_serving_endpoint_for_fix")),
+        })
+        return self._merge(target_table, result_sdf, update_columns)
+
+    def _merge(self, target_table: str, result_sdf: DataFrame, update_columns: Dict[str, Column]) -> DataFrame:
+        """Update the rows of the target table that match the result rows by input_file_number, and return them."""
+        add_hash_columns(self.spark, target_table)
+        (DeltaTable.forName(self.spark, target_table).alias("target")
+         .merge(result_sdf.alias("result"), "target.input_file_number = result.input_file_number")
+         .whenMatchedUpdate(set=update_columns)
+         .execute())
+        return self.spark.table(target_table).join(result_sdf.select("input_file_number"), on="input_file_number")
+
+    def _create_result_dataframe(self, responses: List[BatchInferenceResponse]) -> DataFrame:
+        """Create a DataFrame from the batch inference responses."""
+        current_time = datetime.now()
+        responses_with_timestamp = [
+            (res.index, res.content, res.token_count, res.error, current_time)
+            for res in responses
+        ]
+        return create_dataframe(self.spark, rows_to_arrow_table(responses_with_timestamp, self.arrow_schema), self.schema)
+
+    def _clean_responses(self, responses: List[BatchInferenceResponse]) -> Tuple[List[BatchInferenceResponse], List[Tuple]]:
+        """
+        Clean the response contents in a single pass and find the ones whose cleaned size is below size_ratio_threshold.
+
+        Returns:
+            Tuple[List[BatchInferenceResponse], List[Tuple]]: The cleaned responses, and the input_file_number,
+                original size, cleaned size and size ratio of each content below the threshold.
+        """
+        cleaned_responses = []
+        small_contents = []
+        for res in responses:
+            cleaned_content = self.clean_helper.clean(res.content)
+            if res.content:
+                size_ratio = len(cleaned_content) / len(res.content)
+                if size_ratio < self.size_ratio_threshold:
+                    small_contents.append((res.index, len(res.content), len(cleaned_content), size_ratio))
+            cleaned_responses.append(replace(res, content=cleaned_content))
+        return cleaned_responses, small_contents
+
+    def _warn_small_contents(self, target_table: str, small_contents: List[Tuple]) -> None:
+        """Print a warning with the files whose cleaned content is much smaller than the response content."""
+        print(f"Warning: The following files have cleaned content sizes less than "
+              f"{self.size_ratio_threshold * 100}% of their original sizes, "
+              f"indicating potential data loss:")
+        small_contents_df = self.spark.createDataFrame(
+            small_contents, "input_file_number LONG, original_content_size INT, cleaned_content_size INT, size_ratio DOUBLE")
+        (self.spark.table(target_table)
+         .select("input_file_number", "input_file_path")
+         .join(small_contents_df, on="input_file_number")
+         .show(truncate=False))
+
+    def _get_update_columns(self) -> Dict[str, Column]:
+        """
+        Get the columns to update in the target table, keyed by column name.
+        The syntax check results and checked_hash are cleared, so that the rows are checked again.
+        """
+        result_content = coalesce(col("result.result_content"), col("target.result_content"))
+        return {
+            "is_conversion_target": when((col("result.result_content").isNotNull()) & (col("result.result_error").isNull()), lit(False))
+            .otherwise(col("target.is_conversion_target")),
+            "result_content": result_content,
+            "result_content_hash": sha2(result_content, 256),
+            "result_token_count": coalesce(col("result.result_token_count"), col("target.result_token_count")),
+            "result_error": coalesce(col("result.result_error"), col("target.result_error")),
+            "result_timestamp": coalesce(col("result.result_timestamp"), col("target.result_timestamp")),
+            "result_python_parse_error": lit(None).cast(StringType()),
+            "result_extracted_sqls": lit(None).cast(ArrayType(StringType())),
+            "result_sql_parse_errors": lit(None).cast(ArrayType(StringType())),
+            "checked_hash": lit(None).cast(StringType()),
+            "model_serving_endpoint_for_conversion": coalesce(lit(self.model_serving_endpoint_for_conversion), col("target.model_serving_endpoint_for_conversion")),
+            "model_serving_endpoint_for_fix": coalesce(lit(self.model_serving_endpoint_for_fix), col("target.model_serving_endpoint_for_fix")),
+        }
@@ -0,0 +1,94 @@
+"""
+This module converts, checks and fixes the conversion targets of the result table in a streaming pipeline.
+It is the stage logic of 07_streaming_pipeline, and builds the conversion requests as 02_convert_sql_to_databricks.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from pyspark.sql import DataFrame, SparkSession
+
+from ..batch_inference_helper import BatchInferenceResponse
+from ..streaming_pipeline_helper import (PipelineResult,
+                                         StreamingConversionPipeline)
+from .convert import (ConversionConfig, Prompts, create_prompts,
+                      merge_transpiled_responses, plan_conversion,
+                      summarize_request_prompt_tokens)
+from .result_processor import BatchInferenceResultProcessor
+from .syntax_check import get_sql_parser
+
+
+@dataclass
+class StreamingResult:
+    """
+    A class to represent the result of the streaming pipeline.
+
+    Attributes:
+        results (List[PipelineResult]): The results of the files sent to the endpoint, the representatives of
+            near-duplicate clusters first.
+        elapsed (float): The wall-clock seconds of the pipeline runs.
+        updated_sdf (Optional[DataFrame]): The updated rows of the result table.
+        transpiled_responses (List[BatchInferenceResponse]): The files converted by the rule-based transpiler.
+    """
+    results: List[PipelineResult]
+    elapsed: float
+    updated_sdf: Optional[DataFrame] = None
+    transpiled_responses: List[BatchInferenceResponse] = field(default_factory=list)
+
+
+async def run_streaming_pipeline(spark: SparkSession, config: ConversionConfig, max_fix_attempts: int = 1,
+                                 queue_size: Optional[int] = None, prompts: Optional[Prompts] = None,
+                                 log_level: int = logging.INFO) -> StreamingResult:
+    """
+    Converts the conversion targets of the result table with StreamingConversionPipeline and merges the results
+    and their syntax check results into it.
+
+    The requests are the same as in `convert_sql_to_databricks`: the trivial files are converted by the rule-based
+    transpiler, and the representatives of near-duplicate clusters go through the pipeline first, so that their
+    fixed results are the examples of the other files of their clusters.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        config (ConversionConfig): The settings of the conversion stage. The endpoint is also used for the fixes.
+        max_fix_attempts (int): The maximum number of fix requests per file with syntax errors.
+        queue_size (Optional[int]): The maximum number of files waiting between two stages.
+        prompts (Optional[Prompts]): The prompts of the conversion requests. Defaults to `create_prompts(config)`.
+        log_level (int): The logging level of the pipeline.
+
+    Returns:
+        StreamingResult: The results of the pipeline and the updated rows.
+    """
+    prompts = prompts or create_prompts(config)
+    plan = plan_conversion(spark, config, prompts)
+    request_builder, followers = plan.request_builder, plan.followers
+    pipeline = StreamingConversionPipeline(
+        config.endpoint.create_batch_manager(log_level=log_level),
+        parse_sql=get_sql_parser(spark),
+        max_fix_attempts=max_fix_attempts,
+        queue_size=queue_size,
+        log_level=log_level,
+    )
+    requests = [request_builder.create_request(number) for number in plan.representatives]
+    results = await pipeline.run(requests, close_client=not followers)
+    elapsed = pipeline.elapsed
+    if followers:
+        representative_responses = {result.response.index: result.response for result in results}
+        similar_file_requests = [
+            request_builder.create_similar_file_request(number, representative,
+                                                        representative_responses[representative])
+            for number, representative in followers.items()
+        ]
+        requests += similar_file_requests
+        results += await pipeline.run(similar_file_requests)
+        elapsed += pipeline.elapsed
+    summarize_request_prompt_tokens(requests, request_builder.token_counter)
+
+    endpoint_name = config.endpoint.endpoint_name
+    updated_sdf = BatchInferenceResultProcessor(
+        spark, model_serving_endpoint_for_conversion=endpoint_name, model_serving_endpoint_for_fix=endpoint_name
+    ).merge_pipeline_results(config.result_table, results)
+    print(f"Successfully merged {len(results)} results into the table: {config.result_table}")
+    if plan.transpiled_responses:
+        updated_sdf = updated_sdf.unionByName(
+            merge_transpiled_responses(spark, config.result_table, plan.transpiled_responses))
+    return StreamingResult(results, elapsed, updated_sdf, plan.transpiled_responses)
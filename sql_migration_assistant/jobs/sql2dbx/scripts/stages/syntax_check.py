@@ -0,0 +1,207 @@
+"""
+This module checks the syntax of the converted Python functions and the Spark SQL statements extracted from them.
+It is the stage logic of 03_01_static_syntax_check.
+
+Each row records the SHA-256 hash of the checked content in `checked_hash`. The stages that write `result_content`
+update `result_content_hash`, so that the incremental check only processes the rows whose hashes differ.
+"""
+from typing import Any, Callable, List, Optional, Tuple
+
+import pyarrow as pa
+from delta.tables import DeltaTable
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql.functions import sha2, udf
+from pyspark.sql.types import (ArrayType, IntegerType, StringType,
+                               StructField, StructType)
+
+from ..arrow_dataframe_helper import create_dataframe, rows_to_arrow_table
+from ..autofix_rules_helper import AutoFixEngine
+from ..spark_sql_extract_helper import SparkSQLExtractHelper
+from ..streaming_pipeline_helper import SyntaxCheckResult
+
+PARSED_SCHEMA = StructType([
+    StructField("input_file_number", IntegerType(), True),
+    StructField("result_sql_parse_errors", ArrayType(StringType()), True)
+])
+PARSED_ARROW_SCHEMA = pa.schema([
+    ("input_file_number", pa.int32()),
+    ("result_sql_parse_errors", pa.list_(pa.string())),
+])
+AUTOFIXED_SCHEMA = StructType([
+    StructField("input_file_number", IntegerType(), True),
+    StructField("result_content", StringType(), True),
+    StructField("result_extracted_sqls", ArrayType(StringType()), True),
+    StructField("result_sql_parse_errors", ArrayType(StringType()), True),
+    StructField("autofix_rules", ArrayType(StringType()), True),
+])
+AUTOFIXED_ARROW_SCHEMA = pa.schema([
+    ("input_file_number", pa.int32()),
+    ("result_content", pa.string()),
+    ("result_extracted_sqls", pa.list_(pa.string())),
+    ("result_sql_parse_errors", pa.list_(pa.string())),
+    ("autofix_rules", pa.list_(pa.string())),
+])
+
+
+HASH_COLUMNS_DDL = "result_content_hash STRING, checked_hash STRING"
+
+
+def extract_sqls(func_string: str) -> Tuple[str, List[str]]:
+    helper = SparkSQLExtractHelper()
+    return helper.extract_sql_from_string(func_string)
+
+
+extract_sqls_udf = udf(extract_sqls, StructType([
+    StructField("result_python_parse_error", StringType(), True),
+    StructField("result_extracted_sqls", ArrayType(StringType()), True)
+]))
+
+
+def parse_python_and_extract_sqls(df: DataFrame) -> DataFrame:
+    """Adds the Python parse error and the SQL statements extracted from result_content as new columns."""
+    new_df = df.withColumn("parsed_result", extract_sqls_udf("result_content"))
+    return (new_df
+            .withColumn("result_python_parse_error", new_df["parsed_result"].getItem("result_python_parse_error"))
+            .withColumn("result_extracted_sqls", new_df["parsed_result"].getItem("result_extracted_sqls"))
+            .drop("parsed_result")
+            )
+
+
+def get_sql_parser(spark: SparkSession) -> Callable[[str], Any]:
+    """Returns the parse function of the Spark SQL parser, which can only be called on the driver."""
+    return spark._jsparkSession.sessionState().sqlParser().parsePlan
+
+
+def parse_sql_statements(spark: SparkSession, df: DataFrame) -> List[Tuple[int, List[str]]]:
+    """Parses the extracted SQL statements with the Spark SQL parser, which can only be called on the driver."""
+    parse_sql = get_sql_parser(spark)
+    result = []
+    for row in df.collect():
+        parsed_errors = []
+        for idx, sql in enumerate(row['result_extracted_sqls']):
+            try:
+                parse_sql(sql)
+            except Exception as e:
+                parsed_errors.append(f"Error in query {idx}: {str(e)}")
+        result.append((row["input_file_number"], parsed_errors))
+    return result
+
+
+def add_hash_columns(spark: SparkSession, result_table: str) -> None:
+    """Adds the hash columns to result tables created before incremental syntax checking was added."""
+    if "checked_hash" in spark.table(result_table).columns:
+        return
+    spark.sql(f"ALTER TABLE {result_table} ADD COLUMNS ({HASH_COLUMNS_DDL})")
+    spark.sql(f"UPDATE {result_table} SET result_content_hash = sha2(result_content, 256)")
+
+
+def run_static_syntax_check(spark: SparkSession, result_table: str, autofix: bool = True,
+                            autofix_rules: Optional[List[str]] = None, incremental: bool = True) -> DataFrame:
+    """
+    Checks the syntax of the conversion results and saves the errors into the result table.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        result_table (str): The name of the conversion result table.
+        autofix (bool): If True, the checked files with errors are fixed locally with `autofix_syntax_errors`
+            afterwards, so that only the files that still have errors are left for 03_02_fix_syntax_error.
+        autofix_rules (Optional[List[str]]): The rules of AutoFixEngine to apply. None applies all rules.
+        incremental (bool): If True, only the rows whose `result_content_hash` differs from their `checked_hash`
+            are checked. If False, all rows are checked.
+
+    Returns:
+        DataFrame: The result table with the syntax check results.
+    """
+    add_hash_columns(spark, result_table)
+    target_df = spark.table(result_table)
+    if incremental:
+        target_df = target_df.filter("NOT (result_content_hash <=> checked_hash)")
+    new_df = (parse_python_and_extract_sqls(target_df.select("input_file_number", "result_content"))
+              .withColumn("checked_hash", sha2("result_content", 256)))
+    parsed_data = parse_sql_statements(spark, new_df)
+    print(f"Checked {len(parsed_data)} files" + (" whose content changed since their last check." if incremental else "."))
+    if not parsed_data:
+        return spark.table(result_table)
+
+    parsed_errors_df = create_dataframe(spark, rows_to_arrow_table(parsed_data, PARSED_ARROW_SCHEMA), PARSED_SCHEMA)
+    checked_df = new_df.join(parsed_errors_df, on="input_file_number", how="left")
+    (DeltaTable.forName(spark, result_table).alias("target")
+     .merge(checked_df.alias("checked"), "target.input_file_number = checked.input_file_number")
+     .whenMatchedUpdate(set={
+         "result_python_parse_error": "checked.result_python_parse_error",
+         "result_extracted_sqls": "checked.result_extracted_sqls",
+         "result_sql_parse_errors": "checked.result_sql_parse_errors",
+         # The hash of the content as read by the check, in case it was written without updating the hash
+         "result_content_hash": "checked.checked_hash",
+         "checked_hash": "checked.checked_hash",
+     })
+     .execute())
+    print(f"Changes applied to the result table: {result_table}.")
+    if autofix:
+        autofixed_df = autofix_syntax_errors(spark, result_table, autofix_rules,
+                                             input_file_numbers=[number for number, _ in parsed_data])
+        print(f"Fixed {autofixed_df.count()} files with local autofix rules.")
+        autofixed_df.select("input_file_number", "autofix_rules", "result_sql_parse_errors").show(truncate=False)
+    return spark.table(result_table)
+
+
+def autofix_syntax_errors(spark: SparkSession, result_table: str, rules: Optional[List[str]] = None,
+                          input_file_numbers: Optional[List[int]] = None) -> DataFrame:
+    """
+    Fixes the files with syntax errors with the deterministic rules of AutoFixEngine, without a model serving
+    endpoint, and saves the files that have fewer errors afterwards into the result table.
+
+    Args:
+        spark (SparkSession): The Spark session.
+        result_table (str): The name of the conversion result table with syntax check results.
+        rules (Optional[List[str]]): The rules to apply. None applies all rules.
+        input_file_numbers (Optional[List[int]]): The files to fix, e.g. the files checked in this run, so that
+            the files the rules could not fix before are not tried again. None fixes all files with errors.
+
+    Returns:
+        DataFrame: The fixed files with their syntax check results and applied rules.
+    """
+    engine = AutoFixEngine(get_sql_parser(spark), rules)
+    error_rows = spark.sql(f"""
+        SELECT input_file_number, result_content, result_python_parse_error, result_extracted_sqls, result_sql_parse_errors
+        FROM {result_table}
+        WHERE result_python_parse_error IS NOT NULL
+        OR (result_sql_parse_errors IS NOT NULL AND size(result_sql_parse_errors) > 0)
+    """).collect()
+    if input_file_numbers is not None:
+        numbers = set(input_file_numbers)
+        error_rows = [row for row in error_rows if row["input_file_number"] in numbers]
+    rows = []
+    for row in error_rows:
+        result = engine.fix(row["result_content"], SyntaxCheckResult(
+            row["result_python_parse_error"],
+            list(row["result_extracted_sqls"] or []),
+            list(row["result_sql_parse_errors"] or [])))
+        if result.applied_rules:
+            rows.append((row["input_file_number"], result.content, result.syntax_check.extracted_sqls,
+                         result.syntax_check.sql_parse_errors, result.applied_rules))
+    autofixed_df = create_dataframe(spark, rows_to_arrow_table(rows, AUTOFIXED_ARROW_SCHEMA), AUTOFIXED_SCHEMA)
+    if rows:
+        # The files fixed by AutoFixEngine have no Python parse errors, and their check results are up to date
+        (DeltaTable.forName(spark, result_table).alias("target")
+         .merge(autofixed_df.alias("fixed"), "target.input_file_number = fixed.input_file_number")
+         .whenMatchedUpdate(set={
+             "result_content": "fixed.result_content",
+             "result_python_parse_error": "CAST(NULL AS STRING)",
+             "result_extracted_sqls": "fixed.result_extracted_sqls",
+             "result_sql_parse_errors": "fixed.result_sql_parse_errors",
+             "result_content_hash": "sha2(fixed.result_content, 256)",
+             "checked_hash": "sha2(fixed.result_content, 256)",
+         })
+         .execute())
+    return autofixed_df
+
+
+def count_syntax_error_files(spark: SparkSession, result_table: str) -> int:
+    """Returns the number of files with syntax errors."""
+    return spark.sql(f"""
+        SELECT COUNT(*) as error_count
+        FROM {result_table}
+        WHERE result_python_parse_error IS NOT NULL
+        OR (result_sql_parse_errors IS NOT NULL AND size(result_sql_parse_errors) > 0)
+    """).collect()[0]['error_count']
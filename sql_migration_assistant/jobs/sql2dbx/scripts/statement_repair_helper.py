@@ -0,0 +1,286 @@
+"""
+This module repairs Spark SQL syntax errors statement by statement instead of sending whole files to the model.
+
+The failing queries are located from the indexes in `result_sql_parse_errors` and the `spark.sql` calls found by
+SparkSQLExtractHelper. Each failing call, together with the assignment of its query variable, is sent as a fragment
+with a few lines of surrounding code, and the fixed fragments are spliced back into the original code. A file is fixed
+as a whole instead if its errors cannot be located, a fragment request fails, or the spliced code does not parse.
+"""
+import ast
+import re
+import textwrap
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
+
+from .batch_inference_helper import (BatchInferenceRequest,
+                                     BatchInferenceResponse)
+from .conversion_result_clean_helper import ConversionResultCleanHelper
+from .spark_sql_extract_helper import SparkSQLExtractHelper
+from .system_prompts.syntax_error_fix_prompt import (
+    create_fix_system_message, create_statement_fix_system_message)
+
+SQL_ERROR_INDEX_PATTERN = re.compile(r"^Error in query (\d+):")
+
+
+@dataclass
+class FixTarget:
+    """Data class for storing a converted file with syntax errors."""
+    input_file_number: int
+    content: str
+    python_parse_error: Optional[str] = None
+    sql_parse_errors: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RepairFragment:
+    """
+    Data class for storing a fragment of a converted file to be fixed separately.
+
+    Attributes:
+        start_line (int): The first line of the fragment, 1-based.
+        end_line (int): The last line of the fragment, inclusive.
+        indent (str): The indentation of the first line, removed from the fragment lines and added back when splicing.
+        code (str): The dedented code of the fragment, which consists of whole lines.
+        sql_errors (List[str]): The Spark SQL parse errors of the queries in the fragment.
+        context_before (str): The lines before the fragment, for reference.
+        context_after (str): The lines after the fragment, for reference.
+    """
+    start_line: int
+    end_line: int
+    indent: str
+    code: str
+    sql_errors: List[str]
+    context_before: str = ""
+    context_after: str = ""
+
+
+def create_file_fix_request(target: FixTarget, index: Optional[int] = None) -> BatchInferenceRequest:
+    """Creates a request to fix the whole file. The index defaults to the input_file_number."""
+    return BatchInferenceRequest(
+        index=target.input_file_number if index is None else index,
+        text=target.content,
+        system_message=create_fix_system_message(target.python_parse_error, target.sql_parse_errors))
+
+
+def _get_position(node: ast.AST) -> Tuple[int, int, int, int]:
+    return node.lineno, node.col_offset, node.end_lineno, node.end_col_offset
+
+
+def _get_parents(tree: ast.AST) -> Dict[ast.AST, ast.AST]:
+    return {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+
+
+def _get_statement(node: ast.AST, parents: Dict[ast.AST, ast.AST]) -> Optional[ast.stmt]:
+    """Returns the innermost statement containing the node."""
+    while node is not None and not isinstance(node, ast.stmt):
+        node = parents.get(node)
+    return node
+
+
+def _get_block(stmt: ast.stmt, parents: Dict[ast.AST, ast.AST]) -> Optional[List[ast.stmt]]:
+    """Returns the statement list (e.g. a function body) that directly contains the statement."""
+    parent = parents.get(stmt)
+    for _, value in ast.iter_fields(parent):
+        if isinstance(value, list) and any(item is stmt for item in value):
+            return value
+    return None
+
+
+def _find_query_assignment(tree: ast.AST, call: ast.Call) -> Optional[ast.Assign]:
+    """Returns the last assignment of the query variable passed to the call before the call, if any."""
+    if not call.args or not isinstance(call.args[0], ast.Name):
+        return None
+    name = call.args[0].id
+    assignments = [node for node in ast.walk(tree)
+                   if isinstance(node, ast.Assign) and node.lineno < call.lineno
+                   and isinstance(node.targets[0], ast.Name) and node.targets[0].id == name]
+    return max(assignments, key=lambda node: node.lineno, default=None)
+
+
+def _get_call_span(tree: ast.AST, call: ast.Call, parents: Dict[ast.AST, ast.AST]) -> Optional[Tuple[int, int]]:
+    """
+    Returns the lines of the statement with the call, extended back to the assignment of its query variable.
+    None if the assignment is in a different block than the call, e.g. only in one branch of an if statement.
+    """
+    stmt = _get_statement(call, parents)
+    assignment = _find_query_assignment(tree, call)
+    if assignment is None:
+        return stmt.lineno, stmt.end_lineno
+    block = _get_block(assignment, parents)
+    while stmt is not None and not any(item is stmt for item in block or []):
+        stmt = _get_statement(parents.get(stmt), parents)
+    if stmt is None:
+        return None
+    return assignment.lineno, stmt.end_lineno
+
+
+def _merge_spans(spans: List[Tuple[int, int, str]]) -> List[Tuple[int, int, List[str]]]:
+    """Merges overlapping line spans and collects their errors, in line order."""
+    merged = []
+    for start, end, error in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end), merged[-1][2] + [error])
+        else:
+            merged.append((start, end, [error]))
+    return merged
+
+
+def locate_repair_fragments(content: str, sql_parse_errors: List[str],
+                            context_lines: int = 3) -> Optional[List[RepairFragment]]:
+    """
+    Locates the fragments of a converted file that contain the queries with Spark SQL parse errors.
+
+    Args:
+        content (str): The converted Python code.
+        sql_parse_errors (List[str]): The errors in the form of `Error in query {index}: ...`, where index is the
+            position of the query among the statements extracted by SparkSQLExtractHelper.
+        context_lines (int): The number of lines before and after each fragment passed as reference.
+
+    Returns:
+        Optional[List[RepairFragment]]: The fragments in line order, or None if any error cannot be located.
+    """
+    if not sql_parse_errors:
+        return None
+    helper = SparkSQLExtractHelper()
+    python_error, _ = helper.extract_sql_from_string(content)
+    if python_error:
+        return None
+    tree = ast.parse(content)
+    parents = _get_parents(tree)
+    # The calls found by the helper belong to its own tree, so they are matched to this tree by position
+    calls = {_get_position(node): node for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    lines = content.split("\n")
+
+    spans = []
+    for error in sql_parse_errors:
+        match = SQL_ERROR_INDEX_PATTERN.match(error)
+        if not match or int(match.group(1)) >= len(helper.sql_calls):
+            return None
+        call = calls[_get_position(helper.sql_calls[int(match.group(1))])]
+        span = _get_call_span(tree, call, parents)
+        if span is None:
+            return None
+        spans.append((*span, error))
+
+    fragments = []
+    for start, end, errors in _merge_spans(spans):
+        # Lines inside multi-line strings may be less indented than the statement, and are kept as they are
+        first_line = lines[start - 1]
+        indent = first_line[:len(first_line) - len(first_line.lstrip())]
+        code_lines = [line[len(indent):] if line.startswith(indent) else line for line in lines[start - 1:end]]
+        fragments.append(RepairFragment(
+            start_line=start,
+            end_line=end,
+            indent=indent,
+            code="\n".join(code_lines),
+            sql_errors=errors,
+            context_before="\n".join(lines[max(start - 1 - context_lines, 0):start - 1]),
+            context_after="\n".join(lines[end:end + context_lines]),
+        ))
+    return fragments
+
+
+def splice_fragments(content: str, fragments: List[RepairFragment], fixed_codes: List[str]) -> str:
+    """
+    Replaces the fragments of the content with their fixed code, indented as the original fragments.
+
+    Args:
+        content (str): The converted Python code.
+        fragments (List[RepairFragment]): The fragments located in the content, in line order.
+        fixed_codes (List[str]): The fixed code of each fragment.
+
+    Returns:
+        str: The content with the fixed fragments.
+    """
+    lines = content.split("\n")
+    for fragment, fixed_code in reversed(list(zip(fragments, fixed_codes))):
+        fixed_lines = textwrap.indent(fixed_code.strip("\n"), fragment.indent).split("\n")
+        lines[fragment.start_line - 1:fragment.end_line] = fixed_lines
+    return "\n".join(lines)
+
+
+class StatementRepairPlanner:
+    def __init__(self, targets: List[FixTarget], context_lines: int = 3):
+        """
+        Initialize the StatementRepairPlanner and locate the fragments of each file.
+
+        Args:
+            targets (List[FixTarget]): The files with syntax errors.
+            context_lines (int): The number of lines before and after each fragment passed as reference.
+        """
+        self.clean_helper = ConversionResultCleanHelper()
+        self.fragments: Dict[int, List[RepairFragment]] = {}
+        self.whole_file_targets: List[FixTarget] = []
+        self._targets = {target.input_file_number: target for target in targets}
+        for target in targets:
+            fragments = None
+            if not target.python_parse_error:
+                fragments = locate_repair_fragments(target.content, target.sql_parse_errors, context_lines)
+            if fragments:
+                self.fragments[target.input_file_number] = fragments
+            else:
+                self.whole_file_targets.append(target)
+        # The input_file_number and fragment position of each request. The position is None for a whole-file request
+        self._request_keys: List[Tuple[int, Optional[int]]] = []
+
+    def create_requests(self) -> List[BatchInferenceRequest]:
+        """
+        Creates a request for each fragment, and a whole-file request for each file whose errors were not located.
+        The requests are indexed by their position, which is mapped back to the files by `assemble`.
+        """
+        requests = []
+        self._request_keys = []
+        for input_file_number, fragments in self.fragments.items():
+            for position, fragment in enumerate(fragments):
+                requests.append(BatchInferenceRequest(
+                    index=len(requests),
+                    text=fragment.code,
+                    system_message=create_statement_fix_system_message(
+                        fragment.sql_errors, fragment.context_before, fragment.context_after)))
+                self._request_keys.append((input_file_number, position))
+        for target in self.whole_file_targets:
+            requests.append(create_file_fix_request(target, index=len(requests)))
+            self._request_keys.append((target.input_file_number, None))
+        return requests
+
+    def assemble(self, responses: List[BatchInferenceResponse]) -> Tuple[List[BatchInferenceResponse], List[FixTarget]]:
+        """
+        Splices the fixed fragments back into their files.
+
+        Args:
+            responses (List[BatchInferenceResponse]): The responses to the requests of `create_requests`.
+
+        Returns:
+            Tuple[List[BatchInferenceResponse], List[FixTarget]]: A response indexed by input_file_number for each
+                fixed file, with the sum of the token counts of its fragments, and the files to be fixed as a whole
+                because a fragment request failed or the spliced code does not parse.
+        """
+        file_responses = []
+        fragment_responses: Dict[int, Dict[int, BatchInferenceResponse]] = {}
+        for res in responses:
+            input_file_number, position = self._request_keys[res.index]
+            if position is None:
+                file_responses.append(replace(res, index=input_file_number))
+            else:
+                fragment_responses.setdefault(input_file_number, {})[position] = res
+
+        fallback_targets = []
+        for input_file_number, fragments in self.fragments.items():
+            target = self._targets[input_file_number]
+            results = [fragment_responses.get(input_file_number, {}).get(i) for i in range(len(fragments))]
+            if any(res is None or res.error or not res.content for res in results):
+                fallback_targets.append(target)
+                continue
+            fixed_codes = [self.clean_helper.clean(res.content) for res in results]
+            content = splice_fragments(target.content, fragments, fixed_codes)
+            try:
+                ast.parse(content)
+            except SyntaxError:
+                fallback_targets.append(target)
+                continue
+            file_responses.append(BatchInferenceResponse(
+                index=input_file_number,
+                content=content,
+                token_count=sum(res.token_count for res in results),
+                error=None))
+        return file_responses, fallback_targets
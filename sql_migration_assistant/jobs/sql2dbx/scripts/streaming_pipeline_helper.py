@@ -0,0 +1,201 @@
+"""
+This module converts files through conversion, cleaning, syntax check and syntax error fix as one streaming pipeline.
+
+Each file moves to its next stage as soon as its previous stage finishes, through bounded queues, instead of waiting
+for all files to finish a stage. The LLM requests of the conversion and fix stages share the concurrency of the
+BatchInferenceManager. The syntax check runs in a single thread beside the event loop, because the Spark SQL parser
+runs on the driver and is not meant to be called concurrently.
+"""
+import asyncio
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Callable, List, Optional
+
+from .batch_inference_helper import (BatchInferenceManager,
+                                     BatchInferenceRequest,
+                                     BatchInferenceResponse)
+from .conversion_result_clean_helper import ConversionResultCleanHelper
+from .spark_sql_extract_helper import SparkSQLExtractHelper
+from .system_prompts.syntax_error_fix_prompt import create_fix_system_message
+from .utils import setup_logger
+
+
+@dataclass
+class SyntaxCheckResult:
+    """Data class for storing the static syntax check result of a converted file."""
+    python_parse_error: Optional[str]
+    extracted_sqls: List[str]
+    sql_parse_errors: List[str]
+
+    @property
+    def has_errors(self) -> bool:
+        return bool(self.python_parse_error or self.sql_parse_errors)
+
+
+@dataclass
+class PipelineResult:
+    """
+    Data class for storing the result of a file that went through the pipeline.
+
+    Attributes:
+        response (BatchInferenceResponse): The cleaned response of the last successful conversion or fix request,
+            or the failed conversion response.
+        syntax_check (Optional[SyntaxCheckResult]): The syntax check result of the response content.
+            None if the conversion failed.
+        fix_attempts (int): The number of fix requests sent for the file.
+        elapsed (float): The seconds from the start of the conversion of the file to its last stage.
+    """
+    response: BatchInferenceResponse
+    syntax_check: Optional[SyntaxCheckResult] = None
+    fix_attempts: int = 0
+    elapsed: float = 0.0
+
+
+def check_syntax(content: str, parse_sql: Callable[[str], Any]) -> SyntaxCheckResult:
+    """
+    Parses a converted Python function and the Spark SQL statements extracted from it.
+
+    Args:
+        content (str): The converted Python function.
+        parse_sql (Callable[[str], Any]): Parses a SQL statement and raises an exception on syntax errors,
+            e.g. `spark._jsparkSession.sessionState().sqlParser().parsePlan`.
+
+    Returns:
+        SyntaxCheckResult: The Python parse error and the SQL parse errors, in the format of 03_01_static_syntax_check.
+    """
+    python_parse_error, extracted_sqls = SparkSQLExtractHelper().extract_sql_from_string(content)
+    sql_parse_errors = []
+    for idx, sql in enumerate(extracted_sqls):
+        try:
+            parse_sql(sql)
+        except Exception as e:
+            sql_parse_errors.append(f"Error in query {idx}: {str(e)}")
+    return SyntaxCheckResult(python_parse_error, extracted_sqls, sql_parse_errors)
+
+
+class StreamingConversionPipeline:
+    def __init__(self, manager: BatchInferenceManager, parse_sql: Callable[[str], Any], max_fix_attempts: int = 1,
+                 queue_size: Optional[int] = None, log_level: int = logging.INFO):
+        """
+        Initialize the StreamingConversionPipeline.
+
+        Args:
+            manager (BatchInferenceManager): Sends the conversion and fix requests, with its concurrency.
+            parse_sql (Callable[[str], Any]): Parses a SQL statement and raises an exception on syntax errors.
+            max_fix_attempts (int): The maximum number of fix requests per file with syntax errors.
+            queue_size (Optional[int]): The maximum number of files waiting between two stages.
+                Defaults to twice the concurrency of the manager.
+            log_level (int): The logging level for the pipeline.
+        """
+        self.manager = manager
+        self.parse_sql = parse_sql
+        self.max_fix_attempts = max_fix_attempts
+        self.queue_size = queue_size or manager.concurrency * 2
+        self.clean_helper = ConversionResultCleanHelper()
+        self.logger = setup_logger('StreamingConversionPipeline', level=log_level)
+        self.elapsed = 0.0
+
+    async def run(self, requests: List[BatchInferenceRequest], close_client: bool = True) -> List[PipelineResult]:
+        """
+        Runs the conversion requests through the pipeline.
+
+        A file whose fix request fails keeps its previous content and syntax check result.
+
+        Args:
+            requests (List[BatchInferenceRequest]): The conversion requests, one for each file.
+            close_client (bool): If True, the client of the manager is closed afterwards.
+
+        Returns:
+            List[PipelineResult]: The results, in the order of the requests.
+        """
+        self.logger.info(f"Starting pipeline for {len(requests)} requests with queue size: {self.queue_size}")
+        start_time = time.time()
+        self.manager.start_batch()
+        convert_queue = asyncio.Queue(self.queue_size)
+        check_queue = asyncio.Queue(self.queue_size)
+        fix_queue = asyncio.Queue(self.queue_size)
+        results = {}
+        loop = asyncio.get_running_loop()
+        check_executor = ThreadPoolExecutor(max_workers=1)
+
+        async def generate(i: int, request: BatchInferenceRequest) -> BatchInferenceResponse:
+            response = await self.manager.generate_one(request, i)
+            return replace(response, content=self.clean_helper.clean(response.content))
+
+        async def check(result: PipelineResult) -> None:
+            result.syntax_check = await loop.run_in_executor(
+                check_executor, check_syntax, result.response.content, self.parse_sql)
+
+        def finish(i: int, result: PipelineResult, started: float) -> None:
+            result.elapsed = time.time() - started
+            results[i] = result
+
+        async def convert_worker():
+            while True:
+                i, request = await convert_queue.get()
+                started = time.time()
+                try:
+                    await check_queue.put((i, PipelineResult(await generate(i, request)), started))
+                finally:
+                    convert_queue.task_done()
+
+        async def check_worker():
+            while True:
+                i, result, started = await check_queue.get()
+                try:
+                    if result.response.error is None and result.response.content:
+                        await check(result)
+                    if result.syntax_check and result.syntax_check.has_errors and self.max_fix_attempts > 0:
+                        await fix_queue.put((i, result, started))
+                    else:
+                        finish(i, result, started)
+                except Exception as e:
+                    self.logger.error(f"Unexpected error in syntax check (index {result.response.index}): {str(e)}")
+                    finish(i, result, started)
+                finally:
+                    check_queue.task_done()
+
+        async def fix_worker():
+            while True:
+                i, result, started = await fix_queue.get()
+                try:
+                    while result.syntax_check.has_errors and result.fix_attempts < self.max_fix_attempts:
+                        result.fix_attempts += 1
+                        response = await generate(i, BatchInferenceRequest(
+                            index=result.response.index,
+                            text=result.response.content,
+                            system_message=create_fix_system_message(
+                                result.syntax_check.python_parse_error, result.syntax_check.sql_parse_errors)))
+                        if response.error or not response.content:
+                            break
+                        result.response = response
+                        await check(result)
+                except Exception as e:
+                    self.logger.error(f"Unexpected error in fix (index {result.response.index}): {str(e)}")
+                    self.logger.error(f"Traceback: {traceback.format_exc()}")
+                finally:
+                    finish(i, result, started)
+                    fix_queue.task_done()
+
+        workers = [asyncio.create_task(convert_worker()) for _ in range(self.manager.concurrency)]
+        workers.append(asyncio.create_task(check_worker()))
+        workers += [asyncio.create_task(fix_worker()) for _ in range(self.manager.concurrency)]
+        try:
+            for i, request in enumerate(requests):
+                await convert_queue.put((i, request))
+            for queue in [convert_queue, check_queue, fix_queue]:
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            check_executor.shutdown()
+            if close_client:
+                await self.manager.client.close()
+
+        self.elapsed = time.time() - start_time
+        self.logger.info(f"Completed pipeline for {len(requests)} requests in {self.elapsed:.2f} seconds")
+        return [results[i] for i in range(len(requests))]
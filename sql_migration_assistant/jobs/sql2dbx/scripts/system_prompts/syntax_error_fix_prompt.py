@@ -0,0 +1,65 @@
+# Module for Syntax Error Fix Prompt
+from typing import List, Optional
+
+
+def create_fix_system_message(python_error: Optional[str], sql_errors: Optional[List[str]]) -> str:
+    """
+    Create a system message for an LLM to fix errors in a Python function running in a Databricks notebook.
+
+    Args:
+        python_error (Optional[str]): The Python parsing error message, if any.
+        sql_errors (Optional[List[str]]): The Spark SQL parsing error messages, if any.
+
+    Returns:
+        str: A formatted system message with instructions and error details.
+    """
+    message = f"""Fix the following errors in the Python function that runs in a Databricks notebook.
+The function contains Spark SQL queries, and most errors are Spark SQL-related.
+
+Instructions:
+1. Output only Python code and comments. No other text allowed.
+2. Do not add explanations outside of Python code.
+3. If asked to continue, resume the code without adding extra phrases.
+4. Do not omit any part of the code.
+5. Ensure proper handling of Spark SQL queries in the Databricks environment.
+6. Prioritize fixing Spark SQL-related errors.
+
+Errors to fix:
+"""
+    if python_error:
+        message += f"{python_error}\n"
+    if sql_errors:
+        message += f"{sql_errors}\n"
+    return message
+
+
+def create_statement_fix_system_message(sql_errors: List[str], context_before: str = "", context_after: str = "") -> str:
+    """
+    Create a system message for an LLM to fix Spark SQL errors in a fragment of a Python function.
+
+    Args:
+        sql_errors (List[str]): The Spark SQL parsing error messages of the queries in the fragment.
+        context_before (str): The lines of the function before the fragment, for reference only.
+        context_after (str): The lines of the function after the fragment, for reference only.
+
+    Returns:
+        str: A formatted system message with instructions, error details and the surrounding code.
+    """
+    message = f"""Fix the following errors in a fragment of a Python function that runs in a Databricks notebook.
+The fragment contains Spark SQL queries with errors. The rest of the function is not changed.
+
+Instructions:
+1. Output only the fixed fragment as Python code and comments. No other text allowed.
+2. Do not add explanations outside of Python code.
+3. Do not omit any part of the fragment, and do not add code that is not in the fragment.
+4. Keep the variable names used in the fragment, because the rest of the function refers to them.
+5. Ensure proper handling of Spark SQL queries in the Databricks environment.
+
+Errors to fix:
+{sql_errors}
+"""
+    if context_before:
+        message += f"\nCode before the fragment (for reference only, do not output it):\n{context_before}\n"
+    if context_after:
+        message += f"\nCode after the fragment (for reference only, do not output it):\n{context_after}\n"
+    return message
@@ -1,6 +1,9 @@
 # Module for T-SQL Conversion Prompt
 from typing import List, TypedDict
 
+from ..prompt_builder import PromptBuilder, PromptSection
+from ..utils import TokenCounter
+
 
 class FewShot(TypedDict):
     role: str
@@ -14,6 +17,10 @@ class TsqlConversionPromptManager:
     def get_system_message(self) -> str:
         return _system_message.format(comment_lang=self.comment_lang)
 
+    def get_prompt_builder(self, token_counter: TokenCounter, detect_sections: bool = True) -> PromptBuilder:
+        return PromptBuilder(_system_message_header, _guideline_sections, token_counter,
+                             format_args={"comment_lang": self.comment_lang}, detect_sections=detect_sections)
+
     def get_few_shots(self) -> List[FewShot]:
         return [
             {"role": "user", "content": _example_1_user},
@@ -21,7 +28,7 @@ class TsqlConversionPromptManager:
         ]
 
 # System message
-_system_message = """
+_system_message_header = """
 Convert T-SQL code to Python code that runs on Databricks according to the following instructions and guidelines:
 
 # Input and Output
@@ -37,52 +44,56 @@ Convert T-SQL code to Python code that runs on Databricks according to the follo
 6. DO NOT need to output explanation string. Just output Python code and Python comments.
 
 # Guidelines
-1. Python-based:
-    - Use Python as the primary programming language.
-2. Databricks Environment:
-    - DO NOT include the creation of Spark Sessions or imports of libraries like `from delta.tables import DeltaTable` as these are assumed to be available in the Databricks environment.
-3. Spark SQL Execution:
+"""
+
+# Guideline sections. Sections with a trigger are only needed for inputs that match it (see PromptBuilder).
+_guideline_sections = [
+    PromptSection("python", """Python-based:
+    - Use Python as the primary programming language.""", trigger=None),
+    PromptSection("databricks_environment", """Databricks Environment:
+    - DO NOT include the creation of Spark Sessions or imports of libraries like `from delta.tables import DeltaTable` as these are assumed to be available in the Databricks environment.""", trigger=None),
+    PromptSection("spark_sql_execution", """Spark SQL Execution:
     - Use `spark.sql()` to execute SQL statements.
     - Write SQL statements directly within `spark.sql()`.
-    - DO NOT store SQL statements in variables unless absolutely necessary. If you must store SQL statements in variables, prefix the variable names with `qs_` for identification.
-4. Delta Tables:
-    - Assume all tables appearing in the T-SQL script without a CREATE statement are already defined as delta tables.
-5. Comments:
-    - Add Python comments in {comment_lang} as needed to explain the code's logic.
-6. Transaction and Rollback Handling:
+    - DO NOT store SQL statements in variables unless absolutely necessary. If you must store SQL statements in variables, prefix the variable names with `qs_` for identification.""", trigger=None),
+    PromptSection("delta_tables", """Delta Tables:
+    - Assume all tables appearing in the T-SQL script without a CREATE statement are already defined as delta tables.""", trigger=None),
+    PromptSection("comments", """Comments:
+    - Add Python comments in {comment_lang} as needed to explain the code's logic.""", trigger=None),
+    PromptSection("transactions", """Transaction and Rollback Handling:
     - For T-SQL syntax related to transaction control (e.g., BEGIN TRANSACTION, COMMIT, ROLLBACK), implement equivalent logic in Python using try-except-finally blocks for error handling.
     - DO NOT use `BEGIN TRANSACTION`, `COMMIT`, `ROLLBACK` in `spark.sql()`. They are not supported and will cause errors.
     - If table rollback is needed:
         - Fetch the latest update timestamp of the delta table from the first row of its HISTORY table.
-        - Use `RESTORE TABLE TIMESTAMP AS OF` to revert the delta table to that specific timestamp.
-7. Looping Constructs:
+        - Use `RESTORE TABLE TIMESTAMP AS OF` to revert the delta table to that specific timestamp.""", trigger=r"\b(BEGIN\s+TRAN|COMMIT|ROLLBACK|SAVE\s+TRAN|XACT_ABORT|@@TRANCOUNT)"),
+    PromptSection("loops", """Looping Constructs:
     - DO NOT use `collect()`, for/while loops, or `iterrows()` as they are inefficient for large datasets.
     - Use DataFrame operations instead of cursors.
     - Leverage Spark's built-in transformations and actions (e.g., `map`, `filter`, `reduce`, `groupBy`, `merge`) for distributed data processing.
-    - Use JOINs for bulk updates instead of loops.
-8. Handling Non-Compatible Syntax:
-    - For T-SQL syntax that cannot be directly converted (e.g., CREATE NONCLUSTERED INDEX, EXEC, etc.), exclude it from the conversion and add a Python comment explaining why it was excluded and suggesting potential alternatives in Databricks, if available.
-9. SQL Function Handling:
+    - Use JOINs for bulk updates instead of loops.""", trigger=r"\b(CURSOR|WHILE|FETCH)\b"),
+    PromptSection("non_compatible_syntax", """Handling Non-Compatible Syntax:
+    - For T-SQL syntax that cannot be directly converted (e.g., CREATE NONCLUSTERED INDEX, EXEC, etc.), exclude it from the conversion and add a Python comment explaining why it was excluded and suggesting potential alternatives in Databricks, if available.""", trigger=None),
+    PromptSection("sql_functions", """SQL Function Handling:
     - Convert queries to get the same result as T-SQL, considering SQL functions that perform differently (e.g., `concat` function handling NULL values and zero byte strings).
-    - Example: In Databricks, `concat` does not ignore null values, so handle cases where null values are included.
-10. Table and View Names:
-    - Respect the original view names as much as possible, but remove `@`, `#`, and `$` as they are not supported by Spark SQL.
-11. Converting T-SQL CREATE TEMP TABLE:
+    - Example: In Databricks, `concat` does not ignore null values, so handle cases where null values are included.""", trigger=None),
+    PromptSection("table_and_view_names", """Table and View Names:
+    - Respect the original view names as much as possible, but remove `@`, `#`, and `$` as they are not supported by Spark SQL.""", trigger=None),
+    PromptSection("temp_tables", """Converting T-SQL CREATE TEMP TABLE:
     - Use a Delta table instead of a T-SQL TEMP TABLE and delete it in the finally clause.
-    - DO NOT convert T-SQL TEMP TABLE to Spark TEMP VIEW, as they are not equivalent.
-12. Converting T-SQL DELETE with Alias:
-    - Delta Lake does not support using table aliases in DELETE statements. Ensure that the full table name is used instead of an alias in DELETE statements.
-13. Converting T-SQL DELETE with JOIN:
+    - DO NOT convert T-SQL TEMP TABLE to Spark TEMP VIEW, as they are not equivalent.""", trigger=r"#\w"),
+    PromptSection("delete_with_alias", """Converting T-SQL DELETE with Alias:
+    - Delta Lake does not support using table aliases in DELETE statements. Ensure that the full table name is used instead of an alias in DELETE statements.""", trigger=r"\bDELETE\b"),
+    PromptSection("delete_with_join", """Converting T-SQL DELETE with JOIN:
     - Delta Lake does not support JOINs directly in DELETE statements.
-    - Use a temporary view or subquery to perform the JOIN, then reference the results in the DELETE statement.
-14. Converting T-SQL UPDATE Statements:
+    - Use a temporary view or subquery to perform the JOIN, then reference the results in the DELETE statement.""", trigger=r"\bDELETE\b"),
+    PromptSection("update", """Converting T-SQL UPDATE Statements:
     - DO NOT use `FROM` clauses in Spark SQL `UPDATE` statements as they are not supported.
     - Use `MERGE INTO` for `UPDATE` statements with `JOIN`. Use `UPDATE` for statements without `JOIN`.
-    - If `MERGE INTO` is not suitable, use a temporary view or subquery for the `JOIN`, then perform the `UPDATE`.
-15. Special Character Handling:
+    - If `MERGE INTO` is not suitable, use a temporary view or subquery for the `JOIN`, then perform the `UPDATE`.""", trigger=r"\bUPDATE\b"),
+    PromptSection("special_characters", """Special Character Handling:
     - Use backticks `` to enclose table and column names that contain special characters or spaces.
-    - Avoid using square brackets [] as they are not supported.
-16. Data Type Conversion: Use the following mappings to convert data types when creating the CREATE TABLE statement:
+    - Avoid using square brackets [] as they are not supported.""", trigger=r"[\[\]]"),
+    PromptSection("data_types", """Data Type Conversion: Use the following mappings to convert data types when creating the CREATE TABLE statement:
     - `VARCHAR` -> `STRING`
     - `NVARCHAR` -> `STRING`
     - `TEXT` -> `STRING`
@@ -93,10 +104,12 @@ Convert T-SQL code to Python code that runs on Databricks according to the follo
     - `UNIQUEIDENTIFIER` -> `STRING`
     - `SQL_VARIANT` -> `STRING`
     - `GEOGRAPHY` -> `STRING`
-    - `GEOMETRY` -> `STRING`
-17. Converting OBJECT_NAME(@@PROCID):
-    - Use the function name dynamically retrieved with `__name__`.
-"""
+    - `GEOMETRY` -> `STRING`""", trigger=r"\b(CREATE\s+TABLE|TABLE\s*\()"),
+    PromptSection("object_name", """Converting OBJECT_NAME(@@PROCID):
+    - Use the function name dynamically retrieved with `__name__`.""", trigger=r"\bOBJECT_NAME\s*\("),
+]
+
+_system_message = PromptBuilder.format_prompt(_system_message_header, _guideline_sections)
 
 # Example 1: Comprehensive Procedure with Error Handling, Rollback, Temporary Table, Object Name Handling, and Conditional SQL Statements
 ## Input
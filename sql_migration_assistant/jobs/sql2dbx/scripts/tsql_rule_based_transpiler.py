@@ -0,0 +1,298 @@
+"""
+This module converts trivially convertible T-SQL stored procedures to Python functions without an LLM.
+
+A procedure is converted only if it has simple parameters and its body consists of plain SELECT, INSERT, UPDATE and
+DELETE statements whose syntax and functions mean the same in Spark SQL. Anything else, such as variables, control
+flow, transactions, temporary tables or T-SQL specific functions, makes `transpile` return None, so that the file is
+converted by the LLM instead. The rules are deliberately conservative: a file that is not converted here loses nothing.
+
+The parameters are passed to `spark.sql` as named parameter markers (e.g. `:customer_id`) with `args`, so that their
+values are never pasted into the SQL text.
+"""
+import keyword
+import re
+import textwrap
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from .utils import to_snake_case
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<string>N?'(?:[^']|'')*')
+    |(?P<bracket>\[[^\]]*\])
+    |(?P<quoted>"[^"]*")
+    |(?P<variable>@@?\w+)
+    |(?P<temp>\#\w*)
+    |(?P<word>[A-Za-z_]\w*)
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<space>\s+)
+    |(?P<symbol><>|!=|<=|>=|\S)
+""", re.VERBOSE)
+
+HEADER_PATTERN = re.compile(
+    r"^CREATE\s+(?:OR\s+ALTER\s+)?PROC(?:EDURE)?\s+(?P<name>(?:\[[^\]]+\]|\w+)(?:\.(?:\[[^\]]+\]|\w+))*)"
+    r"(?P<params>.*?)\bAS\b(?P<body>.*)$",
+    re.IGNORECASE | re.DOTALL)
+PARAMETER_PATTERN = re.compile(
+    r"^@(?P<name>\w+)\s+(?P<type>\w+)(?:\s*\(\s*(?:\d+|MAX)\s*(?:,\s*\d+\s*)?\))?"
+    r"(?:\s*=\s*(?P<default>-?\d+(?:\.\d+)?|N?'[^']*'))?$",
+    re.IGNORECASE)
+# Script options generated around CREATE PROCEDURE by SQL Server Management Studio, which have no effect in Spark
+SESSION_OPTION_PATTERN = re.compile(
+    r"^\s*(GO|SET\s+(ANSI_NULLS|QUOTED_IDENTIFIER|NOCOUNT)\s+(ON|OFF)\s*;?)\s*$", re.IGNORECASE | re.MULTILINE)
+BODY_BLOCK_PATTERN = re.compile(r"^\s*BEGIN\b(?P<inner>.*)\bEND\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+
+NUMERIC_TYPES = {"INT", "BIGINT", "SMALLINT", "TINYINT", "BIT", "DECIMAL", "NUMERIC", "FLOAT", "REAL",
+                 "MONEY", "SMALLMONEY"}
+STRING_TYPES = {"CHAR", "VARCHAR", "NCHAR", "NVARCHAR", "DATE", "DATETIME", "DATETIME2", "SMALLDATETIME", "TIME"}
+# Words of the statements that are converted as they are
+CLAUSE_KEYWORDS = {"SELECT", "DISTINCT", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "EXISTS", "IS", "NULL", "LIKE",
+                   "BETWEEN", "AS", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "ON", "GROUP", "BY",
+                   "ORDER", "HAVING", "ASC", "DESC", "UNION", "ALL", "EXCEPT", "INTERSECT", "CASE", "WHEN", "THEN",
+                   "ELSE", "END", "INSERT", "INTO", "VALUES", "UPDATE", "SET", "DELETE"}
+# Functions that behave the same in T-SQL and Spark SQL
+ALLOWED_FUNCTIONS = {"COUNT", "SUM", "AVG", "MIN", "MAX", "ABS", "FLOOR", "CEILING", "SQRT", "POWER", "UPPER",
+                     "LOWER", "LTRIM", "RTRIM", "COALESCE", "NULLIF"}
+# Words that make a statement unsupported, such as control flow, T-SQL specific clauses and hints
+UNSUPPORTED_KEYWORDS = {"DECLARE", "IF", "WHILE", "BEGIN", "TRY", "CATCH", "TRAN", "TRANSACTION", "COMMIT", "ROLLBACK",
+                        "SAVE", "EXEC", "EXECUTE", "RETURN", "PRINT", "RAISERROR", "THROW", "CURSOR", "FETCH", "OPEN",
+                        "CLOSE", "DEALLOCATE", "GOTO", "WAITFOR", "OUTPUT", "TOP", "MERGE", "WITH", "NOLOCK",
+                        "OPTION", "CREATE", "ALTER", "DROP", "TRUNCATE", "IDENTITY", "OVER", "PIVOT", "UNPIVOT",
+                        "APPLY", "COLLATE", "OFFSET", "GO", "USE"}
+STATEMENT_KEYWORDS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+SET_OPERATORS = {"UNION", "ALL", "EXCEPT", "INTERSECT"}
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper()
+
+
+@dataclass
+class Parameter:
+    """Data class for storing a procedure parameter and the Python argument it is converted to."""
+    name: str
+    python_name: str
+    is_numeric: bool
+    default: Optional[str] = None
+
+
+class UnsupportedConstructError(Exception):
+    """Raised when a procedure contains a construct that the rules do not convert."""
+
+
+class TsqlRuleBasedTranspiler:
+    def __init__(self, comment_lang: str = "English"):
+        """
+        Initialize the TsqlRuleBasedTranspiler.
+
+        Args:
+            comment_lang (str): The language of the comment added to the converted functions, English or Japanese.
+        """
+        self.comment_lang = comment_lang
+
+    def transpile(self, sql_text: str) -> Optional[str]:
+        """
+        Converts a T-SQL stored procedure to a Python function with `spark.sql` calls.
+
+        Args:
+            sql_text (str): The procedure without SQL comments.
+
+        Returns:
+            Optional[str]: The Python function, or None if the procedure contains unsupported constructs.
+        """
+        try:
+            return self._transpile(sql_text)
+        except UnsupportedConstructError:
+            return None
+
+    def _transpile(self, sql_text: str) -> str:
+        match = HEADER_PATTERN.match(SESSION_OPTION_PATTERN.sub("", sql_text).strip())
+        if not match:
+            raise UnsupportedConstructError("Not a CREATE PROCEDURE statement")
+        function_name = self._to_python_name(re.split(r"\.(?![^\[]*\])", match.group("name"))[-1].strip("[]"))
+        parameters = self._parse_parameters(match.group("params"))
+        body = match.group("body")
+        block = BODY_BLOCK_PATTERN.match(body)
+        statements = self._split_statements(self._tokenize(block.group("inner") if block else body))
+        if not statements:
+            raise UnsupportedConstructError("Empty procedure")
+
+        lines = [f"def {function_name}({', '.join(self._format_argument(p) for p in parameters.values())}):",
+                 f"    # {self._get_comment()}"]
+        for i, statement in enumerate(statements):
+            self._validate_statement(statement, parameters)
+            is_result = statement[0].upper == "SELECT"
+            if is_result and i < len(statements) - 1:
+                # Only the result of the last statement can be returned, so the other result sets would be lost
+                raise UnsupportedConstructError("SELECT result before the last statement")
+            call = self._format_call(statement, parameters)
+            lines.append(("    return " if is_result else "    ") + call)
+        return "\n".join(lines) + "\n"
+
+    def _get_comment(self) -> str:
+        if self.comment_lang == "Japanese":
+            return "この関数は、LLMを使用せずにsql2dbxのルールベースのトランスパイラーで変換されました。"
+        return "This function was converted by the rule-based transpiler of sql2dbx without an LLM."
+
+    @staticmethod
+    def _to_python_name(name: str) -> str:
+        python_name = to_snake_case(name)
+        if not python_name.isidentifier() or keyword.iskeyword(python_name):
+            raise UnsupportedConstructError(f"Invalid Python name: {python_name}")
+        return python_name
+
+    def _parse_parameters(self, params_text: str) -> Dict[str, Parameter]:
+        """Parses the parameters, keyed by their upper case names without `@`."""
+        params_text = params_text.strip()
+        if params_text.startswith("(") and params_text.endswith(")"):
+            params_text = params_text[1:-1].strip()
+        parameters = {}
+        for param in re.split(r",(?![^(]*\))", params_text) if params_text else []:
+            match = PARAMETER_PATTERN.match(param.strip())
+            if not match:
+                raise UnsupportedConstructError(f"Unsupported parameter: {param}")
+            data_type = match.group("type").upper()
+            if data_type not in NUMERIC_TYPES | STRING_TYPES:
+                raise UnsupportedConstructError(f"Unsupported parameter type: {data_type}")
+            default = match.group("default")
+            if default is not None and data_type in STRING_TYPES:
+                default = repr(default.lstrip("Nn")[1:-1])
+            parameter = Parameter(match.group("name"), self._to_python_name(match.group("name")),
+                                  data_type in NUMERIC_TYPES, default)
+            if any(p.python_name == parameter.python_name for p in parameters.values()):
+                raise UnsupportedConstructError(f"Duplicated parameter name: {parameter.python_name}")
+            parameters[parameter.name.upper()] = parameter
+        # Python does not allow parameters without defaults after parameters with defaults
+        defaults = [p.default is not None for p in parameters.values()]
+        if defaults != sorted(defaults):
+            raise UnsupportedConstructError("Parameters without defaults follow parameters with defaults")
+        return parameters
+
+    @staticmethod
+    def _format_argument(parameter: Parameter) -> str:
+        return parameter.python_name if parameter.default is None else f"{parameter.python_name}={parameter.default}"
+
+    @staticmethod
+    def _tokenize(text: str) -> List[Token]:
+        return [Token(match.lastgroup, match.group()) for match in TOKEN_PATTERN.finditer(text)]
+
+    @staticmethod
+    def _split_statements(tokens: List[Token]) -> List[List[Token]]:
+        """
+        Splits the tokens into statements, at semicolons and at statement keywords outside parentheses, because
+        T-SQL statements do not need to end with semicolons. SELECT continues an INSERT without its query yet,
+        and a set operation such as UNION.
+        """
+        statements, current, depth = [], [], 0
+        for token in tokens:
+            words = [t.upper for t in current if t.kind == "word"]
+            starts_statement = (depth == 0 and token.kind == "word" and token.upper in STATEMENT_KEYWORDS and words
+                                and not (token.upper == "SELECT" and (words[-1] in SET_OPERATORS or (
+                                    words[0] == "INSERT" and "SELECT" not in words and "VALUES" not in words))))
+            if starts_statement or (depth == 0 and token.text == ";"):
+                statements.append(current)
+                current = []
+            if token.text != ";" or depth:
+                current.append(token)
+            depth += {"(": 1, ")": -1}.get(token.text, 0)
+            if depth < 0:
+                raise UnsupportedConstructError("Unbalanced parentheses")
+        statements.append(current)
+        statements = [TsqlRuleBasedTranspiler._strip(statement) for statement in statements]
+        return [statement for statement in statements if statement]
+
+    @staticmethod
+    def _strip(tokens: List[Token]) -> List[Token]:
+        start = next((i for i, t in enumerate(tokens) if t.kind != "space"), len(tokens))
+        end = next((i for i in range(len(tokens), 0, -1) if tokens[i - 1].kind != "space"), 0)
+        return tokens[start:end]
+
+    @staticmethod
+    def _validate_statement(statement: List[Token], parameters: Dict[str, Parameter]) -> None:
+        """Raises UnsupportedConstructError if the statement may not mean the same in Spark SQL."""
+        tokens = [t for t in statement if t.kind != "space"]
+        words = [t.upper for t in tokens if t.kind == "word"]
+        if tokens[0].upper not in STATEMENT_KEYWORDS:
+            raise UnsupportedConstructError(f"Unsupported statement: {tokens[0].text}")
+        for i, token in enumerate(tokens):
+            next_text = tokens[i + 1].text if i + 1 < len(tokens) else ""
+            if token.kind in ("quoted", "temp") or token.text in ("{", "}", "\\"):
+                raise UnsupportedConstructError(f"Unsupported token: {token.text}")
+            if token.kind == "variable" and token.upper[1:] not in parameters:
+                raise UnsupportedConstructError(f"Unsupported variable: {token.text}")
+            if token.kind == "string" and re.search(r"\\|\"|''|[{}]", token.text.lstrip("Nn")[1:-1]):
+                raise UnsupportedConstructError(f"Unsupported string literal: {token.text}")
+            if token.text in ("+", "/"):
+                TsqlRuleBasedTranspiler._validate_arithmetic(tokens, i, parameters)
+            if token.kind == "word" and next_text == "(" and token.upper not in CLAUSE_KEYWORDS | ALLOWED_FUNCTIONS:
+                # The column list of INSERT INTO table (...)
+                if not (i >= 2 and tokens[i - 1].upper == "INTO" and tokens[i - 2].upper == "INSERT"):
+                    raise UnsupportedConstructError(f"Unsupported function: {token.text}")
+            elif token.kind == "word" and token.upper in UNSUPPORTED_KEYWORDS:
+                raise UnsupportedConstructError(f"Unsupported keyword: {token.text}")
+
+        kind = tokens[0].upper
+        if kind == "SELECT" and "INTO" in words:
+            raise UnsupportedConstructError("SELECT INTO")
+        if kind == "INSERT" and (len(words) < 2 or words[1] != "INTO" or words.count("INTO") > 1):
+            raise UnsupportedConstructError("INSERT without INTO")
+        if kind in ("UPDATE", "DELETE"):
+            # Spark SQL does not support UPDATE ... FROM and DELETE with joins, and subqueries only partly
+            if "SELECT" in words or words.count("FROM") > (1 if kind == "DELETE" else 0) or "JOIN" in words:
+                raise UnsupportedConstructError(f"{kind} with FROM, JOIN or a subquery")
+            if kind == "DELETE" and words[1:2] != ["FROM"]:
+                raise UnsupportedConstructError("DELETE without FROM")
+        if kind != "UPDATE" and "SET" in words:
+            raise UnsupportedConstructError("SET outside UPDATE")
+
+    @staticmethod
+    def _validate_arithmetic(tokens: List[Token], index: int, parameters: Dict[str, Parameter]) -> None:
+        """
+        Raises UnsupportedConstructError unless both operands of the `+` or `/` at the index are numeric literals or
+        numeric parameters. `+` concatenates strings in T-SQL but adds numbers in Spark SQL, and `/` of integers
+        truncates in T-SQL but not in Spark SQL, so `/` also needs a decimal literal operand (e.g. `@Total / 100.0`).
+        """
+        operands = [tokens[j] for j in (index - 1, index + 1) if 0 <= j < len(tokens)]
+
+        def is_numeric(token: Token) -> bool:
+            return token.kind == "number" or (token.kind == "variable" and parameters[token.upper[1:]].is_numeric)
+
+        operator = tokens[index].text
+        if len(operands) < 2 or not all(is_numeric(operand) for operand in operands):
+            raise UnsupportedConstructError(f"{operator} with operands that are not numeric literals or parameters")
+        if operator == "/" and not any(operand.kind == "number" and "." in operand.text for operand in operands):
+            raise UnsupportedConstructError("Integer division")
+
+    @staticmethod
+    def _format_call(statement: List[Token], parameters: Dict[str, Parameter]) -> str:
+        """Formats the statement as a `spark.sql` call, with the parameters as named parameter markers."""
+        parts = []
+        argument_names = []
+        for token in statement:
+            if token.kind == "bracket":
+                parts.append(f"`{token.text[1:-1]}`")
+            elif token.kind == "string" and token.text[0] in "Nn":
+                parts.append(token.text[1:])
+            elif token.kind == "variable":
+                python_name = parameters[token.upper[1:]].python_name
+                parts.append(f":{python_name}")
+                if python_name not in argument_names:
+                    argument_names.append(python_name)
+            else:
+                parts.append(token.text)
+        sql = "".join(parts)
+        args = ""
+        if argument_names:
+            args = ", args={" + ", ".join(f'"{name}": {name}' for name in argument_names) + "}"
+        if "\n" not in sql:
+            return f'spark.sql("{sql}"{args})'
+        first_line, rest = sql.split("\n", 1)
+        sql = textwrap.indent(first_line.strip() + "\n" + textwrap.dedent(rest), " " * 8)
+        return f'spark.sql("""\n{sql}\n    """{args})'
+
@@ -1,22 +1,145 @@
+import base64
+import codecs
+import fnmatch
 import logging
 import os
+import posixpath
 import re
 import sys
-from typing import Optional, Tuple
+import tarfile
+import threading
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import chardet
 import tiktoken
+import tiktoken.load
+
+# Model names that can be used in place of a tiktoken encoding name
+MODEL_TOKEN_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "gpt-4o-mini": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-4-turbo": "cl100k_base",
+    "gpt-3.5-turbo": "cl100k_base",
+    "databricks-dbrx-instruct": "cl100k_base",
+}
+
+# The pre-tokenization pattern of cl100k_base, which is also used by other BPE tokenizers such as Llama 3
+CL100K_PAT_STR = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+
+_tokenizers: Dict[str, tiktoken.Encoding] = {}
+_tokenizer_files: Dict[str, Tuple[str, str, Dict[str, int]]] = {}
+_tokenizer_lock = threading.Lock()
+
+
+def set_tokenizer_cache_dir(cache_dir: Optional[str]) -> None:
+    """
+    Sets the directory where BPE files are looked up before they are downloaded, e.g. a Unity Catalog Volume.
+
+    The directory uses tiktoken's cache layout. Loading a tokenizer once on a cluster with internet access
+    with the same directory populates it for air-gapped clusters. Does nothing if cache_dir is empty.
+    """
+    if cache_dir:
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+
+def register_tokenizer_file(name: str, bpe_file: str, pat_str: str = CL100K_PAT_STR,
+                            special_tokens: Optional[Dict[str, int]] = None) -> None:
+    """
+    Registers a tokenizer loaded from a tiktoken BPE file, for models without a built-in tiktoken encoding.
+
+    Args:
+        name (str): The name used with get_tokenizer and TokenCounter.
+        bpe_file (str): The local path or URL of the BPE file in tiktoken format (e.g. Llama 3's tokenizer.model).
+        pat_str (str): The pre-tokenization regex pattern of the tokenizer.
+        special_tokens (Optional[Dict[str, int]]): The special tokens of the tokenizer.
+    """
+    with _tokenizer_lock:
+        _tokenizer_files[name] = (bpe_file, pat_str, special_tokens or {})
+        _tokenizers.pop(name, None)
+
+
+def get_tokenizer(name: str) -> tiktoken.Encoding:
+    """
+    Returns the tokenizer for a tiktoken encoding, model name or registered tokenizer file.
+
+    Tokenizers are loaded on first use and shared by all callers in the process. The BPE files of tiktoken
+    encodings are downloaded unless they are found in the directory set with set_tokenizer_cache_dir. On clusters
+    without internet access, set that directory or register a local BPE file with register_tokenizer_file.
+
+    Args:
+        name (str): A tiktoken encoding name (e.g. `o200k_base`), a model name (e.g. `gpt-4o`), or a name
+            registered with register_tokenizer_file.
+
+    Returns:
+        tiktoken.Encoding: The tokenizer.
+
+    Raises:
+        ValueError: If the name is not known.
+    """
+    name = MODEL_TOKEN_ENCODINGS.get(name, name)
+    tokenizer = _tokenizers.get(name)
+    if tokenizer is not None:
+        return tokenizer
+
+    with _tokenizer_lock:
+        if name not in _tokenizers:
+            _tokenizers[name] = _load_tokenizer(name)
+        return _tokenizers[name]
+
+
+def _load_tokenizer(name: str) -> tiktoken.Encoding:
+    """Loads a tokenizer without caching it."""
+    if name in _tokenizer_files:
+        bpe_file, pat_str, special_tokens = _tokenizer_files[name]
+        return tiktoken.Encoding(name=name, pat_str=pat_str, special_tokens=special_tokens,
+                                 mergeable_ranks=_load_bpe_file(bpe_file))
+    if name in tiktoken.list_encoding_names():
+        return tiktoken.get_encoding(name)
+    try:
+        return tiktoken.encoding_for_model(name)
+    except KeyError:
+        raise ValueError(f"Unknown tokenizer: {name}. Use a tiktoken encoding ({', '.join(tiktoken.list_encoding_names())}), "
+                         f"a model name, or register a BPE file with register_tokenizer_file.") from None
+
+
+def _load_bpe_file(bpe_file: str) -> Dict[bytes, int]:
+    """Loads mergeable ranks from a local BPE file, or from a URL through tiktoken's download cache."""
+    if not os.path.isfile(bpe_file):
+        return tiktoken.load.load_tiktoken_bpe(bpe_file)
+    # tiktoken reads local files through the optional blobfile package, so parse the file here
+    with open(bpe_file, 'rb') as file:
+        return {base64.b64decode(token): int(rank)
+                for token, rank in (line.split() for line in file.read().splitlines() if line)}
 
 
 class TokenCounter:
     def __init__(self, token_encoding_name: str = "cl100k_base"):
-        """Initialize the TokenCounter with a specified token encoding."""
-        self.encoding = tiktoken.get_encoding(token_encoding_name)
+        """Initialize the TokenCounter with a specified token encoding, model name or registered tokenizer."""
+        self.encoding = get_tokenizer(token_encoding_name)
 
     def count_tokens(self, string: str) -> int:
         """Returns the number of tokens in a text string."""
         return len(self.encoding.encode(string))
 
+    def count_tokens_batch(self, strings: List[str], num_threads: int = 8) -> List[int]:
+        """
+        Returns the number of tokens in each of the text strings.
+
+        The strings are encoded by tiktoken's batch API in a thread pool. tiktoken releases the GIL
+        while encoding, so the threads run in parallel.
+
+        Args:
+            strings (List[str]): The text strings to count.
+            num_threads (int): The number of threads used for encoding.
+
+        Returns:
+            List[int]: The token counts, in the same order as the strings.
+        """
+        return [len(tokens) for tokens in self.encoding.encode_batch(strings, num_threads=num_threads)]
+
 
 def setup_logger(name, level=logging.INFO):
     """Function to setup a logger that outputs to stdout"""
@@ -31,59 +154,395 @@ def setup_logger(name, level=logging.INFO):
     return logger
 
 
-def list_files_recursively(input_dir: str) -> list[str]:
+@dataclass
+class FileFilter:
+    """
+    Selects input files by their path relative to the input directory or archive, with '/' as the separator.
+
+    Glob patterns are matched with fnmatch against the whole relative path, so `*` also matches '/'
+    (e.g. `*.sql` matches `procs/a.sql`). A directory whose relative path followed by '/' matches an
+    exclude pattern (e.g. `backup/*`) is not scanned at all.
+
+    Attributes:
+        include_patterns (List[str]): A file must match one of these patterns. Empty includes all files.
+        exclude_patterns (List[str]): A file must match none of these patterns.
+        extensions (List[str]): A file must have one of these extensions, case-insensitively (e.g. `.sql`). Empty allows all.
+        max_depth (Optional[int]): The maximum number of directory levels below the input directory.
+            0 selects only the files directly in it. None has no limit.
+    """
+    include_patterns: List[str] = field(default_factory=list)
+    exclude_patterns: List[str] = field(default_factory=list)
+    extensions: List[str] = field(default_factory=list)
+    max_depth: Optional[int] = None
+
+    def matches(self, relative_path: str) -> bool:
+        """Returns True if a file with the relative path is selected."""
+        if self.max_depth is not None and relative_path.count('/') > self.max_depth:
+            return False
+        if self.extensions and not relative_path.lower().endswith(tuple(ext.lower() for ext in self.extensions)):
+            return False
+        if self.include_patterns and not any(fnmatch.fnmatch(relative_path, p) for p in self.include_patterns):
+            return False
+        return not any(fnmatch.fnmatch(relative_path, p) for p in self.exclude_patterns)
+
+    def allows_directory(self, relative_dir: str) -> bool:
+        """Returns True if files may be selected below a directory with the relative path."""
+        if self.max_depth is not None and relative_dir.count('/') >= self.max_depth:
+            return False
+        return not any(fnmatch.fnmatch(relative_dir + '/', p) for p in self.exclude_patterns)
+
+
+def iter_files(input_dir: str, file_filter: Optional[FileFilter] = None) -> Iterator[str]:
+    """
+    Lazily yields the paths of the files in a directory tree, in a deterministic order.
+
+    Directories are scanned with os.scandir, and the file types cached in the directory entries are
+    used instead of one stat call per file. As with os.walk, the files of a directory are yielded before
+    its subdirectories are scanned, and symbolic links to directories are not followed. Entries are
+    visited in name order, and excluded subdirectories are not scanned.
+
+    Args:
+        input_dir (str): The directory to search for files.
+        file_filter (Optional[FileFilter]): Selects the files to yield. If None, all files are yielded.
+
+    Yields:
+        str: The file paths.
+    """
+    file_filter = file_filter or FileFilter()
+    stack = [(input_dir, "")]
+    while stack:
+        directory, relative_dir = stack.pop()
+        try:
+            with os.scandir(directory) as scanned:
+                entries = sorted(scanned, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        children = []
+        for entry in entries:
+            relative_path = f"{relative_dir}{entry.name}"
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if file_filter.allows_directory(relative_path):
+                        children.append((entry.path, relative_path + '/'))
+                elif entry.is_file() and file_filter.matches(relative_path):
+                    yield entry.path
+            except OSError:
+                continue
+        stack.extend(reversed(children))
+
+
+def list_files_recursively(input_dir: str, file_filter: Optional[FileFilter] = None) -> list[str]:
     """
     Recursively list all files in the specified directory.
 
     Args:
         input_dir (str): The directory to search for files.
+        file_filter (Optional[FileFilter]): Selects the files to list. If None, all files are listed.
 
     Returns:
-        list[str]: A list of file paths.
+        list[str]: A list of file paths, in the order of iter_files.
+    """
+    return list(iter_files(input_dir, file_filter))
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(path: str) -> bool:
+    """Returns True if the path is a zip or tar archive file that can be read with iter_archive_members."""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def iter_archive_members(archive_path: str, file_filter: Optional[FileFilter] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yields the path and content of each regular file in a zip or tar archive without extracting it to disk.
+
+    Only one member is held in memory at a time. Tar archives, including compressed ones, are read as a
+    stream from start to end.
+
+    Args:
+        archive_path (str): The path of the archive.
+        file_filter (Optional[FileFilter]): Selects the members to read by their path within the archive.
+
+    Yields:
+        Tuple[str, bytes]: The path of the member within the archive and its content.
+    """
+    file_filter = file_filter or FileFilter()
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                path = posixpath.normpath(info.filename)
+                if not info.is_dir() and file_filter.matches(path):
+                    with archive.open(info) as member:
+                        yield path, member.read()
+    else:
+        with tarfile.open(archive_path, mode='r|*') as archive:
+            for member in archive:
+                path = posixpath.normpath(member.name)
+                if member.isfile() and file_filter.matches(path):
+                    yield path, archive.extractfile(member).read()
+
+
+@dataclass
+class EncodingDetectionResult:
+    """Data class for storing the result of an encoding detection."""
+    encoding: str
+    confidence: float
+    method: str  # One of "specified", "bom", "utf-8", "cache", "chardet" or "fallback"
+
+
+class EncodingDetector:
     """
-    all_files = []
-    for root, _, files in os.walk(input_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if os.path.isfile(file_path):
-                all_files.append(file_path)
-    return all_files
+    Detects file encodings in tiers, from the cheapest check to the most expensive one:
+
+    1. Byte order mark (BOM) sniffing.
+    2. Strict UTF-8 (and ASCII) validation, which covers most SQL files.
+    3. The encoding last detected in the same directory, if the content decodes strictly with it.
+    4. chardet's incremental detector, fed with at most `sample_size` bytes from the first non-ASCII byte of the
+       content. If its answer does not decode the whole content strictly, chardet is fed the whole content.
+    """
+    BOMS = [
+        (codecs.BOM_UTF32_LE, 'utf-32'),  # Must be checked before UTF-16 LE, whose BOM is its prefix
+        (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'),
+    ]
+
+    def __init__(self, sample_size: int = 64 * 1024, min_cache_confidence: float = 0.8):
+        """
+        Initialize the EncodingDetector.
+
+        Args:
+            sample_size (int): The maximum number of bytes passed to chardet before it is fed the whole content.
+            min_cache_confidence (float): The minimum chardet confidence for an encoding to be cached for its directory.
+        """
+        self.sample_size = sample_size
+        self.min_cache_confidence = min_cache_confidence
+        self._directory_cache: Dict[str, EncodingDetectionResult] = {}
+
+    def detect(self, raw_data: bytes, file_path: Optional[str] = None) -> EncodingDetectionResult:
+        """
+        Detects the encoding of the raw content of a file.
+
+        Args:
+            raw_data (bytes): The raw content of the file.
+            file_path (Optional[str]): The path of the file, used for the per-directory cache.
+
+        Returns:
+            EncodingDetectionResult: The detected encoding, its confidence and the tier that detected it.
+        """
+        for bom, encoding in self.BOMS:
+            if raw_data.startswith(bom):
+                return EncodingDetectionResult(encoding, 1.0, "bom")
+
+        if raw_data.isascii():
+            return EncodingDetectionResult('ascii', 1.0, "utf-8")
+        if _decodes_strictly(raw_data, 'utf-8'):
+            return EncodingDetectionResult('utf-8', 1.0, "utf-8")
 
+        directory = os.path.dirname(file_path) if file_path else None
+        cached = self._directory_cache.get(directory) if directory is not None else None
+        if cached and _decodes_strictly(raw_data, cached.encoding):
+            return EncodingDetectionResult(cached.encoding, cached.confidence, "cache")
 
-def get_file_content(input_file_path: str, encoding: Optional[str] = None) -> Tuple[str, str]:
+        # The ASCII head of the content tells chardet nothing but "ascii", so the sample starts where it differs
+        first_non_ascii = _NON_ASCII_BYTE.search(raw_data).start()
+        result = self._detect_with_chardet(raw_data[first_non_ascii:first_non_ascii + self.sample_size])
+        if not self._is_valid_detection(raw_data, result['encoding']):
+            result = self._detect_with_chardet(raw_data)
+        if not result['encoding'] or result['encoding'].lower() == 'ascii':
+            return EncodingDetectionResult('utf-8', 0.0, "fallback")  # Use 'utf-8' if encoding detection fails
+
+        detection = EncodingDetectionResult(result['encoding'], result['confidence'], "chardet")
+        if directory is not None and detection.confidence >= self.min_cache_confidence:
+            self._directory_cache[directory] = detection
+        return detection
+
+    @staticmethod
+    def _is_valid_detection(raw_data: bytes, encoding: Optional[str]) -> bool:
+        """Returns True if a chardet answer is not ASCII and decodes the whole non-ASCII content strictly."""
+        return bool(encoding) and encoding.lower() != 'ascii' and _decodes_strictly(raw_data, encoding)
+
+    @staticmethod
+    def _detect_with_chardet(raw_data: bytes, chunk_size: int = 4096) -> dict:
+        """Feeds the data to chardet until it is confident or all of it has been read."""
+        detector = chardet.UniversalDetector()
+        for start in range(0, len(raw_data), chunk_size):
+            detector.feed(raw_data[start:start + chunk_size])
+            if detector.done:
+                break
+        return detector.close()
+
+
+_NON_ASCII_BYTE = re.compile(rb"[\x80-\xff]")
+
+
+def _decodes_strictly(raw_data: bytes, encoding: str) -> bool:
+    """Returns True if the raw data decodes without errors with the given encoding."""
+    try:
+        raw_data.decode(encoding)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def get_file_content(input_file_path: str, encoding: Optional[str] = None,
+                     detector: Optional[EncodingDetector] = None) -> Tuple[str, str]:
     """
     Returns the content of a specified file as a string along with its encoding.
 
     Args:
         input_file_path (str): The path of the file to read.
-        encoding (Optional[str]): The encoding to use for reading the file. If not specified, chardet.detect is used.
+        encoding (Optional[str]): The encoding to use for reading the file. If not specified, the encoding is detected.
+        detector (Optional[EncodingDetector]): The detector to use. Pass a shared instance to reuse its per-directory cache.
 
     Returns:
         Tuple[str, str]: A tuple containing the file content and its encoding.
     """
     with open(input_file_path, 'rb') as file:
         raw_data = file.read()
-        if encoding is None:
-            result = chardet.detect(raw_data)
-            encoding = result['encoding'] or 'utf-8'  # Use 'utf-8' if encoding detection fails
-        content = raw_data.decode(encoding, errors='replace')
-    return content, encoding
+    content, detection = decode_file_content(raw_data, encoding=encoding, detector=detector,
+                                             file_path=input_file_path)
+    return content, detection.encoding
+
+
+def decode_file_content(raw_data: bytes, encoding: Optional[str] = None, detector: Optional[EncodingDetector] = None,
+                        file_path: Optional[str] = None) -> Tuple[str, EncodingDetectionResult]:
+    """
+    Decodes the raw bytes of a file into a string along with the encoding detection result.
+
+    Args:
+        raw_data (bytes): The raw content of the file.
+        encoding (Optional[str]): The encoding to use for decoding. If not specified, the encoding is detected.
+        detector (Optional[EncodingDetector]): The detector to use. A new one is created if not specified.
+        file_path (Optional[str]): The path of the file, used for the detector's per-directory cache.
+
+    Returns:
+        Tuple[str, EncodingDetectionResult]: A tuple containing the decoded content and the detection result.
+    """
+    if encoding is None:
+        detection = (detector or EncodingDetector()).detect(raw_data, file_path=file_path)
+    else:
+        detection = EncodingDetectionResult(encoding, 1.0, "specified")
+    content = raw_data.decode(detection.encoding, errors='replace')
+    return content, detection
+
+
+_SQL_LEXER_START = re.compile(r"'|\"|\[|--|/\*")
+_SQL_LITERAL_REST = {
+    "'": re.compile(r"[^']*(?:''[^']*)*'"),
+    '"': re.compile(r'[^"]*(?:""[^"]*)*"'),
+    "[": re.compile(r"[^\]]*(?:\]\][^\]]*)*\]"),
+}
+_SQL_BLOCK_COMMENT_DELIMITER = re.compile(r"/\*|\*/")
+_WHITESPACE = re.compile(r"\s+")
+_MULTIPLE_EMPTY_LINES = re.compile(r"\n\s*\n")
 
 
-def remove_sql_comments(sql_text: str) -> str:
+def remove_sql_comments(sql_text: str, normalize_whitespace: bool = False) -> str:
     """
-    Removes both line and block comments from SQL text.
+    Removes both line and block comments from SQL text in a single left-to-right pass.
+
+    Block comments may be nested. String literals, quoted identifiers and bracketed identifiers are
+    copied as they are, so comment markers inside them (e.g. `'--'` or `[a/*b]`) are kept.
+    Unterminated literals and block comments extend to the end of the text.
 
     Args:
         sql_text (str): The SQL text to clean.
+        normalize_whitespace (bool): If True, every run of whitespace and comments outside literals is
+            collapsed into a single space while scanning. If False, multiple empty lines are collapsed
+            into one empty line.
 
     Returns:
         str: The SQL text without comments.
     """
-    no_line_comments = re.sub(r'--.*', '', sql_text)
-    no_comments = re.sub(r'/\*.*?\*/', '', no_line_comments, flags=re.DOTALL)
-    no_comments = re.sub(r'\n\s*\n', '\n\n', no_comments)  # Remove multiple empty lines
-    return no_comments
+    pieces = []
+    code = []  # Code between literals, normalized as a whole when a literal or the end is reached
+    separator = " " if normalize_whitespace else ""
+
+    def flush_code() -> None:
+        text = "".join(code)
+        pieces.append(_WHITESPACE.sub(" ", text) if normalize_whitespace else text)
+        code.clear()
+
+    pos = 0
+    length = len(sql_text)
+    while pos < length:
+        match = _SQL_LEXER_START.search(sql_text, pos)
+        if match is None:
+            code.append(sql_text[pos:])
+            break
+        start, token = match.start(), match.group()
+        code.append(sql_text[pos:start])
+
+        if token == "--":
+            end = sql_text.find("\n", start)
+            end = length if end == -1 else end
+            code.append(separator)
+        elif token == "/*":
+            depth, end = 1, length
+            for delimiter in _SQL_BLOCK_COMMENT_DELIMITER.finditer(sql_text, start + 2):
+                depth += 1 if delimiter.group() == "/*" else -1
+                if depth == 0:
+                    end = delimiter.end()
+                    break
+            code.append(separator)
+        else:
+            literal = _SQL_LITERAL_REST[token].match(sql_text, start + 1)
+            end = literal.end() if literal else length
+            flush_code()
+            pieces.append(sql_text[start:end])
+        pos = end
+    flush_code()
+
+    result = "".join(pieces)
+    if not normalize_whitespace:
+        result = _MULTIPLE_EMPTY_LINES.sub("\n\n", result)  # Remove multiple empty lines
+    return result
+
+
+def parse_comma_separated(input_string: str) -> list[str]:
+    """Parses a comma-separated string into a list of stripped, non-empty values (e.g., "*.sql, *.ddl").
+
+    Args:
+        input_string: The string containing comma-separated values.
+
+    Returns:
+        A list containing all values found in input_string.
+    """
+    return [part.strip() for part in (input_string or '').split(',') if part.strip()]
+
+
+def to_snake_case(name: str) -> str:
+    """Converts a T-SQL style name to snake case (e.g., "OrderID" to "order_id", "usp_GetOrders" to "usp_get_orders").
+
+    Args:
+        name: The name in camel case or Pascal case, possibly with underscores.
+
+    Returns:
+        The name in lower snake case.
+    """
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "_", name).lower()
+
+
+def add_missing_columns(spark, table: str, columns: List[Tuple[str, str]]) -> List[str]:
+    """Adds the columns that the table does not have yet, e.g. to result tables created by an older version.
+
+    Args:
+        spark: The Spark session.
+        table: The name of the Delta table.
+        columns: The names and SQL data types (e.g., "array<string>") of the columns the table should have.
+
+    Returns:
+        The names of the added columns.
+    """
+    existing_columns = set(spark.table(table).columns)
+    missing_columns = [(name, data_type) for name, data_type in columns if name not in existing_columns]
+    if missing_columns:
+        column_definitions = ", ".join(f"{name} {data_type}" for name, data_type in missing_columns)
+        spark.sql(f"ALTER TABLE {table} ADD COLUMNS ({column_definitions})")
+    return [name for name, _ in missing_columns]
 
 
 def parse_number_ranges(input_string: str) -> list[int]:
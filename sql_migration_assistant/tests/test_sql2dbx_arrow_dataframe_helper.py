@@ -0,0 +1,38 @@
+import unittest
+from datetime import datetime
+
+import pyarrow as pa
+
+from jobs.sql2dbx.scripts.arrow_dataframe_helper import rows_to_arrow_table
+
+SCHEMA = pa.schema([
+    ("input_file_number", pa.int32()),
+    ("result_sql_parse_errors", pa.list_(pa.string())),
+    ("result_timestamp", pa.timestamp("us")),
+])
+
+
+class TestRowsToArrowTable(unittest.TestCase):
+    """
+    Unit test class for testing the conversion of Python rows to pyarrow tables.
+    """
+
+    def test_converts_rows_with_nulls_and_lists(self):
+        """Tests that rows are converted column by column with the schema types, keeping nulls."""
+        timestamp = datetime(2024, 1, 1, 12, 0)
+        table = rows_to_arrow_table([(1, ["Error in query 0"], timestamp), (2, [], None)], SCHEMA)
+        self.assertEqual(table.schema, SCHEMA)
+        self.assertEqual(table.to_pylist(), [
+            {"input_file_number": 1, "result_sql_parse_errors": ["Error in query 0"], "result_timestamp": timestamp},
+            {"input_file_number": 2, "result_sql_parse_errors": [], "result_timestamp": None},
+        ])
+
+    def test_empty_rows(self):
+        """Tests that no rows result in an empty table with the schema."""
+        table = rows_to_arrow_table(iter([]), SCHEMA)
+        self.assertEqual(table.schema, SCHEMA)
+        self.assertEqual(table.num_rows, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import re
+import unittest
+
+from jobs.sql2dbx.scripts.autofix_rules_helper import (AutoFixEngine,
+                                                       split_string_literal)
+
+
+def parse_sql(sql):
+    """A stand-in for the Spark SQL parser that fails on the error classes of the rules."""
+    if re.search(r"[#@]|^\s*(BEGIN|COMMIT|ROLLBACK)\b|^\s*UPDATE\b.*\bFROM\b", sql, re.IGNORECASE | re.DOTALL):
+        raise ValueError("[PARSE_SYNTAX_ERROR] Syntax error")
+
+
+class TestAutoFixEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = AutoFixEngine(parse_sql)
+
+    def test_fixes_combined_errors(self):
+        content = '''```python
+def usp_update(order_id, new_status):
+    spark.sql("BEGIN TRANSACTION")
+    spark.sql("INSERT INTO #TempOrders SELECT * FROM Orders WHERE OrderID = @OrderID")
+    query = f"""
+        UPDATE o
+        SET o.Status = '{new_status}'
+        FROM Orders o
+        INNER JOIN #TempOrders t ON o.OrderID = t.OrderID
+        WHERE o.IsPriority = 1
+    """
+    spark.sql(query)
+    spark.sql("COMMIT")
+```'''
+        result = self.engine.fix(content)
+
+        self.assertFalse(result.syntax_check.has_errors)
+        self.assertEqual(result.applied_rules[0], "markdown_fences")
+        self.assertEqual(set(result.applied_rules),
+                         {"markdown_fences", "transaction_control", "temp_table_prefix", "variable_prefix", "update_from"})
+        self.assertNotIn("```", result.content)
+        self.assertIn('spark.sql(f"INSERT INTO TempOrders SELECT * FROM Orders WHERE OrderID = {order_id}")',
+                      result.content)
+        self.assertIn('''
+        MERGE INTO Orders o
+        USING TempOrders t
+        ON o.OrderID = t.OrderID
+        WHEN MATCHED AND (o.IsPriority = 1) THEN UPDATE SET o.Status = '{new_status}'
+    """''', result.content)
+        self.assertEqual(result.content.count("    pass  # Transaction control"), 2)
+
+    def test_update_from_with_where_join(self):
+        content = 'def run():\n    spark.sql("UPDATE Orders SET Status = c.Status FROM Customers c WHERE Orders.Id = c.Id")\n'
+        result = self.engine.fix(content)
+
+        self.assertEqual(result.applied_rules, ["update_from"])
+        self.assertIn('"MERGE INTO Orders USING Customers c ON Orders.Id = c.Id '
+                      'WHEN MATCHED THEN UPDATE SET Status = c.Status"', result.content)
+
+    def test_keeps_original_without_improvement(self):
+        content = ('def run():\n'
+                   '    spark.sql("SELECT * FROM t WHERE id = @UnknownId")\n'
+                   '    x = 1; spark.sql("COMMIT")\n'
+                   '    spark.sql("UPDATE t SET a = s.a FROM t LEFT JOIN s ON t.id = s.id")\n')
+        result = self.engine.fix(content)
+
+        self.assertEqual(result.content, content)
+        self.assertEqual(result.applied_rules, [])
+        self.assertEqual(len(result.syntax_check.sql_parse_errors), 3)
+
+    def test_rollback_is_not_removed(self):
+        content = ('def run():\n'
+                   '    try:\n'
+                   '        spark.sql("BEGIN TRANSACTION")\n'
+                   '        spark.sql("DELETE FROM t")\n'
+                   '    except Exception:\n'
+                   '        spark.sql("ROLLBACK TRANSACTION")\n'
+                   '        raise\n')
+        result = self.engine.fix(content)
+
+        self.assertEqual(result.applied_rules, ["transaction_control"])
+        self.assertIn('        pass  # Transaction control', result.content)
+        self.assertIn('        spark.sql("ROLLBACK TRANSACTION")\n', result.content)
+        self.assertEqual(len(result.syntax_check.sql_parse_errors), 1)
+
+    def test_braces_are_escaped_in_new_f_strings(self):
+        content = 'def run(id):\n    spark.sql("SELECT named_struct(\'a\', 1) AS s, \'{x}\' AS b FROM t WHERE id = @id")\n'
+        result = self.engine.fix(content)
+
+        self.assertEqual(result.applied_rules, ["variable_prefix"])
+        self.assertIn('spark.sql(f"SELECT named_struct(\'a\', 1) AS s, \'{{x}}\' AS b FROM t WHERE id = {id}")',
+                      result.content)
+
+    def test_rejects_unknown_rules(self):
+        with self.assertRaises(ValueError):
+            AutoFixEngine(parse_sql, rules=["unknown"])
+
+
+class TestSplitStringLiteral(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(split_string_literal('f"""a\nb"""'), ("f", '"""', "a\nb"))
+        self.assertEqual(split_string_literal(r"'it\'s'"), ("", "'", r"it\'s"))
+        self.assertIsNone(split_string_literal('"a" "b"'))
+        self.assertIsNone(split_string_literal('b"a"'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+
+from jobs.sql2dbx.scripts import batch_inference_helper
+from jobs.sql2dbx.scripts.batch_inference_helper import (
+    AsyncChatClient, BatchInferenceManager, BatchInferenceRequest,
+    BatchInferenceResponse)
+
+
+def handle_chat_request(request):
+    """Answers each chat request with its user message in upper case, split into two parts by max_tokens."""
+    payload = json.loads(request.content)
+    messages = payload["messages"]
+    if messages[-1]["content"] == "Please continue.":
+        content, finish_reason = messages[-3]["content"].upper()[5:], "stop"
+    else:
+        content, finish_reason = messages[-1]["content"].upper()[:5], "length"
+    return httpx.Response(200, json={
+        "choices": [{"message": {"content": content}, "finish_reason": finish_reason}],
+        "usage": {"total_tokens": 10},
+    })
+
+
+class TestAsyncChatClientRecording(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.record_file = os.path.join(self.temp_dir.name, "traffic.jsonl.gz")
+        self.requests = [BatchInferenceRequest(index=i, text=text, system_message="Convert")
+                         for i, text in enumerate(["select 1", "select 22"])]
+        credentials = SimpleNamespace(host="https://example.com", token="token")
+        patcher = mock.patch.object(batch_inference_helper, "get_databricks_host_creds", return_value=credentials)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_client(self, **kwargs):
+        client = AsyncChatClient(endpoint_name="endpoint", request_params={"max_tokens": 5}, **kwargs)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handle_chat_request))
+        return client
+
+    def record(self, close=True):
+        async def run():
+            client = self.create_client(record_file=self.record_file)
+            results = [await client.predict(request) for request in self.requests]
+            if close:
+                await client.close()
+            return results
+        return asyncio.run(run())
+
+    def test_record_and_replay(self):
+        recorded = self.record()
+        self.assertEqual(recorded, [("SELECT 1", 20), ("SELECT 22", 20)])
+
+        async def replay():
+            client = self.create_client(replay_file=self.record_file)
+            client.client = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: self.fail("The endpoint must not be called in replay mode")))
+            # Replayed out of the recorded order, as requests finish in any order in a batch
+            results = [await client.predict(request) for request in reversed(self.requests)]
+            await client.close()
+            return results
+
+        self.assertEqual(asyncio.run(replay()), list(reversed(recorded)))
+
+    def test_unwritable_record_file_does_not_fail_requests(self):
+        record_file = os.path.join(self.temp_dir.name, "missing_directory", "traffic.jsonl.gz")
+
+        client = self.create_client(record_file=record_file)
+        self.addCleanup(os.remove, client._record_temp_file)
+
+        async def run():
+            results = [await client.predict(request) for request in self.requests]
+            await client.close()
+            return results
+
+        with self.assertLogs("AsyncChatClient", level="ERROR"):
+            self.assertEqual(asyncio.run(run()), [("SELECT 1", 20), ("SELECT 22", 20)])
+
+        # The recording is kept in the temporary file, two requests each with a continuation
+        with gzip.open(client._record_temp_file, "rt", encoding="utf-8") as file:
+            exchanges = [json.loads(line) for line in file]
+        self.assertEqual(len(exchanges), 4)
+        self.assertEqual(exchanges[0]["response"]["choices"][0]["message"]["content"], "SELEC")
+
+    def test_replay_miss(self):
+        self.record()
+
+        async def replay():
+            client = self.create_client(replay_file=self.record_file)
+            try:
+                await client.predict(BatchInferenceRequest(index=0, text="select 333", system_message="Convert"))
+            finally:
+                await client.close()
+
+        with self.assertRaises(LookupError):
+            asyncio.run(replay())
+
+    def test_record_and_replay_files_are_exclusive(self):
+        with self.assertRaises(ValueError):
+            AsyncChatClient(endpoint_name="endpoint", request_params={},
+                            record_file=self.record_file, replay_file=self.record_file)
+
+
+class TestBatchInferenceManager(unittest.TestCase):
+    def setUp(self):
+        credentials = SimpleNamespace(host="https://example.com", token="token")
+        patcher = mock.patch.object(batch_inference_helper, "get_databricks_host_creds", return_value=credentials)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client = AsyncChatClient(endpoint_name="endpoint", request_params={"max_tokens": 5})
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handle_chat_request))
+        self.manager = BatchInferenceManager(client, concurrency=2)
+        self.requests = [BatchInferenceRequest(index=i, text=text, system_message="Convert")
+                         for i, text in enumerate(["select 1", "select 22"], start=10)]
+
+    def test_batch_inference(self):
+        responses = asyncio.run(self.manager.batch_inference(self.requests))
+        self.assertEqual(responses, [BatchInferenceResponse(10, "SELECT 1", 20, None),
+                                     BatchInferenceResponse(11, "SELECT 22", 20, None)])
+
+    def test_generate_one_without_batch(self):
+        async def run():
+            response = await self.manager.generate_one(self.requests[0])
+            await self.manager.client.close()
+            return response
+
+        self.assertEqual(asyncio.run(run()), BatchInferenceResponse(10, "SELECT 1", 20, None))
+
+
+class TestPayloadKey(unittest.TestCase):
+    def test_key_does_not_depend_on_key_order(self):
+        payload = {"messages": [{"role": "user", "content": "日本語"}], "max_tokens": 5, "temperature": 0}
+        reordered = {"temperature": 0, "max_tokens": 5, "messages": [{"content": "日本語", "role": "user"}]}
+
+        self.assertEqual(AsyncChatClient._payload_key(payload), AsyncChatClient._payload_key(reordered))
+        self.assertNotEqual(AsyncChatClient._payload_key(payload),
+                            AsyncChatClient._payload_key({**payload, "max_tokens": 6}))
+
+
+if __name__ == '__main__':
+    unittest.main()
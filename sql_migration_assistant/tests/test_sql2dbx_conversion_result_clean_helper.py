@@ -0,0 +1,27 @@
+import unittest
+
+from jobs.sql2dbx.scripts.conversion_result_clean_helper import \
+    ConversionResultCleanHelper
+
+
+class TestConversionResultCleanHelper(unittest.TestCase):
+    """
+    Unit test class for testing the cleaning of conversion results.
+    """
+
+    def setUp(self):
+        self.helper = ConversionResultCleanHelper()
+
+    def test_clean_extracts_python_code_block(self):
+        """Tests that the code of a single python code block is extracted."""
+        text = "Here is the code:\n```python\ndef f():\n    pass\n```\nDone."
+        self.assertEqual(self.helper.clean(text), "def f():\n    pass\n")
+
+    def test_clean_keeps_text_without_code_blocks_and_none(self):
+        """Tests that text without code blocks and None are returned unchanged."""
+        self.assertEqual(self.helper.clean("def f():\n    pass\n"), "def f():\n    pass\n")
+        self.assertIsNone(self.helper.clean(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
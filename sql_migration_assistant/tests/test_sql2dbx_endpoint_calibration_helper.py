@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import unittest
+
+from jobs.sql2dbx.scripts.endpoint_calibration_helper import (
+    CalibrationTrialResult, EndpointCalibrationHelper, RunProfile,
+    select_representative_sample)
+
+
+def create_trial(concurrency, max_tokens=4000, error_count=0, total_tokens=1000, elapsed_seconds=10.0):
+    return CalibrationTrialResult(concurrency=concurrency, max_tokens=max_tokens, timeout=300, request_count=20,
+                                  error_count=error_count, total_tokens=total_tokens, elapsed_seconds=elapsed_seconds)
+
+
+class TestSelectRepresentativeSample(unittest.TestCase):
+    def setUp(self):
+        # input_file_number 1 to 10 with token counts in reverse order
+        self.token_counts = {number: (11 - number) * 100 for number in range(1, 11)}
+
+    def test_spreads_over_token_counts(self):
+        self.assertEqual(select_representative_sample(self.token_counts, 3), [10, 6, 1])
+
+    def test_small_sample_sizes(self):
+        self.assertEqual(select_representative_sample(self.token_counts, 1), [5])
+        self.assertEqual(select_representative_sample(self.token_counts, 20), list(range(10, 0, -1)))
+        self.assertEqual(select_representative_sample({}, 3), [])
+
+    def test_ties_are_ordered_by_number(self):
+        self.assertEqual(select_representative_sample({3: 100, 1: 100, 2: 100}, 3), [1, 2, 3])
+
+
+class TestRecommend(unittest.TestCase):
+    def setUp(self):
+        self.helper = EndpointCalibrationHelper(
+            endpoint_name="endpoint", request_params={"max_tokens": 4000}, concurrency_values=[4, 8, 16],
+            max_tokens_values=[1000, 4000], timeout_values=[300], max_error_rate=0.05)
+
+    def test_recommends_fastest_acceptable_trial(self):
+        profile = self.helper.recommend([
+            create_trial(4, elapsed_seconds=30.0),
+            # Too many errors, although the fastest
+            create_trial(16, error_count=5, elapsed_seconds=10.0),
+            create_trial(8, elapsed_seconds=20.0),
+        ])
+        self.assertEqual((profile.concurrency, profile.elapsed_seconds, profile.error_rate), (8, 20.0, 0.0))
+        self.assertEqual(profile.endpoint_name, "endpoint")
+        self.assertIsNotNone(profile.created_at)
+
+    def test_continuation_tokens_do_not_count_as_throughput(self):
+        # The smaller max_tokens needs continuations that send the prompts again, so it reports more tokens per
+        # second but takes longer to finish the same sample
+        profile = self.helper.recommend([
+            create_trial(8, max_tokens=1000, total_tokens=5000, elapsed_seconds=25.0),
+            create_trial(8, max_tokens=4000, total_tokens=1000, elapsed_seconds=20.0),
+        ])
+        self.assertEqual(profile.max_tokens, 4000)
+
+    def test_ties_prefer_lower_concurrency(self):
+        profile = self.helper.recommend([create_trial(16), create_trial(4), create_trial(8)])
+        self.assertEqual(profile.concurrency, 4)
+
+    def test_falls_back_to_lowest_error_rate(self):
+        with self.assertLogs("EndpointCalibrationHelper", level="WARNING"):
+            profile = self.helper.recommend([
+                create_trial(4, error_count=4, elapsed_seconds=10.0),
+                create_trial(8, error_count=2, elapsed_seconds=30.0),
+                create_trial(16, error_count=2, elapsed_seconds=20.0),
+            ])
+        self.assertEqual((profile.concurrency, profile.error_rate), (16, 0.1))
+
+    def test_requires_results(self):
+        with self.assertRaises(ValueError):
+            self.helper.recommend([])
+
+
+class TestRunProfile(unittest.TestCase):
+    def test_save_and_load(self):
+        profile = RunProfile(endpoint_name="endpoint", concurrency=8, max_tokens=4000, timeout=300,
+                             elapsed_seconds=20.0, tokens_per_second=50.0, error_rate=0.0,
+                             created_at="2024-01-01T00:00:00+00:00")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "run_profile.json")
+            profile.save(path)
+            self.assertEqual(RunProfile.load(path), profile)
+
+    def test_load_profile_without_optional_fields(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "run_profile.json")
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump({"endpoint_name": "endpoint", "concurrency": 4, "max_tokens": 2000, "timeout": 120}, file)
+            profile = RunProfile.load(path)
+        self.assertEqual((profile.concurrency, profile.max_tokens, profile.elapsed_seconds), (4, 2000, None))
+
+    def test_apply_request_params(self):
+        profile = RunProfile(endpoint_name="endpoint", concurrency=8, max_tokens=4000, timeout=300)
+        request_params = {"max_tokens": 1000, "temperature": 0}
+
+        self.assertEqual(profile.apply_request_params(request_params), {"max_tokens": 4000, "temperature": 0})
+        self.assertEqual(request_params, {"max_tokens": 1000, "temperature": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import base64
+import os
+import tempfile
+import unittest
+
+from jobs.sql2dbx.scripts import utils
+from jobs.sql2dbx.scripts.few_shot_selector import (FewShotExample,
+                                                    FewShotSelector)
+
+
+class TestFewShotSelector(unittest.TestCase):
+    """
+    Unit test class for testing the retrieval-based few-shot selection.
+    """
+
+    def setUp(self):
+        # A byte-level BPE file without merges, so that each byte is one token
+        self.temp_dir = tempfile.TemporaryDirectory()
+        bpe_file = os.path.join(self.temp_dir.name, "bytes.tiktoken")
+        with open(bpe_file, "w") as file:
+            for rank in range(256):
+                file.write(f"{base64.b64encode(bytes([rank])).decode()} {rank}\n")
+        utils.register_tokenizer_file("test_bytes", bpe_file)
+        self.examples = [
+            FewShotExample("MERGE INTO dbo.Target t USING dbo.Source s ON t.Id = s.Id "
+                           "WHEN MATCHED THEN UPDATE SET t.Name = s.Name;", "spark.sql('MERGE INTO target')"),
+            FewShotExample("DECLARE cur CURSOR FOR SELECT Id FROM dbo.Orders; OPEN cur; FETCH NEXT FROM cur INTO @Id;",
+                           "for row in spark.table('orders').collect(): pass"),
+            FewShotExample("BEGIN TRAN; UPDATE dbo.Accounts SET Balance = 0; COMMIT TRAN;",
+                           "spark.sql('UPDATE accounts SET balance = 0')"),
+        ]
+        self.selector = FewShotSelector(self.examples, utils.TokenCounter("test_bytes"), max_examples=2)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_selects_most_similar_example_last(self):
+        """Tests that the most similar examples are selected, with the most similar one closest to the input."""
+        few_shots = self.selector.select("DECLARE c CURSOR FOR SELECT Id FROM dbo.Customers; OPEN c; "
+                                         "FETCH NEXT FROM c INTO @Id; MERGE INTO dbo.Target t USING x s ON 1 = 1;")
+        self.assertEqual([m["role"] for m in few_shots], ["user", "assistant", "user", "assistant"])
+        self.assertEqual(few_shots[-2]["content"], self.examples[1].source_sql)
+        self.assertEqual(few_shots[0]["content"], self.examples[0].source_sql)
+
+    def test_skips_examples_over_token_budget(self):
+        """Tests that examples that do not fit the token budget are skipped."""
+        sql = "MERGE INTO dbo.Target t USING dbo.Other s ON t.Id = s.Id WHEN MATCHED THEN DELETE;"
+        merge_example_tokens = self.selector.token_counts[0]
+        few_shots = self.selector.select(sql, token_budget=merge_example_tokens)
+        self.assertEqual([m["content"] for m in few_shots], [self.examples[0].source_sql, self.examples[0].converted_code])
+        few_shots = self.selector.select(sql, token_budget=merge_example_tokens - 1)
+        self.assertNotIn(self.examples[0].source_sql, [m["content"] for m in few_shots])
+        self.assertEqual(self.selector.select(sql, token_budget=0), [])
+
+    def test_does_not_select_the_input_itself(self):
+        """Tests that an example with the same SQL as the input is not selected."""
+        few_shots = self.selector.select(self.examples[2].source_sql)
+        self.assertNotIn(self.examples[2].source_sql, [m["content"] for m in few_shots])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from jobs.sql2dbx.scripts.file_manifest_helper import FileManifestHelper
+
+
+class TestFileManifestHelper(unittest.TestCase):
+    """
+    Unit test class for testing the FileManifestHelper.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.helper = FileManifestHelper()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def test_diff_detects_new_changed_unchanged_and_removed_files(self):
+        """Tests that each file is classified against the previous manifest."""
+        unchanged = self._write("unchanged.sql", "SELECT 1")
+        changed = self._write("changed.sql", "SELECT 2")
+        removed = self._write("removed.sql", "SELECT 3")
+        previous = {e.input_file_path: e for e in self.helper.create_entries([unchanged, changed, removed])}
+
+        self._write("changed.sql", "SELECT 22")
+        os.remove(removed)
+        new = self._write("new.sql", "SELECT 4")
+
+        diff = self.helper.diff([unchanged, changed, new], previous)
+        self.assertEqual([e.input_file_path for e in diff.new], [new])
+        self.assertEqual([e.input_file_path for e in diff.changed], [changed])
+        self.assertEqual([e.input_file_path for e in diff.unchanged], [unchanged])
+        self.assertEqual(diff.removed, [removed])
+        self.assertEqual(len(diff.entries), 3)
+
+    def test_touched_file_with_same_content_is_unchanged(self):
+        """Tests that a file with a new modification time but the same content is not reported as changed."""
+        path = self._write("touched.sql", "SELECT 1")
+        previous = {e.input_file_path: e for e in self.helper.create_entries([path])}
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+        diff = self.helper.diff([path], previous)
+        self.assertEqual(diff.changed, [])
+        self.assertEqual(diff.unchanged[0].input_file_mtime, stat.st_mtime + 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from jobs.sql2dbx.scripts.llm_token_count_helper import (
+    FILE_TOKEN_METADATA_ARROW_SCHEMA, FileTokenMetadata, TokenEstimator,
+    to_record_batch)
+
+
+class TestToRecordBatch(unittest.TestCase):
+    """
+    Unit test class for testing the conversion of FileTokenMetadata to Arrow record batches.
+    """
+
+    def test_converts_metadata_with_missing_counts(self):
+        """Tests that all fields are converted and missing token counts become nulls."""
+        metadata = FileTokenMetadata(
+            input_file_number=1,
+            input_file_path="/input/a.sql",
+            input_file_encoding="utf-8",
+            input_file_encoding_confidence=1.0,
+            input_file_content="SELECT 1 -- comment",
+            input_file_content_without_sql_comments="SELECT 1 ",
+            input_file_token_count=None,
+            input_file_token_count_without_sql_comments=3,
+            tiktoken_encoding="o200k_base",
+        )
+        batch = to_record_batch([metadata])
+        self.assertEqual(batch.schema, FILE_TOKEN_METADATA_ARROW_SCHEMA)
+        row = batch.to_pylist()[0]
+        self.assertEqual(row["input_file_path"], "/input/a.sql")
+        self.assertIsNone(row["input_file_token_count"])
+        self.assertEqual(row["input_file_token_count_without_sql_comments"], 3)
+
+    def test_metadata_has_no_instance_dict(self):
+        """Tests that FileTokenMetadata uses slots instead of a per-instance dict."""
+        self.assertFalse(hasattr(FileTokenMetadata(1, "p", "utf-8", 1.0, "", None, 0, None, "o200k_base"), "__dict__"))
+
+
+class TestTokenEstimator(unittest.TestCase):
+    """
+    Unit test class for testing the approximate token estimator.
+    """
+
+    def test_calibrate_fits_linear_counts(self):
+        """Tests that counts proportional to the character count are fitted with a small error bound."""
+        texts = [f"SELECT col_{i} FROM table_{i};" * (i + 1) for i in range(20)]
+        counts = [len(text) // 4 for text in texts]
+        estimator = TokenEstimator.calibrate(texts, counts)
+        self.assertLess(estimator.relative_error_bound, 0.1)
+        self.assertAlmostEqual(estimator.estimate(texts[10]), counts[10], delta=counts[10] * 0.1)
+
+    def test_calibrate_with_too_few_samples_returns_default(self):
+        """Tests that calibration falls back to the default estimator without enough samples."""
+        self.assertEqual(TokenEstimator.calibrate(["SELECT 1"], [3]), TokenEstimator())
+
+    def test_is_near(self):
+        """Tests that only estimates whose error bounds include the threshold are near it."""
+        estimator = TokenEstimator(relative_error_bound=0.1)
+        self.assertTrue(estimator.is_near(1000, 1050))
+        self.assertTrue(estimator.is_near(1000, 950))
+        self.assertFalse(estimator.is_near(1000, 1200))
+        self.assertFalse(estimator.is_near(1000, 800))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import base64
+import os
+import tempfile
+import unittest
+
+from jobs.sql2dbx.scripts import utils
+from jobs.sql2dbx.scripts.prompt_builder import (PromptBuilder, PromptSection,
+                                                 summarize_prompt_tokens)
+from jobs.sql2dbx.scripts.system_prompts.tsql_conversion_prompt import \
+    TsqlConversionPromptManager
+
+
+class TestPromptBuilder(unittest.TestCase):
+    """
+    Unit test class for testing the section-based system messages and their token cost.
+    """
+
+    def setUp(self):
+        # A byte-level BPE file without merges, so that each byte is one token
+        self.temp_dir = tempfile.TemporaryDirectory()
+        bpe_file = os.path.join(self.temp_dir.name, "bytes.tiktoken")
+        with open(bpe_file, "w") as file:
+            for rank in range(256):
+                file.write(f"{base64.b64encode(bytes([rank])).decode()} {rank}\n")
+        utils.register_tokenizer_file("test_bytes", bpe_file)
+        self.token_counter = utils.TokenCounter("test_bytes")
+        self.builder = PromptBuilder("# Guidelines ({lang})\n", [
+            PromptSection("base", "Base:\n    - Always."),
+            PromptSection("transactions", "Transactions:\n    - Use try/except.", trigger=r"\bBEGIN\s+TRAN"),
+            PromptSection("loops", "Loops:\n    - Use for loops.", trigger=r"\b(CURSOR|WHILE)\b"),
+        ], self.token_counter, format_args={"lang": "English"})
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_build_selects_triggered_sections_and_renumbers(self):
+        """Tests that only the sections whose triggers match are included, numbered from 1."""
+        self.assertEqual(self.builder.build("begin tran; while 1 = 1 break; commit;"),
+                         "# Guidelines (English)\n1. Base:\n    - Always.\n"
+                         "2. Transactions:\n    - Use try/except.\n3. Loops:\n    - Use for loops.\n")
+        self.assertEqual(self.builder.build("SELECT * FROM dbo.Loops;"),
+                         "# Guidelines (English)\n1. Base:\n    - Always.\n")
+
+    def test_costs_count_requests_per_section(self):
+        """Tests that each section's token count and the number of requests that included it are recorded."""
+        self.builder.build("BEGIN TRAN; COMMIT;")
+        self.builder.build("SELECT 1;")
+        self.assertEqual([(c.name, c.request_count) for c in self.builder.costs],
+                         [("base", 2), ("transactions", 1), ("loops", 0)])
+        self.assertEqual(self.builder.costs[0].token_count, len("1. Base:\n    - Always.\n"))
+        self.assertEqual(self.builder.costs[0].total_token_count, 2 * len("1. Base:\n    - Always.\n"))
+
+    def test_tsql_full_build_matches_system_message(self):
+        """Tests that the T-SQL system message with all sections is the same as get_system_message."""
+        manager = TsqlConversionPromptManager("Japanese")
+        builder = manager.get_prompt_builder(self.token_counter, detect_sections=False)
+        self.assertEqual(builder.build("SELECT 1;"), manager.get_system_message())
+        # Sections are measured as if numbered 1, so the two-digit numbers are one byte short each
+        self.assertEqual(builder.get_full_token_count(), len(manager.get_system_message().encode()) - 8)
+
+    def test_summarize_prompt_tokens(self):
+        """Tests that the prompt tokens are summed by message kind."""
+        requests = [
+            [{"role": "system", "content": "s" * 30}, {"role": "user", "content": "u" * 10},
+             {"role": "assistant", "content": "a" * 10}, {"role": "user", "content": "i" * 50}],
+            [{"role": "system", "content": "s" * 30}, {"role": "user", "content": "i" * 70}],
+        ]
+        self.assertEqual(summarize_prompt_tokens(requests, self.token_counter), {
+            "system_message": 60, "few_shots": 20, "input": 120, "total": 200, "overhead_percent": 40})
+
+
+if __name__ == "__main__":
+    unittest.main()
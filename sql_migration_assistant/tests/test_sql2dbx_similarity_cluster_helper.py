@@ -0,0 +1,57 @@
+import unittest
+
+from jobs.sql2dbx.scripts.similarity_cluster_helper import (
+    SimilarityClusterHelper, normalize_sql_tokens, order_by_representatives)
+
+PROCEDURE_TEMPLATE = """
+CREATE PROCEDURE dbo.usp_Load_{n} AS
+BEGIN
+    SELECT * INTO #tmp FROM dbo.Source_{n} WHERE Region = 'R{n}';
+    SELECT o.OrderId, o.CustomerId, SUM(l.Amount) AS Total
+    FROM dbo.Orders o JOIN dbo.OrderLines l ON l.OrderId = o.OrderId
+    WHERE o.Status = 'OPEN' AND o.CreatedAt > DATEADD(day, -30, GETDATE())
+    GROUP BY o.OrderId, o.CustomerId;
+    UPDATE dbo.Customers SET LastOrder = GETDATE() WHERE CustomerId IN (SELECT CustomerId FROM #tmp);
+    DELETE FROM dbo.Staging WHERE LoadDate < DATEADD(day, -7, GETDATE());
+    INSERT INTO dbo.AuditLog (Action, CreatedAt) VALUES ('cleanup', GETDATE());
+END
+"""
+
+
+class TestSimilarityClusterHelper(unittest.TestCase):
+    """
+    Unit test class for testing the MinHash LSH near-duplicate detection.
+    """
+
+    def setUp(self):
+        self.helper = SimilarityClusterHelper(threshold=0.8)
+
+    def test_normalize_sql_tokens(self):
+        """Tests that string literals and numbers are normalized and other tokens are lowercased."""
+        self.assertEqual(normalize_sql_tokens("SELECT Id FROM t WHERE s = N'it''s' AND n > 10.5"),
+                         ["select", "id", "from", "t", "where", "s", "=", "'?'", "and", "n", ">", "0"])
+
+    def test_clusters_procedures_from_the_same_template(self):
+        """Tests that procedures differing only in names and literals are clustered under the smallest number."""
+        numbered_texts = [(n, PROCEDURE_TEMPLATE.format(n=n)) for n in range(1, 5)]
+        numbered_texts.append((5, "SELECT name FROM sys.tables ORDER BY create_date DESC"))
+        numbered_texts.append((6, ""))
+        self.assertEqual(self.helper.cluster(numbered_texts), {1: 1, 2: 1, 3: 1, 4: 1, 5: 5, 6: 6})
+
+    def test_signature_is_deterministic(self):
+        """Tests that signatures of the same text are equal across helpers with the same seed."""
+        text = PROCEDURE_TEMPLATE.format(n=1)
+        other_helper = SimilarityClusterHelper(threshold=0.8)
+        self.assertTrue((self.helper.compute_signature(text) == other_helper.compute_signature(text)).all())
+        self.assertIsNone(self.helper.compute_signature("  "))
+
+    def test_order_by_representatives(self):
+        """Tests that the smallest given number of each cluster is its representative."""
+        clusters = {1: 1, 2: 1, 3: 1, 4: 4}
+        representatives, followers = order_by_representatives(clusters, [3, 2, 4, 7])
+        self.assertEqual(representatives, [2, 4, 7])
+        self.assertEqual(followers, {3: 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
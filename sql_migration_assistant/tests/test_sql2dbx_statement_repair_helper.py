@@ -0,0 +1,86 @@
+import unittest
+
+from jobs.sql2dbx.scripts.batch_inference_helper import BatchInferenceResponse
+from jobs.sql2dbx.scripts.statement_repair_helper import (
+    FixTarget, StatementRepairPlanner, locate_repair_fragments,
+    splice_fragments)
+
+CONTENT = '''def run():
+    spark.sql("SELECT 1")
+    table = "t"
+    query = f"""
+SELECT * FRM {table}
+"""
+    df = spark.sql(query)
+    spark.sql("DELET FROM t2")
+    return df
+'''
+
+
+class TestLocateRepairFragments(unittest.TestCase):
+    def test_locates_failing_calls_with_query_assignment(self):
+        fragments = locate_repair_fragments(CONTENT, ["Error in query 1: a", "Error in query 2: b"], context_lines=1)
+
+        self.assertEqual([(f.start_line, f.end_line) for f in fragments], [(4, 7), (8, 8)])
+        self.assertEqual(fragments[0].indent, "    ")
+        self.assertTrue(fragments[0].code.startswith('query = f"""\n'))
+        self.assertEqual(fragments[0].sql_errors, ["Error in query 1: a"])
+        self.assertEqual(fragments[0].context_before, '    table = "t"')
+        self.assertEqual(fragments[1].code, 'spark.sql("DELET FROM t2")')
+        self.assertEqual(fragments[1].context_after, "    return df")
+
+    def test_returns_none_if_an_error_cannot_be_located(self):
+        self.assertIsNone(locate_repair_fragments(CONTENT, ["Error in query 9: a"]))
+        self.assertIsNone(locate_repair_fragments(CONTENT, ["unexpected error"]))
+        self.assertIsNone(locate_repair_fragments("def run(:\n    pass\n", ["Error in query 0: a"]))
+
+    def test_returns_none_if_query_is_assigned_in_another_block(self):
+        content = 'def run(x):\n    if x:\n        query = "SELEC 1"\n    spark.sql(query)\n'
+        self.assertIsNone(locate_repair_fragments(content, ["Error in query 0: a"]))
+
+    def test_splice_keeps_the_other_lines(self):
+        fragments = locate_repair_fragments(CONTENT, ["Error in query 1: a", "Error in query 2: b"])
+        spliced = splice_fragments(CONTENT, fragments, [
+            'query = f"SELECT * FROM {table}"\ndf = spark.sql(query)\n',
+            'spark.sql("DELETE FROM t2")',
+        ])
+
+        self.assertEqual(spliced, '''def run():
+    spark.sql("SELECT 1")
+    table = "t"
+    query = f"SELECT * FROM {table}"
+    df = spark.sql(query)
+    spark.sql("DELETE FROM t2")
+    return df
+''')
+
+
+class TestStatementRepairPlanner(unittest.TestCase):
+    def test_requests_and_fallbacks(self):
+        targets = [
+            FixTarget(1, CONTENT, sql_parse_errors=["Error in query 2: b"]),
+            FixTarget(2, "def run(:\n", python_parse_error="invalid syntax"),
+            FixTarget(3, CONTENT, sql_parse_errors=["Error in query 2: b"]),
+        ]
+        planner = StatementRepairPlanner(targets)
+        requests = planner.create_requests()
+
+        self.assertEqual([r.index for r in requests], [0, 1, 2])
+        self.assertEqual(requests[0].text, 'spark.sql("DELET FROM t2")')
+        self.assertIn("Error in query 2: b", requests[0].system_message)
+        self.assertEqual(requests[2].text, "def run(:\n")
+
+        file_responses, fallback_targets = planner.assemble([
+            BatchInferenceResponse(0, '```python\nspark.sql("DELETE FROM t2")\n```', 5, None),
+            # The fixed fragment of file 3 breaks the indentation, so the file is fixed as a whole
+            BatchInferenceResponse(1, 'if True:\nspark.sql("DELETE FROM t2")', 6, None),
+            BatchInferenceResponse(2, "def run():\n    pass\n", 7, None),
+        ])
+
+        self.assertEqual([(r.index, r.token_count) for r in file_responses], [(2, 7), (1, 5)])
+        self.assertIn('    spark.sql("DELETE FROM t2")\n    return df', file_responses[1].content)
+        self.assertEqual([t.input_file_number for t in fallback_targets], [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
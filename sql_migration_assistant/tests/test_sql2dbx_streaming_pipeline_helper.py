@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+import unittest
+
+from jobs.sql2dbx.scripts.batch_inference_helper import (BatchInferenceManager,
+                                                         BatchInferenceRequest)
+from jobs.sql2dbx.scripts.streaming_pipeline_helper import (
+    StreamingConversionPipeline, check_syntax)
+
+
+class FakeChatClient:
+    """A chat client that answers from a dict of request texts, after a delay per request."""
+
+    def __init__(self, answers, delays=None):
+        self.answers = answers
+        self.delays = delays or {}
+        self.requests = []
+        self.closed = False
+
+    async def predict(self, request):
+        self.requests.append(request)
+        await asyncio.sleep(self.delays.get(request.text, 0))
+        answer = self.answers[request.text]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer, 10
+
+    async def close(self):
+        self.closed = True
+
+
+def parse_sql(sql):
+    if "SELEC " in sql:
+        raise ValueError("Syntax error at or near 'SELEC'")
+
+
+class TestStreamingConversionPipeline(unittest.TestCase):
+    """
+    Unit test class for testing the streaming pipeline of conversion, syntax check and fix.
+    """
+
+    def run_pipeline(self, client, requests, **kwargs):
+        manager = BatchInferenceManager(client, concurrency=4, log_level=logging.WARNING)
+        pipeline = StreamingConversionPipeline(manager, parse_sql, log_level=logging.WARNING, **kwargs)
+        return pipeline, asyncio.run(pipeline.run(requests))
+
+    def test_check_syntax(self):
+        """Tests that Python and SQL parse errors are reported in the format of the static syntax check."""
+        result = check_syntax('def f():\n    spark.sql("SELEC 1")\n    spark.sql("SELECT 2")\n', parse_sql)
+        self.assertEqual(result.extracted_sqls, ["SELEC 1", "SELECT 2"])
+        self.assertEqual(result.sql_parse_errors, ["Error in query 0: Syntax error at or near 'SELEC'"])
+        self.assertTrue(check_syntax("def f(:\n", parse_sql).python_parse_error)
+
+    def test_converts_checks_and_fixes_each_file(self):
+        """Tests that files with syntax errors are fixed and checked again, and the others are only converted."""
+        client = FakeChatClient({
+            "ok": "```python\ndef ok():\n    spark.sql('SELECT 1')\n```",
+            "bad": "def bad():\n    spark.sql('SELEC 1')\n",
+            "def bad():\n    spark.sql('SELEC 1')\n": "def bad():\n    spark.sql('SELECT 1')\n",
+            "failed": RuntimeError("endpoint error"),
+        })
+        requests = [BatchInferenceRequest(index=n, text=t, system_message="convert")
+                    for n, t in [(1, "ok"), (2, "bad"), (3, "failed")]]
+        _, results = self.run_pipeline(client, requests)
+
+        self.assertEqual([r.response.index for r in results], [1, 2, 3])
+        self.assertEqual(results[0].response.content, "def ok():\n    spark.sql('SELECT 1')\n")
+        self.assertEqual((results[0].fix_attempts, results[0].syntax_check.has_errors), (0, False))
+        self.assertEqual(results[1].response.content, "def bad():\n    spark.sql('SELECT 1')\n")
+        self.assertEqual((results[1].fix_attempts, results[1].syntax_check.has_errors), (1, False))
+        self.assertIn("Error in query 0", client.requests[-1].system_message)
+        self.assertEqual(results[2].response.error, "endpoint error")
+        self.assertIsNone(results[2].syntax_check)
+        self.assertTrue(client.closed)
+
+    def test_keeps_errors_after_max_fix_attempts(self):
+        """Tests that a file that is still wrong after the fix attempts keeps its last content and errors."""
+        bad = "def bad():\n    spark.sql('SELEC 1')\n"
+        client = FakeChatClient({"bad": bad, bad: bad})
+        _, results = self.run_pipeline(client, [BatchInferenceRequest(1, "bad", "convert")], max_fix_attempts=2)
+        self.assertEqual(results[0].fix_attempts, 2)
+        self.assertTrue(results[0].syntax_check.has_errors)
+        self.assertEqual(len(client.requests), 3)
+
+    def test_files_do_not_wait_for_stage_barriers(self):
+        """Tests that a fast file is fixed while a slow file is still being converted."""
+        bad = "def bad():\n    spark.sql('SELEC 1')\n"
+        client = FakeChatClient({"slow": "def slow():\n    pass\n", "bad": bad, bad: "def bad():\n    pass\n"},
+                                delays={"slow": 0.3, "bad": 0.1, bad: 0.2})
+        requests = [BatchInferenceRequest(1, "slow", "convert"), BatchInferenceRequest(2, "bad", "convert")]
+        start = time.time()
+        pipeline, results = self.run_pipeline(client, requests)
+        # With stage barriers, the fix would start after the slow conversion: 0.3 + 0.2 seconds
+        self.assertLess(time.time() - start, 0.45)
+        self.assertEqual(results[1].fix_attempts, 1)
+        self.assertLess(pipeline.elapsed, 0.45)
+
+
+if __name__ == "__main__":
+    unittest.main()
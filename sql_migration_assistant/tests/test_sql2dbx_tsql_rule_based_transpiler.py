@@ -0,0 +1,114 @@
+import unittest
+
+from jobs.sql2dbx.scripts.tsql_rule_based_transpiler import \
+    TsqlRuleBasedTranspiler
+from jobs.sql2dbx.scripts.utils import to_snake_case
+
+PROCEDURE = """SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+CREATE PROCEDURE [dbo].[GetActiveOrders]
+    @CustomerId INT,
+    @Status NVARCHAR(20) = N'Active'
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DELETE FROM [dbo].[OrderCache] WHERE CustomerId = @CustomerId;
+    SELECT [OrderId], [Amount] FROM [dbo].[Orders] WHERE CustomerId = @CustomerId AND Status = @Status
+    UNION ALL
+    SELECT OrderId, Amount FROM dbo.ArchivedOrders WHERE CustomerId = @CustomerId;
+END
+GO
+"""
+
+
+class TestTsqlRuleBasedTranspiler(unittest.TestCase):
+    def setUp(self):
+        self.transpiler = TsqlRuleBasedTranspiler()
+
+    def test_transpiles_procedure(self):
+        self.assertEqual(self.transpiler.transpile(PROCEDURE), '''def get_active_orders(customer_id, status='Active'):
+    # This function was converted by the rule-based transpiler of sql2dbx without an LLM.
+    spark.sql("DELETE FROM `dbo`.`OrderCache` WHERE CustomerId = :customer_id", args={"customer_id": customer_id})
+    return spark.sql("""
+        SELECT `OrderId`, `Amount` FROM `dbo`.`Orders` WHERE CustomerId = :customer_id AND Status = :status
+        UNION ALL
+        SELECT OrderId, Amount FROM dbo.ArchivedOrders WHERE CustomerId = :customer_id
+    """, args={"customer_id": customer_id, "status": status})
+''')
+
+    def test_last_statement_is_returned_only_if_it_is_a_select(self):
+        result = self.transpiler.transpile(
+            "CREATE PROCEDURE p @Status VARCHAR(10) AS BEGIN UPDATE t SET a = 1 WHERE s = @Status END")
+        self.assertTrue(result.startswith("def p(status):\n"))
+        self.assertIn('''    spark.sql("UPDATE t SET a = 1 WHERE s = :status", args={"status": status})\n''', result)
+        self.assertNotIn("return", result)
+
+        result = self.transpiler.transpile("CREATE PROC dbo.p AS SELECT * FROM t")
+        self.assertTrue(result.endswith('    return spark.sql("SELECT * FROM t")\n'))
+
+    def test_rejects_unsupported_constructs(self):
+        bodies = [
+            "DECLARE @x INT; SELECT 1",
+            "SELECT ISNULL(a, 0) FROM t",
+            "UPDATE t SET a = s.a FROM t JOIN s ON t.id = s.id",
+            "SELECT * FROM #tmp",
+            "SELECT * FROM t WHERE a = @Unknown",
+            "SELECT a FROM t WHERE b = @Status + 'x'",
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assertIsNone(self.transpiler.transpile(
+                    f"CREATE PROCEDURE p @Status VARCHAR(10) AS BEGIN {body} END"))
+        self.assertIsNone(self.transpiler.transpile("SELECT * FROM t"))
+
+    def test_string_parameters_are_not_pasted_into_the_sql(self):
+        result = self.transpiler.transpile(
+            "CREATE PROCEDURE p @Name NVARCHAR(50) = N'O''Brien' AS DELETE FROM t WHERE name = @Name")
+        self.assertIsNone(result)
+
+        result = self.transpiler.transpile("CREATE PROCEDURE p @Name NVARCHAR(50) AS DELETE FROM t WHERE name = @Name")
+        self.assertIn('''spark.sql("DELETE FROM t WHERE name = :name", args={"name": name})''', result)
+        self.assertNotIn("'", result)
+
+    def test_arithmetic_operators(self):
+        def transpile(expression):
+            return self.transpiler.transpile(
+                f"CREATE PROCEDURE p @Id INT, @Status VARCHAR(10) AS SELECT {expression} AS v FROM t")
+
+        self.assertIsNotNone(transpile("@Id + 1"))
+        self.assertIsNotNone(transpile("@Id / 2.0"))
+        rejected = [
+            # String concatenation in T-SQL, but numeric addition in Spark SQL
+            "FirstName + LastName",
+            "@Status + 1",
+            # Integer division truncates in T-SQL, but not in Spark SQL
+            "qty / cnt",
+            "@Id / 2",
+            "SUM(qty) / 2.0",
+        ]
+        for expression in rejected:
+            with self.subTest(expression=expression):
+                self.assertIsNone(transpile(expression))
+
+    def test_rejects_select_results_before_the_last_statement(self):
+        for body in ["SELECT a FROM t; SELECT b FROM s", "SELECT a FROM t; DELETE FROM s"]:
+            with self.subTest(body=body):
+                self.assertIsNone(self.transpiler.transpile(f"CREATE PROCEDURE p AS BEGIN {body} END"))
+
+    def test_japanese_comment(self):
+        result = TsqlRuleBasedTranspiler("Japanese").transpile(PROCEDURE)
+        self.assertEqual(result.split("\n")[1],
+                         "    # この関数は、LLMを使用せずにsql2dbxのルールベースのトランスパイラーで変換されました。")
+
+
+class TestToSnakeCase(unittest.TestCase):
+    def test_to_snake_case(self):
+        self.assertEqual(to_snake_case("GetActiveOrders"), "get_active_orders")
+        self.assertEqual(to_snake_case("CustomerID"), "customer_id")
+        self.assertEqual(to_snake_case("usp_GetHTTPStatus"), "usp_get_http_status")
+
+
+if __name__ == '__main__':
+    unittest.main()
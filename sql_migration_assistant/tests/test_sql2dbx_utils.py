@@ -0,0 +1,270 @@
+import base64
+import codecs
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from jobs.sql2dbx.scripts import utils
+
+
+class TestEncodingDetector(unittest.TestCase):
+    """
+    Unit test class for testing the tiered EncodingDetector.
+    """
+
+    def setUp(self):
+        self.detector = utils.EncodingDetector(sample_size=256)
+
+    def test_detects_bom(self):
+        """Tests that a byte order mark is detected before any other tier."""
+        raw_data = codecs.BOM_UTF16_LE + "SELECT 1".encode("utf-16-le")
+        result = self.detector.detect(raw_data)
+        self.assertEqual(result.encoding, "utf-16")
+        self.assertEqual(result.method, "bom")
+        self.assertEqual(result.confidence, 1.0)
+
+    def test_detects_ascii_and_utf8_without_chardet(self):
+        """Tests that ASCII and valid UTF-8 are detected by the strict validation tier."""
+        self.assertEqual(self.detector.detect(b"SELECT 1").encoding, "ascii")
+        result = self.detector.detect("SELECT 'café'".encode("utf-8"))
+        self.assertEqual(result.encoding, "utf-8")
+        self.assertEqual(result.method, "utf-8")
+
+    def test_caches_detected_encoding_per_directory(self):
+        """Tests that an encoding detected by chardet is reused for other files in the same directory."""
+        raw_data = ("SELECT * FROM テーブル WHERE 名前 = '山田';\n" * 50).encode("shift_jis")
+        first = self.detector.detect(raw_data, file_path="/input/a.sql")
+        second = self.detector.detect(raw_data, file_path="/input/b.sql")
+        other_directory = self.detector.detect(raw_data, file_path="/other/c.sql")
+        self.assertEqual(first.method, "chardet")
+        self.assertEqual(second.method, "cache")
+        self.assertEqual(second.encoding, first.encoding)
+        self.assertEqual(other_directory.method, "chardet")
+
+    def test_detects_multibyte_tail_after_ascii_head(self):
+        """Tests that a Shift-JIS part after an ASCII head longer than sample_size is not decoded as ASCII."""
+        text = "-- " + "x" * 1000 + "\n" + "SELECT * FROM テーブル WHERE 名前 = '山田';\n" * 20
+        raw_data = text.encode("shift_jis")
+        content, detection = utils.decode_file_content(raw_data, detector=self.detector)
+        self.assertNotEqual(detection.encoding.lower(), "ascii")
+        self.assertEqual(detection.method, "chardet")
+        self.assertEqual(content, text)
+
+    def test_decode_file_content_with_specified_encoding(self):
+        """Tests that an explicitly specified encoding skips detection."""
+        content, detection = utils.decode_file_content("SELECT 1".encode("cp1252"), encoding="cp1252")
+        self.assertEqual(content, "SELECT 1")
+        self.assertEqual(detection.method, "specified")
+
+
+
+class TestRemoveSqlComments(unittest.TestCase):
+    """
+    Unit test class for testing the single-pass SQL comment remover.
+    """
+
+    def test_removes_line_and_nested_block_comments(self):
+        """Tests that line comments and nested block comments are removed."""
+        sql = "SELECT 1 -- comment\nFROM t /* outer /* inner */ still outer */ WHERE x = 1"
+        self.assertEqual(utils.remove_sql_comments(sql), "SELECT 1 \nFROM t  WHERE x = 1")
+
+    def test_keeps_comment_markers_in_literals(self):
+        """Tests that comment markers inside strings and quoted or bracketed identifiers are kept."""
+        sql = "SELECT 'it''s -- not a comment', [col--1], \"a/*b\" FROM t -- comment"
+        self.assertEqual(utils.remove_sql_comments(sql),
+                         "SELECT 'it''s -- not a comment', [col--1], \"a/*b\" FROM t ")
+
+    def test_collapses_multiple_empty_lines(self):
+        """Tests that multiple empty lines are collapsed by default."""
+        self.assertEqual(utils.remove_sql_comments("SELECT 1\n\n  \n-- c\n\nSELECT 2"), "SELECT 1\n\nSELECT 2")
+
+    def test_normalize_whitespace(self):
+        """Tests that whitespace and comments outside literals are collapsed into single spaces."""
+        sql = "SELECT\t a,  -- c\n  b/*x*/c\nFROM t WHERE s = '  two  spaces  '"
+        self.assertEqual(utils.remove_sql_comments(sql, normalize_whitespace=True),
+                         "SELECT a, b c FROM t WHERE s = '  two  spaces  '")
+
+
+
+class TestTokenizerRegistry(unittest.TestCase):
+    """
+    Unit test class for testing the process-wide tokenizer registry.
+    """
+
+    def setUp(self):
+        # A byte-level BPE file without merges, so that each byte is one token
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.bpe_file = os.path.join(self.temp_dir.name, "bytes.tiktoken")
+        with open(self.bpe_file, "w") as file:
+            for rank in range(256):
+                file.write(f"{base64.b64encode(bytes([rank])).decode()} {rank}\n")
+        utils.register_tokenizer_file("test_bytes", self.bpe_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_registered_tokenizer_file_is_loaded_once(self):
+        """Tests that a registered BPE file is loaded on first use and shared afterwards."""
+        tokenizer = utils.get_tokenizer("test_bytes")
+        self.assertIs(utils.get_tokenizer("test_bytes"), tokenizer)
+        self.assertEqual(utils.TokenCounter("test_bytes").count_tokens("SELECT 1"), 8)
+        self.assertEqual(utils.TokenCounter("test_bytes").count_tokens_batch(["a", "abc"]), [1, 3])
+
+    def test_unknown_tokenizer(self):
+        """Tests that an unknown name raises a ValueError."""
+        with self.assertRaises(ValueError):
+            utils.get_tokenizer("no_such_tokenizer")
+
+
+class TestIterFiles(unittest.TestCase):
+    """
+    Unit test class for testing the scandir-based file discovery and FileFilter.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for name in ["b.sql", "a.SQL", "readme.md", "procs/c.sql", "procs/sub/d.sql", "backup/e.sql"]:
+            path = os.path.join(self.temp_dir.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as file:
+                file.write("SELECT 1")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _relative_paths(self, file_filter=None):
+        return [os.path.relpath(path, self.temp_dir.name).replace(os.sep, "/")
+                for path in utils.iter_files(self.temp_dir.name, file_filter)]
+
+    def test_yields_all_files_in_deterministic_order(self):
+        """Tests that the files of each directory are yielded in name order before its subdirectories."""
+        self.assertEqual(self._relative_paths(),
+                         ["a.SQL", "b.sql", "readme.md", "backup/e.sql", "procs/c.sql", "procs/sub/d.sql"])
+        self.assertEqual(utils.list_files_recursively(self.temp_dir.name),
+                         list(utils.iter_files(self.temp_dir.name)))
+
+    def test_filters_by_extension_patterns_and_depth(self):
+        """Tests that extensions, include and exclude patterns and the maximum depth are combined."""
+        self.assertEqual(self._relative_paths(utils.FileFilter(extensions=[".sql"], exclude_patterns=["backup/*"])),
+                         ["a.SQL", "b.sql", "procs/c.sql", "procs/sub/d.sql"])
+        self.assertEqual(self._relative_paths(utils.FileFilter(include_patterns=["procs/*"], max_depth=1)),
+                         ["procs/c.sql"])
+        self.assertEqual(self._relative_paths(utils.FileFilter(max_depth=0, exclude_patterns=["*.md"])),
+                         ["a.SQL", "b.sql"])
+
+    def test_parse_comma_separated(self):
+        """Tests that widget values are split into stripped, non-empty values."""
+        self.assertEqual(utils.parse_comma_separated(" *.sql, ,procs/* "), ["*.sql", "procs/*"])
+        self.assertEqual(utils.parse_comma_separated(""), [])
+
+
+class TestIterArchiveMembers(unittest.TestCase):
+    """
+    Unit test class for testing reading files from archives without extracting them.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.members = {"procs/a.sql": b"SELECT 1", "procs/sub/b.sql": b"SELECT 2"}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_zip_archive(self):
+        """Tests that regular files of a zip archive are yielded with their archive-relative paths."""
+        archive_path = os.path.join(self.temp_dir.name, "input.zip")
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            archive.writestr("procs/", "")
+            for name, content in self.members.items():
+                archive.writestr(name, content)
+        self.assertTrue(utils.is_archive(archive_path))
+        self.assertEqual(dict(utils.iter_archive_members(archive_path)), self.members)
+
+    def test_tar_gz_archive(self):
+        """Tests that regular files of a compressed tar archive are streamed with normalized paths."""
+        archive_path = os.path.join(self.temp_dir.name, "input.tar.gz")
+        with tarfile.open(archive_path, "w:gz") as archive:
+            for name, content in self.members.items():
+                info = tarfile.TarInfo(f"./{name}")
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        self.assertTrue(utils.is_archive(archive_path))
+        self.assertEqual(dict(utils.iter_archive_members(archive_path)), self.members)
+
+    def test_filtered_members(self):
+        """Tests that only members selected by the file filter are yielded."""
+        archive_path = os.path.join(self.temp_dir.name, "input.zip")
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            for name, content in self.members.items():
+                archive.writestr(name, content)
+        members = dict(utils.iter_archive_members(archive_path, utils.FileFilter(max_depth=1)))
+        self.assertEqual(members, {"procs/a.sql": b"SELECT 1"})
+
+    def test_directory_is_not_archive(self):
+        """Tests that a directory is not treated as an archive."""
+        self.assertFalse(utils.is_archive(self.temp_dir.name))
+
+
+
+class FakeTable:
+    def __init__(self, columns):
+        self.columns = columns
+
+
+class FakeSpark:
+    """A stand-in for a Spark session with a single Delta table whose columns are changed by ALTER TABLE."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.statements = []
+
+    def table(self, name):
+        return FakeTable(self.columns)
+
+    def sql(self, statement):
+        self.statements.append(statement)
+        definitions = statement[statement.index("(") + 1:statement.rindex(")")]
+        self.columns.extend(definition.split()[0] for definition in definitions.split(", "))
+
+
+class TestAddMissingColumns(unittest.TestCase):
+    # The result table columns before encoding detection, near-duplicate detection and incremental syntax checking
+    OLD_COLUMNS = [
+        "input_file_number", "input_file_path", "input_file_encoding", "tiktoken_encoding",
+        "input_file_token_count", "input_file_content", "is_conversion_target", "result_content",
+    ]
+    RESULT_COLUMNS = [
+        ("input_file_number", "int"),
+        ("input_file_path", "string"),
+        ("input_file_encoding", "string"),
+        ("input_file_encoding_confidence", "double"),
+        ("tiktoken_encoding", "string"),
+        ("input_file_token_count", "int"),
+        ("input_file_content", "string"),
+        ("is_conversion_target", "boolean"),
+        ("similarity_cluster_id", "int"),
+        ("result_content", "string"),
+        ("result_sql_parse_errors", "array<string>"),
+    ]
+
+    def test_adds_all_missing_columns_to_old_table(self):
+        spark = FakeSpark(self.OLD_COLUMNS)
+        added_columns = utils.add_missing_columns(spark, "catalog.schema.result", self.RESULT_COLUMNS)
+
+        self.assertEqual(added_columns,
+                         ["input_file_encoding_confidence", "similarity_cluster_id", "result_sql_parse_errors"])
+        self.assertEqual(spark.statements, [
+            "ALTER TABLE catalog.schema.result ADD COLUMNS (input_file_encoding_confidence double, "
+            "similarity_cluster_id int, result_sql_parse_errors array<string>)"])
+        self.assertEqual(set(spark.columns), {name for name, _ in self.RESULT_COLUMNS})
+
+    def test_up_to_date_table_is_not_altered(self):
+        spark = FakeSpark([name for name, _ in self.RESULT_COLUMNS])
+        self.assertEqual(utils.add_missing_columns(spark, "result", self.RESULT_COLUMNS), [])
+        self.assertEqual(spark.statements, [])
+
+if __name__ == "__main__":
+    unittest.main()